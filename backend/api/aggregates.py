@@ -0,0 +1,85 @@
+"""
+Statistics across a user's stored datasets, merged from each dataset's exact
+sums and counts rather than its rounded averages. The whole history is read
+from the user's running totals (UserAggregate); a selection is summed over
+the selected rows in the database. Neither reparses a file or loads a summary.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+
+from .models import METRIC_TOTALS, TOTAL_FIELDS, DatasetDistribution, EquipmentDataset, UserAggregate
+
+DISTRIBUTION_LIMIT = 50
+
+
+def combine(totals):
+    """Averages and totals from summed columns (a UserAggregate row or an aggregate() result)."""
+    averages, merged = {}, {}
+    for key, (sum_field, count_field) in METRIC_TOTALS.items():
+        total, count = totals[sum_field] or 0, totals[count_field] or 0
+        averages[key] = total / count if count else None
+        merged[key] = {"sum": total, "count": count}
+    return {
+        "dataset_count": totals['dataset_count'] or 0,
+        "total_count": totals['total_count'] or 0,
+        "averages": averages,
+        "totals": merged,
+    }
+
+
+def user_totals(user_id):
+    """Totals over the user's whole history: one row read, built on first use."""
+    totals = UserAggregate.objects.filter(user_id=user_id).values('dataset_count', *TOTAL_FIELDS).first()
+    if totals is None:
+        try:
+            with transaction.atomic():
+                UserAggregate.objects.rebuild(user_id)
+        except IntegrityError:
+            # Built concurrently by an upload or another read.
+            pass
+        totals = UserAggregate.objects.filter(user_id=user_id).values('dataset_count', *TOTAL_FIELDS).first()
+    return combine(totals)
+
+
+def select(user_id, last=None, ids=None, since=None, until=None):
+    """The user's datasets matching every given filter: newest `last`, ids, and an upload window."""
+    datasets = EquipmentDataset.objects.filter(user_id=user_id)
+    if ids is not None:
+        datasets = datasets.filter(pk__in=ids)
+    if since is not None:
+        datasets = datasets.filter(upload_date__gte=since)
+    if until is not None:
+        datasets = datasets.filter(upload_date__lt=until)
+    if last is not None:
+        newest_first = datasets.order_by('-upload_date', '-pk')
+        datasets = EquipmentDataset.objects.filter(user_id=user_id, pk__in=newest_first.values('pk')[:last])
+    return datasets
+
+
+def selection_totals(datasets):
+    return combine(datasets.order_by().aggregate(
+        dataset_count=Count('pk'), **{field: Sum(field) for field in TOTAL_FIELDS}
+    ))
+
+
+def breakdown(datasets):
+    """Per-dataset figures for comparisons, newest first, with unrounded averages."""
+    rows = datasets.order_by('-upload_date', '-pk').values('id', 'file_name', 'upload_date', *TOTAL_FIELDS)
+    return [
+        {
+            "id": row['id'],
+            "file_name": row['file_name'],
+            "upload_date": row['upload_date'],
+            **{key: value for key, value in combine({**row, 'dataset_count': 1}).items() if key != 'dataset_count'},
+        }
+        for row in rows
+    ]
+
+
+def distribution(datasets, limit=DISTRIBUTION_LIMIT):
+    """Type counts summed across the datasets, largest first."""
+    rows = (
+        DatasetDistribution.objects.filter(dataset__in=datasets.values('pk'))
+        .values('category').annotate(total=Sum('count')).order_by('-total', 'category')[:limit]
+    )
+    return {row['category']: row['total'] for row in rows}
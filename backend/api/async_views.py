@@ -0,0 +1,249 @@
+"""
+ASGI-native versions of the upload, job, history and report endpoints, served
+under /api/async/. Under an ASGI server they hold no thread while waiting:
+the server receives the request body before the view runs, the ORM and cache
+calls are awaited, and multipart parsing, queueing and report drawing run
+in worker threads. The event stream lives here too, since only an ASGI
+server can hold thousands of them open.
+"""
+import copy
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from . import authentication, events, history, reports
+from .fields import FieldsError, requested_fields, select_fields
+from .jobs import enqueue_upload
+from .models import AuthToken, EquipmentDataset, UploadJob
+from .renderers import negotiated_response
+from .uploadhandlers import HashingUploadHandler
+from .views import serialize_job
+
+logger = logging.getLogger(__name__)
+
+# A job waited on without events is read again this often: jobs run by
+# external workers or other server processes publish none here.
+JOB_RECHECK_SECONDS = 2
+
+
+async def authenticate(request):
+    """
+    The user for an 'Authorization: Token <key>' header, as
+    CachedTokenAuthentication would find it; a warm token stays on the event loop.
+    """
+    key = authentication.token_key(request)
+    if key is None:
+        return None
+    resolved = authentication.resolve_cached(key) or await sync_to_async(authentication.resolve)(key)
+    if resolved is None:
+        return None
+    token, replacement = resolved
+    if replacement is not None:
+        request.rotated_token = replacement
+    if not AuthToken.user.is_cached(token):
+        # From the shared cache, which keeps no users; kept on the token for its next request here.
+        try:
+            token.user = await User.objects.aget(pk=token.user_id)
+        except User.DoesNotExist:
+            return None
+    return copy.copy(token.user)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """Token-authenticated async view; handlers find the user on request.user."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await authenticate(request)
+        if user is None:
+            response = JsonResponse({"error": "Authentication credentials were not provided or are invalid."}, status=401)
+            response['WWW-Authenticate'] = 'Token'
+            return response
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncUploadView(AsyncAPIView):
+    """Same contract as UploadView: 202 with a job to poll, or 201 from the summary cache."""
+
+    async def post(self, request):
+        logger.info(f"Upload request from user: {request.user.username}")
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return negotiated_response(request, {"error": str(e)}, status=400)
+
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
+        # Multipart parsing writes the file out to disk; keep it off the event loop.
+        files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+
+        if 'file' not in files:
+            return negotiated_response(request, {"error": "No file provided"}, status=400)
+
+        file_obj = files['file']
+        digest = hasher.digests.get('file', [''])[0]
+
+        try:
+            job = await sync_to_async(enqueue_upload)(request.user, file_obj, digest)
+            if job.status == UploadJob.SUCCEEDED:
+                logger.info(f"Served file {file_obj.name} for user {request.user.username} from summary cache")
+                return negotiated_response(request, serialize_job(job, fields), status=201)
+
+            logger.info(f"Queued file {file_obj.name} for user {request.user.username} as job {job.id}")
+            return negotiated_response(request, serialize_job(job, fields), status=202)
+        except Exception as e:
+            logger.error(f"Upload error for user {request.user.id}: {str(e)}")
+            return negotiated_response(request, {"error": "Failed to queue file"}, status=500)
+
+
+class AsyncJobDetailView(AsyncAPIView):
+    """
+    Status of one upload job, as JobDetailView gives it. ?wait=<seconds>
+    long-polls until the job finishes or its progress moves past
+    ?progress=<n>, for at most JOB_LONG_POLL_SECONDS, woken by the job's
+    events rather than by reading it over and over.
+    """
+
+    async def get(self, request, job_id):
+        try:
+            fields = requested_fields(request)
+            wait = min(float(request.GET.get('wait', 0)), settings.JOB_LONG_POLL_SECONDS)
+            seen_progress = request.GET.get('progress')
+            seen_progress = int(seen_progress) if seen_progress is not None else None
+        except FieldsError as e:
+            return negotiated_response(request, {"error": str(e)}, status=400)
+        except ValueError:
+            return negotiated_response(request, {"error": "wait and progress must be numbers"}, status=400)
+
+        jobs = UploadJob.objects.filter(user=request.user)
+        # Subscribed before the first read, so an event published in between is not missed.
+        subscription = events.broker.subscribe(request.user.id) if wait > 0 else None
+        try:
+            job = await jobs.filter(pk=job_id).afirst()
+            if job is not None and seen_progress is None:
+                seen_progress = job.progress
+            deadline = time.monotonic() + wait
+            while job is not None and job.status not in UploadJob.FINISHED and job.progress <= seen_progress:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                event = await subscription.get(min(remaining, JOB_RECHECK_SECONDS))
+                if event is not None and event.name != events.RESYNC and event.data.get('job_id') != str(job_id):
+                    continue
+                job = await jobs.filter(pk=job_id).afirst()
+        finally:
+            if subscription is not None:
+                subscription.close()
+
+        if job is None:
+            return negotiated_response(request, {"error": "Job not found"}, status=404)
+        return negotiated_response(request, serialize_job(job, fields))
+
+
+class AsyncHistoryView(AsyncAPIView):
+
+    async def get(self, request):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return negotiated_response(request, {"error": str(e)}, status=400)
+
+        listing = await history.aget_listing(request.user.id)
+        if history.is_not_modified(request, listing):
+            response = HttpResponse(status=304)
+        else:
+            response = negotiated_response(request, [select_fields(entry, fields) for entry in listing['data']])
+
+        response['ETag'] = listing['etag']
+        response['Last-Modified'] = listing['last_modified']
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def _get_report(dataset_id):
+    # Runs on a pool thread, which keeps no Django request cycle to close its connection.
+    try:
+        return reports.get_report(dataset_id)
+    finally:
+        connection.close()
+
+
+class AsyncDownloadPDFView(AsyncAPIView):
+
+    async def get(self, request, dataset_id=None):
+        datasets = EquipmentDataset.objects.filter(user=request.user).only('id', 'file_name')
+        if dataset_id:
+            dataset = await datasets.filter(pk=dataset_id).afirst()
+        else:
+            dataset = await datasets.order_by('-upload_date').afirst()
+        if not dataset:
+            return JsonResponse({"error": "No data found"}, status=404)
+
+        try:
+            # ReportLab is CPU-bound; a cold report is drawn in a worker thread.
+            path = await sync_to_async(_get_report, thread_sensitive=False)(dataset.pk)
+        except Exception as e:
+            logger.error(f"PDF generation error for user {request.user.id}: {str(e)}")
+            return JsonResponse({"error": "Failed to generate PDF"}, status=500)
+
+        return reports.report_response(
+            request, path, f"Report_{dataset.file_name}.pdf", reports.report_etag(dataset.pk)
+        )
+
+
+def _close_connection():
+    # A function, so `connection` is looked up on the worker thread that owns it.
+    connection.close()
+
+
+class AsyncEventsView(AsyncAPIView):
+    """
+    Server-sent events for the user: dataset.created and dataset.deleted
+    (with the sync cursor of the change), job.progress and job.finished, and
+    resync when the client must re-read its state. Reconnects resume from
+    Last-Event-ID. A comment line goes out every EVENTS_HEARTBEAT_SECONDS so
+    proxies keep the connection and dead clients are noticed. An open stream
+    keeps the idle worker thread Django gives each ASGI request, but no
+    database connection.
+    """
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # Django would buffer the endless stream under WSGI and never send it.
+            return JsonResponse({"error": "Event streams need the ASGI server"}, status=501)
+        if events.broker.subscriber_count(request.user.id) >= settings.EVENTS_MAX_STREAMS_PER_USER:
+            return JsonResponse({"error": "Too many open event streams"}, status=429)
+
+        # Authenticating opened a database connection on this request's thread; an
+        # open stream should not hold one for hours.
+        await sync_to_async(_close_connection)()
+        stream = self.stream(request.user.id, request.headers.get('Last-Event-ID'))
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    async def stream(user_id, last_event_id):
+        heartbeat = settings.EVENTS_HEARTBEAT_SECONDS
+        # Subscribed once streaming starts, so the finally below always runs.
+        subscription = events.broker.subscribe(user_id, last_event_id)
+        try:
+            # Browsers wait this long before reconnecting a dropped stream.
+            yield "retry: 3000\n\n"
+            while True:
+                event = await subscription.get(heartbeat)
+                yield event.encode() if event is not None else ":\n\n"
+        finally:
+            # Also on client disconnect, which Django raises here as a cancellation.
+            subscription.close()
@@ -0,0 +1,272 @@
+"""
+Token authentication without a database query per request.
+
+Login hands out a random key (AuthToken.objects.issue) and keeps only its
+SHA-256. Tokens resolved by a request are kept in a per-process LRU for
+AUTH_CACHE_SECONDS and, with AUTH_CACHE_SHARED, in the Django cache too, so a
+warm request authenticates from memory. The shared cache holds no users, only
+what deciding on a token takes (its user's id and whether it is active, and
+its dates); the user is loaded when a view first asks for it. Deleting a token (logout, expiry
+pruning) or saving or deleting its user drops its entries from this process
+and the shared cache at once; other processes' LRUs let go within
+AUTH_CACHE_SECONDS.
+
+A token older than AUTH_TOKEN_ROTATE_SECONDS is replaced on its next use;
+RotatedTokenMiddleware hands the new key back in the X-Auth-Token header.
+"""
+import copy
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication
+
+from .models import AuthToken
+
+ROTATED_HEADER = 'X-Auth-Token'
+
+# Hits (this process's LRU), shared hits and misses (database lookups) seen by this process.
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _shared_key(digest):
+    return f"auth:token:{digest}"
+
+
+def _shared_entry(token):
+    return {
+        "user_id": token.user_id,
+        "is_active": token.user.is_active,
+        "created_at": token.created_at,
+        "expires_at": token.expires_at,
+        "replaced_at": token.replaced_at,
+    }
+
+
+def _from_shared_entry(digest, entry):
+    token = AuthToken(
+        pk=digest, user_id=entry["user_id"], created_at=entry["created_at"],
+        expires_at=entry["expires_at"], replaced_at=entry["replaced_at"],
+    )
+    token.user_is_active = entry["is_active"]
+    return token
+
+
+class TokenLRU:
+    """Resolved tokens by digest, each kept for AUTH_CACHE_SECONDS, the least recently used evicted first."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            stored_at, token = entry
+            if time.monotonic() - stored_at > settings.AUTH_CACHE_SECONDS:
+                self._remove(digest)
+                return None
+            self._entries.move_to_end(digest)
+            return token
+
+    def put(self, token):
+        with self._lock:
+            self._remove(token.pk)
+            self._entries[token.pk] = (time.monotonic(), token)
+            self._by_user.setdefault(token.user_id, set()).add(token.pk)
+            while len(self._entries) > settings.AUTH_CACHE_MAX_ENTRIES:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, digest):
+        with self._lock:
+            self._remove(digest)
+
+    def discard_user(self, user_id):
+        with self._lock:
+            for digest in list(self._by_user.get(user_id, ())):
+                self._remove(digest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        digests = self._by_user.get(entry[1].user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[entry[1].user_id]
+
+
+_local = TokenLRU()
+
+
+def token_key(request):
+    """The key of an 'Authorization: Token <key>' header, or None."""
+    auth = request.headers.get('Authorization', '').split()
+    if len(auth) != 2 or auth[0].lower() != 'token':
+        return None
+    return auth[1]
+
+
+def _live(token):
+    # Tokens from the shared cache say whether their user is active until the user is loaded.
+    active = token.user.is_active if AuthToken.user.is_cached(token) else token.user_is_active
+    return token.expires_at > timezone.now() and active
+
+
+def _due_for_rotation(token):
+    age = timezone.now() - token.created_at
+    return token.replaced_at is None and age > timedelta(seconds=settings.AUTH_TOKEN_ROTATE_SECONDS)
+
+
+def resolve_cached(key):
+    """
+    resolve() from this process's LRU alone: no I/O, so async views can call
+    it on the event loop. None when resolve() has to run.
+    """
+    token = _local.get(AuthToken.digest_of(key))
+    if token is None or not _live(token) or _due_for_rotation(token):
+        return None
+    _count('hits')
+    return token, None
+
+
+def resolve(key):
+    """
+    The live token for a key and, if it was due for rotation, its
+    replacement's key; None for an unknown, expired or disabled one.
+    """
+    digest = AuthToken.digest_of(key)
+    token = _local.get(digest)
+    if token is not None:
+        _count('hits')
+    elif settings.AUTH_CACHE_SHARED and (entry := cache.get(_shared_key(digest))) is not None:
+        _count('shared_hits')
+        token = _from_shared_entry(digest, entry)
+        _local.put(token)
+    else:
+        _count('misses')
+        token = AuthToken.objects.select_related('user').filter(pk=digest).first()
+        if token is None:
+            return None
+        _local.put(token)
+        if settings.AUTH_CACHE_SHARED:
+            cache.set(_shared_key(digest), _shared_entry(token), settings.AUTH_SHARED_CACHE_TIMEOUT)
+
+    if not _live(token):
+        return None
+    replacement = None
+    if _due_for_rotation(token):
+        rotated = AuthToken.objects.rotate(token)
+        # Replaced here or elsewhere, the cached copy no longer says so.
+        invalidate(digest)
+        if rotated is not None:
+            replacement = rotated[1]
+    return token, replacement
+
+
+def invalidate(digest):
+    """Forget a token here and in the shared cache, as after it is deleted or replaced."""
+    _local.discard(digest)
+    if settings.AUTH_CACHE_SHARED:
+        cache.delete(_shared_key(digest))
+
+
+def invalidate_user(user_id):
+    """Forget every token of a user, as after the user is saved (deactivated, say) or deleted."""
+    _local.discard_user(user_id)
+    if settings.AUTH_CACHE_SHARED:
+        digests = AuthToken.objects.filter(user_id=user_id).values_list('pk', flat=True)
+        cache.delete_many([_shared_key(digest) for digest in digests])
+
+
+def stats():
+    with _counters_lock:
+        hits, shared_hits, misses = _counters['hits'], _counters['shared_hits'], _counters['misses']
+    return {
+        "hits": hits,
+        "shared_hits": shared_hits,
+        "misses": misses,
+        "hit_ratio": round((hits + shared_hits) / (hits + shared_hits + misses), 4) if hits + shared_hits + misses else 0,
+        "entries": len(_local),
+    }
+
+
+class CachedTokenAuthentication(BaseAuthentication):
+    """
+    DRF authentication for 'Authorization: Token <key>' headers, answered from
+    the token caches when warm. request.auth is the AuthToken.
+    """
+    keyword = 'Token'
+
+    def authenticate(self, request):
+        key = token_key(request)
+        if key is None:
+            return None
+        resolved = resolve(key)
+        if resolved is None:
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+        token, replacement = resolved
+        try:
+            user = token.user
+        except User.DoesNotExist:
+            # Deleted since another process shared the token.
+            raise exceptions.AuthenticationFailed('Invalid or expired token.')
+        if replacement is not None:
+            request._request.rotated_token = replacement
+        # A copy: cached users are shared by every request the token makes.
+        return copy.copy(user), token
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class RotatedTokenMiddleware:
+    """Hands the key of a token replaced during the request back to the client, in X-Auth-Token."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.attach(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.attach(request, await self.get_response(request))
+
+    @staticmethod
+    def attach(request, response):
+        replacement = getattr(request, 'rotated_token', None)
+        if replacement is not None:
+            response[ROTATED_HEADER] = replacement
+        return response
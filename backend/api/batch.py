@@ -0,0 +1,199 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import transaction
+
+from . import columnar, history, metrics, summary_cache
+from .models import EquipmentDataset
+from .retention import lock_user, trim_history
+from .utils import process_csv_path, resolve_engine
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BatchError(ValueError):
+    """The batch as a whole cannot be accepted."""
+
+
+def get_pool():
+    """The process-wide pool that parses batch files, one file per task."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.BATCH_UPLOAD_WORKERS)
+        return _pool
+
+
+def reset_pool():
+    """Drop a pool whose worker died, so the next batch starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+class BatchFile:
+    """One CSV of a batch, spooled to disk with its SHA-256 digest."""
+
+    def __init__(self, name, path, digest):
+        self.name = name
+        self.path = path
+        self.digest = digest
+        self.summary = None
+        self.rollups = []
+        self.column_store = None
+        self.error = None
+        self.cached = False
+        self.dataset_id = None
+
+
+def _copy_hashed(source, path):
+    digest = hashlib.sha256()
+    with open(path, 'wb') as destination:
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(block)
+            destination.write(block)
+    return digest.hexdigest()
+
+
+def spool_batch(uploads, digests, workdir):
+    """
+    Write every uploaded CSV into workdir, expanding zip archives into their
+    CSV members. `digests` are the upload handler's per-file SHA-256s, in order.
+    """
+    files = []
+    total = 0
+    for upload, digest in zip(uploads, digests):
+        if upload.name.lower().endswith('.zip'):
+            try:
+                archive = zipfile.ZipFile(upload)
+            except zipfile.BadZipFile:
+                raise BatchError(f"{upload.name} is not a valid zip archive")
+            with archive:
+                members = [
+                    member for member in archive.infolist()
+                    if not member.is_dir()
+                    and member.filename.lower().endswith('.csv')
+                    and not member.filename.startswith('__MACOSX/')
+                ]
+                for member in members:
+                    # Checked against the declared sizes before anything is inflated.
+                    total += member.file_size
+                    if total > settings.BATCH_UPLOAD_MAX_BYTES:
+                        raise BatchError("The batch is larger than the server accepts once unzipped")
+                for member in members:
+                    path = os.path.join(workdir, f"{len(files)}.csv")
+                    with archive.open(member) as source:
+                        member_digest = _copy_hashed(source, path)
+                    files.append(BatchFile(os.path.basename(member.filename), path, member_digest))
+        else:
+            path = os.path.join(workdir, f"{len(files)}.csv")
+            with open(path, 'wb') as destination:
+                for chunk in upload.chunks():
+                    destination.write(chunk)
+            total += upload.size
+            files.append(BatchFile(upload.name, path, digest))
+
+        if len(files) > settings.BATCH_UPLOAD_MAX_FILES:
+            raise BatchError(f"A batch may hold at most {settings.BATCH_UPLOAD_MAX_FILES} CSV files")
+    if not files:
+        raise BatchError("No CSV files found in the upload")
+    return files
+
+
+def process_batch(user, uploads, digests):
+    """
+    Summarise every CSV of a batch and store the successful ones in one
+    transaction. Content seen before is answered from the summary cache;
+    the rest is parsed in parallel on the process pool.
+    Returns the BatchFiles, each with a summary and dataset id, or an error.
+    """
+    workdir = os.path.join(settings.UPLOAD_SPOOL_DIR, f"batch-{uuid.uuid4().hex}")
+    os.makedirs(workdir)
+    try:
+        files = spool_batch(uploads, digests, workdir)
+
+        pending = []
+        for batch_file in files:
+            cached = summary_cache.reuse(batch_file.digest)
+            if cached is not None:
+                batch_file.summary, batch_file.rollups, batch_file.column_store = cached
+                batch_file.cached = True
+            else:
+                pending.append(batch_file)
+
+        # Files with the same content are parsed once.
+        groups = {}
+        for batch_file in pending:
+            groups.setdefault(batch_file.digest or id(batch_file), []).append(batch_file)
+
+        # Resolved here so pool processes never need Django settings.
+        engine = resolve_engine()
+        store_root = settings.COLUMN_STORE_DIR if columnar.enabled() else None
+        futures = [
+            (group, get_pool().submit(
+                process_csv_path, group[0].path, engine, store_root, settings.COLUMN_STORE_DATASET_MAX_BYTES
+            ))
+            for group in groups.values()
+        ]
+        for group, future in futures:
+            summary, rollups, column_store, error = None, [], None, None
+            try:
+                summary, rollups, staged, timings = future.result()
+                metrics.record_parse(timings)
+                if staged:
+                    column_store = columnar.commit(staged, columnar.store_key(group[0].digest))
+                summary_cache.store(group[0].digest, summary, rollups)
+            except BrokenProcessPool:
+                reset_pool()
+                error = "CSV Processing Error: the parser process stopped unexpectedly"
+            except Exception as e:
+                error = str(e)
+            for batch_file in group:
+                batch_file.summary, batch_file.rollups, batch_file.error = summary, rollups, error
+                batch_file.column_store = column_store
+
+        stored = [batch_file for batch_file in files if batch_file.summary is not None]
+        try:
+            store_batch(user, stored)
+        except Exception:
+            for key in {batch_file.column_store['key'] for batch_file in stored if batch_file.column_store}:
+                columnar.release(key)
+            raise
+        return files
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def store_batch(user, files):
+    """Insert the batch's datasets with bulk_create, then trim the history once."""
+    if not files:
+        return
+    with transaction.atomic():
+        datasets = EquipmentDataset.objects.bulk_create_from_summaries(
+            user, [
+                (batch_file.name, batch_file.summary, batch_file.rollups, batch_file.column_store)
+                for batch_file in files
+            ]
+        )
+        lock_user(user.pk)
+        trim_history(user.pk)
+        # Datasets the retention limit removed straight away keep no id.
+        kept = set(EquipmentDataset.objects.filter(pk__in=[d.pk for d in datasets]).values_list('pk', flat=True))
+        for batch_file, dataset in zip(files, datasets):
+            batch_file.dataset_id = dataset.pk if dataset.pk in kept else None
+        # bulk_create sends no post_save, so the history signal never fires.
+        transaction.on_commit(lambda: history.invalidate(user.pk))
+    logger.info(f"Stored {len(files)} dataset(s) from a batch for user {user.username}")
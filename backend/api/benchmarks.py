@@ -0,0 +1,247 @@
+"""
+The benchmark suite behind `manage.py bench` and its test cases: CSV parsing
+and the upload, history and PDF endpoints, driven through the Django test
+client on seeded synthetic files (see api.synthetic) at several sizes and
+concurrency levels. Each case comes out as timing figures, which compare()
+checks against an earlier run's.
+
+The commands run it, like the simulations in api.simulations, inside
+scratch_database(): a throwaway copy of the configured database, made the
+way `manage.py test` makes one, with scratch_files() and a local cache, so
+nothing they create reaches real data.
+"""
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_databases, teardown_databases
+
+from . import reports
+from .models import AuthToken
+from .services import store_dataset
+from .synthetic import equipment_csv, type_labels, write_equipment_csv
+from .utils import process_csv, resolve_engine
+
+SUITES = ('parse', 'upload', 'history', 'pdf')
+
+# Files parsed at every size: (name, Type labels, malformed line share, encoding, accented labels).
+VARIANTS = [
+    ('plain', 6, 0.0, 'utf-8', False),
+    ('types-1000', 1000, 0.0, 'utf-8', False),
+    ('malformed-5pct', 6, 0.05, 'utf-8', False),
+    ('bom-accented', 6, 0.0, 'utf-8-sig', True),
+]
+
+# Distribution sizes of the datasets whose reports are drawn.
+REPORT_TYPES = (6, 500)
+
+
+class BenchError(RuntimeError):
+    """An operation under benchmark failed, so its timings mean nothing."""
+
+
+@contextmanager
+def scratch_files():
+    """Spool, report and column directories in a temporary directory for the block, and a local cache."""
+    with tempfile.TemporaryDirectory() as workdir:
+        with override_settings(
+            UPLOAD_SPOOL_DIR=os.path.join(workdir, 'spool'),
+            REPORT_CACHE_DIR=os.path.join(workdir, 'reports'),
+            COLUMN_STORE_DIR=os.path.join(workdir, 'columns'),
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        ):
+            yield workdir
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """A throwaway copy of the configured database for the block, with scratch_files()."""
+    databases = setup_databases(verbosity, interactive=False)
+    try:
+        with scratch_files() as workdir:
+            yield workdir
+    finally:
+        teardown_databases(databases, verbosity)
+
+
+def summarize_samples(samples, throughput=None):
+    """Figures for one case, in seconds, and its throughput (work done per second) when given."""
+    ordered = sorted(samples)
+    figures = {
+        "samples": len(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "min": ordered[0],
+        "max": ordered[-1],
+    }
+    if throughput is not None:
+        figures["throughput"] = throughput
+    return figures
+
+
+def compare(results, baseline, threshold):
+    """(case, change in p50) for cases in both runs, and the cases that slowed down by more than threshold."""
+    changes = []
+    for case, figures in results.items():
+        before = baseline.get(case)
+        if before and before['p50'] > 0:
+            changes.append((case, figures['p50'] / before['p50'] - 1))
+    return changes, [(case, change) for case, change in changes if change > threshold]
+
+
+class BenchSuite:
+    """
+    One run of the suites as `user`, whose uploads, datasets and reports it
+    leaves for the caller to remove. `results` maps each case to its figures;
+    log, if given, gets a line per case.
+    """
+
+    def __init__(self, user, rows, concurrency, repeat=5, seed=0, log=None):
+        self.user = user
+        self.token = AuthToken.objects.issue(user)[1]
+        self.rows = rows
+        self.concurrency = concurrency
+        self.repeat = repeat
+        self.seed = seed
+        self.log = log
+        self.results = {}
+
+    def run(self, suites=SUITES):
+        with tempfile.TemporaryDirectory() as workdir:
+            for suite in suites:
+                getattr(self, f"bench_{suite}")(workdir)
+        return self.results
+
+    def meta(self, suites=SUITES):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            "started": datetime.now(timezone.utc).isoformat(),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": connection.vendor,
+            "engine": resolve_engine(),
+            "options": {
+                "suites": list(suites), "rows": self.rows, "concurrency": self.concurrency,
+                "repeat": self.repeat, "seed": self.seed,
+            },
+        }
+
+    def record(self, case, samples, throughput=None, unit=''):
+        figures = self.results[case] = summarize_samples(samples, throughput)
+        if self.log:
+            rate = f"  {throughput:12,.0f} {unit}" if throughput is not None else ''
+            self.log(f"{case:<44} p50 {figures['p50'] * 1000:9.2f}ms  p95 {figures['p95'] * 1000:9.2f}ms{rate}")
+
+    def clients(self, concurrency, work):
+        """
+        Run work(client) `repeat` times on each of `concurrency` threads, each
+        with its own test client. Returns every call's seconds and the wall time.
+        """
+        def worker():
+            client = Client(HTTP_AUTHORIZATION=f"Token {self.token}")
+            try:
+                timings = []
+                for _ in range(self.repeat):
+                    started = time.perf_counter()
+                    work(client)
+                    timings.append(time.perf_counter() - started)
+                return timings
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [pool.submit(worker) for _ in range(concurrency)]
+            samples = [timing for future in futures for timing in future.result()]
+        return samples, time.perf_counter() - started
+
+    def bench_parse(self, workdir):
+        engine = resolve_engine()
+        for rows in self.rows:
+            for name, types, malformed, encoding, accented in VARIANTS:
+                path = write_equipment_csv(
+                    os.path.join(workdir, f"{name}-{rows}.csv"), rows, seed=self.seed,
+                    types=type_labels(types, accented), malformed=malformed, encoding=encoding,
+                )
+                samples = []
+                for _ in range(self.repeat):
+                    with open(path, 'rb') as handle:
+                        started = time.perf_counter()
+                        process_csv(File(handle), engine=engine)
+                        samples.append(time.perf_counter() - started)
+                os.remove(path)
+                self.record(f"parse/{name}/rows={rows}", samples, rows / statistics.median(samples), 'rows/s')
+
+    def bench_upload(self, workdir):
+        for rows in self.rows:
+            body = equipment_csv(rows, seed=self.seed)
+            for concurrency in self.concurrency:
+                def upload(client):
+                    # One extra row makes every upload new to the summary cache.
+                    content = body + f"Bench-{uuid.uuid4().hex},Pump,100,6,110\n".encode()
+                    response = client.post('/api/upload/', {'file': ContentFile(content, name='bench.csv')})
+                    job = response.json()
+                    if response.status_code >= 400:
+                        raise BenchError(f"Upload failed: {job}")
+                    while job['status'] not in ('succeeded', 'failed'):
+                        job = client.get(f"/api/async/jobs/{job['job_id']}/",
+                                         {'wait': 20, 'progress': job['progress']}).json()
+                    if job['status'] == 'failed':
+                        raise BenchError(f"Upload job failed: {job.get('error')}")
+
+                samples, wall = self.clients(concurrency, upload)
+                self.record(f"upload/rows={rows}/c={concurrency}", samples, len(samples) / wall, 'uploads/s')
+
+    def bench_history(self, workdir):
+        for n in range(settings.DATASET_RETENTION_LIMIT):
+            store_dataset(self.user, f"history-{n}.csv", self.report_summary(6))
+        for concurrency in self.concurrency:
+            samples, wall = self.clients(concurrency, lambda client: client.get('/api/history/'))
+            self.record(f"history/c={concurrency}", samples, len(samples) / wall, 'req/s')
+
+    def bench_pdf(self, workdir):
+        for types in REPORT_TYPES:
+            dataset = store_dataset(self.user, f"report-{types}.csv", self.report_summary(types))
+            url = f"/api/download-pdf/{dataset.pk}/"
+
+            def cold(client):
+                reports.delete_report(dataset.pk)
+                b''.join(client.get(url).streaming_content)
+
+            samples, _ = self.clients(1, cold)
+            self.record(f"pdf/cold/types={types}", samples)
+            for concurrency in self.concurrency:
+                samples, wall = self.clients(concurrency, lambda client: b''.join(client.get(url).streaming_content))
+                self.record(f"pdf/warm/types={types}/c={concurrency}", samples, len(samples) / wall, 'req/s')
+
+    def report_summary(self, types):
+        labels = type_labels(types)
+        return {
+            "total_count": 100_000 * types,
+            "averages": {"avg_flowrate": 119.8, "avg_pressure": 6.11, "avg_temp": 117.47},
+            "distribution": {label: 100_000 for label in labels},
+            "raw_data": [
+                {"Equipment Name": f"{label}-{n}", "Type": label, "Flowrate": 120, "Pressure": 5.2, "Temperature": 110}
+                for n, label in enumerate(labels[:10])
+            ],
+        }
@@ -0,0 +1,216 @@
+import hashlib
+import io
+import os
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .jobs import dispatch, spool_path
+from .models import ChunkedUpload, UploadChunk, UploadJob
+
+# Smaller chunks would cost more in per-request overhead than they save on retries.
+MIN_CHUNK_SIZE = 64 * 1024
+
+
+class ChunksPending(IOError):
+    """The chunk a parse needs next has not arrived; its job goes back to waiting."""
+
+    def __init__(self, index):
+        super().__init__(f"Waiting for chunk {index}")
+        self.index = index
+
+
+def create_upload(user, file_name, total_size, chunk_size=None, sha256=''):
+    """
+    Start a resumable upload: preallocate its temp file and create its job,
+    waiting for chunks. A declared sha256 is only checked against the bytes
+    once they are in; it never stands in for them.
+    """
+    chunk_size = min(
+        max(chunk_size or settings.CHUNKED_UPLOAD_CHUNK_SIZE, MIN_CHUNK_SIZE),
+        settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE,
+    )
+
+    with transaction.atomic():
+        job = UploadJob(user=user, file_name=file_name, status=UploadJob.WAITING)
+        job.spool_path = spool_path(job.id)
+        job.save()
+
+        upload = ChunkedUpload.objects.create(
+            user=user,
+            job=job,
+            file_name=file_name,
+            total_size=total_size,
+            chunk_size=chunk_size,
+            temp_path=job.spool_path,
+            sha256=sha256,
+        )
+
+    os.makedirs(os.path.dirname(upload.temp_path), exist_ok=True)
+    with open(upload.temp_path, 'wb') as handle:
+        handle.truncate(total_size)
+    return upload
+
+
+def wake(upload):
+    """Queue the upload's job if it is waiting, and make sure a worker looks at it."""
+    UploadJob.objects.filter(pk=upload.job_id, status=UploadJob.WAITING).update(
+        status=UploadJob.QUEUED, updated_at=timezone.now()
+    )
+    # Claiming is atomic, so dispatching a job that already started is a no-op.
+    transaction.on_commit(lambda: dispatch(upload.job_id))
+
+
+def park(upload, index):
+    """
+    Put a job whose parse ran out of chunks back to waiting, freeing its
+    worker; it starts over when chunks arrive. Called by the job itself.
+    """
+    UploadJob.objects.filter(pk=upload.job_id, status=UploadJob.RUNNING).update(
+        status=UploadJob.WAITING, progress=0, updated_at=timezone.now()
+    )
+    # The chunk may have landed after the reader last looked, while the job was still running.
+    if UploadChunk.objects.filter(upload=upload, index=index).exists():
+        wake(upload)
+
+
+def expire_uploads(before):
+    """Abort uploads whose job has been waiting for chunks since before `before`. Returns how many."""
+    stale = ChunkedUpload.objects.filter(
+        job__status=UploadJob.WAITING, job__updated_at__lt=before
+    ).select_related('job')
+    count = 0
+    for upload in stale:
+        abort_upload(upload)
+        count += 1
+    return count
+
+
+def write_chunk(upload, index, stream):
+    """
+    Write one chunk at its offset in the temp file, then record it.
+    Re-sending a chunk is harmless, so clients can retry blindly.
+    """
+    expected = upload.expected_size(index)
+    written = 0
+    with open(upload.temp_path, 'r+b') as handle:
+        handle.seek(index * upload.chunk_size)
+        while True:
+            data = stream.read(1024 * 1024)
+            if not data:
+                break
+            written += len(data)
+            if written > expected:
+                raise ValueError(f"Chunk {index} is larger than {expected} bytes")
+            handle.write(data)
+
+    if written != expected:
+        raise ValueError(f"Chunk {index} must be {expected} bytes, got {written}")
+
+    # The row goes in only after the bytes are on disk, so readers never see a hole.
+    try:
+        UploadChunk.objects.create(upload=upload, index=index, size=written)
+    except IntegrityError:
+        pass
+
+    if settings.CHUNKED_UPLOAD_EAGER_PARSE:
+        wake(upload)
+    return written
+
+
+def finalize_upload(upload):
+    """Check every chunk is in and make sure the job is running. Returns the missing count."""
+    missing = upload.total_chunks - UploadChunk.objects.filter(upload=upload).count()
+    if missing == 0:
+        wake(upload)
+    return missing
+
+
+def received_indexes(upload):
+    return sorted(UploadChunk.objects.filter(upload=upload).values_list('index', flat=True))
+
+
+def received_ranges(indexes):
+    """Collapse sorted chunk indexes into inclusive [first, last] ranges."""
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def abort_upload(upload):
+    job = upload.job
+    upload.delete()
+    if job.status not in UploadJob.FINISHED:
+        UploadJob.objects.filter(pk=job.pk).update(status=UploadJob.FAILED, error="Upload was cancelled")
+    try:
+        os.remove(job.spool_path)
+    except OSError:
+        pass
+
+
+class ChunkedUploadReader(io.RawIOBase):
+    """
+    Reads an assembling upload front to back, waiting for chunks that have
+    not arrived yet, so parsing runs while the client is still sending. After
+    CHUNKED_UPLOAD_PARK_SECONDS without the chunk it needs it raises
+    ChunksPending rather than hold its worker. Hashes what it reads so the
+    result can be verified and cached.
+    """
+
+    def __init__(self, upload, poll_interval=0.5):
+        self.upload = upload
+        self.poll_interval = poll_interval
+        self._file = open(upload.temp_path, 'rb')
+        self._position = 0
+        self._received = set()
+        self._hash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def _wait_for(self, index):
+        deadline = time.monotonic() + settings.CHUNKED_UPLOAD_PARK_SECONDS
+        while index not in self._received:
+            if not ChunkedUpload.objects.filter(pk=self.upload.pk).exists():
+                raise IOError("Upload was cancelled")
+
+            received = set(UploadChunk.objects.filter(upload_id=self.upload.pk).values_list('index', flat=True))
+            if received - self._received:
+                deadline = time.monotonic() + settings.CHUNKED_UPLOAD_PARK_SECONDS
+            self._received = received
+
+            if index in received:
+                break
+            if time.monotonic() > deadline:
+                raise ChunksPending(index)
+            time.sleep(self.poll_interval)
+
+    def readinto(self, buffer):
+        remaining = self.upload.total_size - self._position
+        if remaining <= 0:
+            return 0
+
+        index = self._position // self.upload.chunk_size
+        self._wait_for(index)
+
+        chunk_end = (index + 1) * self.upload.chunk_size
+        size = min(len(buffer), chunk_end - self._position, remaining)
+        self._file.seek(self._position)
+        data = self._file.read(size)
+        buffer[:len(data)] = data
+        self._hash.update(data)
+        self._position += len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        super().close()
@@ -0,0 +1,507 @@
+"""
+Columnar copies of uploads, kept so later analyses read the data again
+without reparsing the CSV.
+
+A store is a directory under COLUMN_STORE_DIR with one .npy file per column
+and a manifest.json. Readings are float32; Type and Equipment Name are int32
+codes into a category list (-1 where missing); the timestamp is
+datetime64[ns] in UTC. Readers open the files with np.load(mmap_mode='r'),
+so a slice or a reduction pages in only what it touches.
+
+Stores are named after the upload's SHA-256 and shared by every dataset with
+the same content; the last dataset to go takes its store along. Sorting by a
+column builds a persistent index inside the store (see SortIndex). ColumnWriter
+needs no Django settings, so batch worker processes write stores too.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from .ingest import CATEGORY, DTYPES, FLOAT, TIMESTAMP, column_kinds, encode_column
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+STAGING_DIR = '.staging'
+INDEX_DIR = 'index'
+
+# Each .npy starts with a header of this size. It is reserved when the file
+# is opened and filled in at the end, once the row count is known.
+_HEADER_BYTES = 128
+
+# Stores kept open per process, so repeat reads reuse their maps and categories.
+OPEN_STORES = 16
+_open_stores = OrderedDict()
+_open_stores_lock = threading.Lock()
+
+# One lock per column being indexed, so simultaneous first sorts build it once.
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+# sweep() leaves younger directories alone: a staged store may still be
+# written, and a committed one may wait for its dataset's transaction.
+SWEEP_MIN_AGE_SECONDS = 6 * 3600
+
+
+def _npy_header(dtype, rows):
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)})
+    header = header.encode('latin1').ljust(_HEADER_BYTES - 11) + b'\n'
+    return np.lib.format.MAGIC_PREFIX + b'\x01\x00' + len(header).to_bytes(2, 'little') + header
+
+
+class ColumnWriter:
+    """
+    Appends the known columns of every parsed chunk to a store staged under
+    root; finish() completes it and returns its directory for commit().
+    Once the columns pass max_bytes they are dropped, and the store keeps
+    only a manifest that says so.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.directory = None
+        self.columns = None
+        self.handles = []
+        self.codes = []
+        self.rows = 0
+        self.bytes = 0
+        self.skipped = None
+
+    def _start(self, df):
+        staging = os.path.join(self.root, STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+        self.directory = tempfile.mkdtemp(dir=staging)
+        self.columns = []
+        if df is None:
+            return
+
+        for name, kind in column_kinds(list(df.columns)):
+            column = {"name": name, "kind": kind, "file": f"{len(self.columns)}.npy"}
+            if kind == CATEGORY:
+                column["categories"] = f"{len(self.columns)}.categories.json"
+            handle = open(os.path.join(self.directory, column['file']), 'wb')
+            handle.write(b'\0' * _HEADER_BYTES)
+            self.columns.append(column)
+            self.handles.append(handle)
+            self.codes.append({} if kind == CATEGORY else None)
+
+    def update(self, df):
+        if self.skipped:
+            return
+        if self.columns is None:
+            self._start(df)
+
+        for column, handle, codes in zip(self.columns, self.handles, self.codes):
+            encode_column(column['kind'], codes, df[column['name']]).tofile(handle)
+        self.rows += len(df)
+        self.bytes = self.rows * sum(DTYPES[column['kind']].itemsize for column in self.columns)
+        if self.bytes > self.max_bytes:
+            self._drop_columns(f"Columns exceed the {self.max_bytes} bytes kept per dataset")
+
+    def _drop_columns(self, reason):
+        for handle in self.handles:
+            handle.close()
+        for column in self.columns:
+            os.remove(os.path.join(self.directory, column['file']))
+        self.columns, self.handles, self.codes = [], [], []
+        self.bytes = 0
+        self.skipped = reason
+
+    def finish(self):
+        """Complete the staged store and return its directory."""
+        if self.columns is None:
+            self._start(None)
+
+        for column, handle, codes in zip(self.columns, self.handles, self.codes):
+            handle.seek(0)
+            handle.write(_npy_header(DTYPES[column['kind']], self.rows))
+            handle.close()
+            if codes is not None:
+                with open(os.path.join(self.directory, column['categories']), 'w') as categories:
+                    # dumps, not dump: the latter streams through the pure-Python encoder.
+                    categories.write(json.dumps(list(codes)))
+        self.handles = []
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "columns": self.columns,
+            "skipped": self.skipped,
+        }
+        with open(os.path.join(self.directory, MANIFEST), 'w') as handle:
+            json.dump(manifest, handle)
+        return self.directory
+
+    def abort(self):
+        for handle in self.handles:
+            handle.close()
+        self.handles = []
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SortIndex:
+    """
+    A column's row numbers in ascending order, missing values last, with the
+    sorted keys alongside for range lookups and each row's position for the
+    way back. Descending order walks the same index backwards, so equal
+    values come out in reverse row order.
+    """
+
+    def __init__(self, order, keys, positions, descending=False):
+        self.order = order
+        self.keys = keys
+        self.positions = positions
+        self.valid = len(keys)
+        self.descending = descending
+
+    def __len__(self):
+        return len(self.order)
+
+    def rows(self, start, stop):
+        """Row numbers at positions [start, stop) of this ordering."""
+        if not self.descending:
+            return self.order[start:stop]
+        head = self.order[max(self.valid - stop, 0):max(self.valid - start, 0)][::-1]
+        if stop <= self.valid:
+            return head
+        return np.concatenate([head, self.order[max(start, self.valid):stop]])
+
+    def positions_of(self, rows):
+        """Where the given rows fall in this ordering."""
+        positions = self.positions[rows]
+        if self.descending:
+            positions = np.where(positions < self.valid, self.valid - 1 - positions, positions)
+        return positions
+
+    def span(self, low=None, high=None, low_open=False, high_open=False):
+        """Positions [start, stop) of this ordering whose keys lie between low and high."""
+        start = 0 if low is None else int(np.searchsorted(self.keys, low, 'right' if low_open else 'left'))
+        stop = self.valid if high is None else int(np.searchsorted(self.keys, high, 'left' if high_open else 'right'))
+        stop = max(start, stop)
+        if self.descending:
+            return self.valid - stop, self.valid - start
+        return start, stop
+
+
+class ColumnSet:
+    """An opened store. Columns are mapped read-only on first use."""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.rows = manifest['rows']
+        self.columns = {column['name']: column for column in manifest['columns']}
+        self._arrays = {}
+        self._categories = {}
+        self._codes = {}
+        self._ranks = {}
+        self._indexes = {}
+
+    def kind(self, name):
+        return self.columns[name]['kind']
+
+    def array(self, name):
+        """The raw column: float32 readings, int32 category codes or datetime64 times."""
+        if name not in self._arrays:
+            column = self.columns[name]
+            if self.rows:
+                self._arrays[name] = np.load(os.path.join(self.directory, column['file']), mmap_mode='r')
+            else:
+                # An empty file cannot be mapped.
+                self._arrays[name] = np.empty(0, dtype=DTYPES[column['kind']])
+        return self._arrays[name]
+
+    def categories(self, name):
+        """Category labels by code, as an object array: unlike a list, it is not walked by every full GC pass."""
+        if name not in self._categories:
+            with open(os.path.join(self.directory, self.columns[name]['categories'])) as handle:
+                self._categories[name] = np.array(json.load(handle), dtype=object)
+        return self._categories[name]
+
+    def codes(self, name):
+        """Category label to code."""
+        if name not in self._codes:
+            self._codes[name] = {label: code for code, label in enumerate(self.categories(name))}
+        return self._codes[name]
+
+    def series(self, name, index=slice(None)):
+        """Rows `index` (a slice or positions) of a column as a Series, categories decoded."""
+        values = self.array(name)[index]
+        if self.kind(name) == CATEGORY:
+            return pd.Series(pd.Categorical.from_codes(values, self.categories(name)), name=name)
+        return pd.Series(values, name=name)
+
+    def ranks(self, name):
+        """Each category code's place in alphabetical order: the sort key of a category column."""
+        if name not in self._ranks:
+            categories = self.categories(name)
+            ranks = np.empty(len(categories), dtype=DTYPES[CATEGORY])
+            ranks[np.argsort(categories, kind='stable')] = np.arange(len(categories))
+            self._ranks[name] = ranks
+        return self._ranks[name]
+
+    def sort_keys(self, name):
+        """Comparable keys for a column and where it is missing: readings, category ranks, or nanoseconds."""
+        values = self.array(name)
+        kind = self.kind(name)
+        if kind == FLOAT:
+            return values, np.isnan(values)
+        if kind == TIMESTAMP:
+            return values.view('<i8'), np.isnat(values)
+        # The appended -1 keeps missing codes (-1) out of the ranks.
+        return np.append(self.ranks(name), -1)[values], values < 0
+
+    def sort_index(self, name, descending=False):
+        """
+        The column's SortIndex. It is built on the first sort by that column,
+        saved under the store's index directory, and mapped from there after.
+        """
+        if name not in self._indexes:
+            stem = os.path.join(self.directory, INDEX_DIR, os.path.splitext(self.columns[name]['file'])[0])
+            with _index_locks_guard:
+                lock = _index_locks.setdefault(stem, threading.Lock())
+            with lock:
+                if not os.path.exists(f"{stem}.order.npy"):
+                    self._build_index(name, stem)
+            if self.rows:
+                self._indexes[name] = tuple(
+                    np.load(f"{stem}.{part}.npy", mmap_mode='r') for part in ('order', 'keys', 'positions')
+                )
+            else:
+                empty = np.empty(0, dtype='<i4')
+                self._indexes[name] = (empty, self.sort_keys(name)[0], empty)
+        return SortIndex(*self._indexes[name], descending=descending)
+
+    def _build_index(self, name, stem):
+        keys, missing = self.sort_keys(name)
+        valid = np.flatnonzero(~missing)
+        ascending = valid[np.argsort(keys[valid], kind='stable')]
+        order = np.concatenate([ascending, np.flatnonzero(missing)])
+        order = order.astype('<i4' if self.rows < 2 ** 31 else '<i8', copy=False)
+        positions = np.empty_like(order)
+        positions[order] = np.arange(self.rows, dtype=order.dtype)
+
+        os.makedirs(os.path.dirname(stem), exist_ok=True)
+        # The order file goes last: once it is on disk the index is complete.
+        parts = (('keys', np.ascontiguousarray(keys[ascending])), ('positions', positions), ('order', order))
+        for suffix, array in parts:
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(stem), suffix='.part')
+            with os.fdopen(fd, 'wb') as handle:
+                np.save(handle, array)
+            os.replace(temp_path, f"{stem}.{suffix}.npy")
+
+
+def _reading(value):
+    # Readings are stored as float32; report them without float64 noise digits.
+    return float(np.format_float_positional(np.float32(value), unique=True))
+
+
+def describe(store, metrics, by=None, percentiles=(50, 95)):
+    """
+    Exact statistics of the readings, overall or per category of `by`,
+    computed from the mapped columns rather than a reparse. Rows are grouped
+    with one stable argsort of the category codes; each group is a slice.
+    """
+    if by is None:
+        order, labels, sizes = None, [None], [store.rows]
+    else:
+        keys = store.array(by)
+        order = np.argsort(keys, kind='stable')
+        labels = [None, *store.categories(by)]
+        # Shifted by one so the missing code, -1, counts at the front.
+        sizes = np.bincount(keys + 1, minlength=len(labels))
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+
+    groups = [
+        {"key": label, "rows": int(size), "metrics": {}}
+        for label, size in zip(labels, sizes)
+    ]
+    for metric in metrics:
+        values = store.array(metric)
+        values = values[order] if order is not None else values
+        for group, start, stop in zip(groups, bounds[:-1], bounds[1:]):
+            if not group["rows"]:
+                continue
+            part = values[start:stop].astype('float64')
+            part = part[~np.isnan(part)]
+            stats = {"count": len(part), "mean": None, "std": None, "min": None, "max": None}
+            stats.update({f"p{p:g}": None for p in percentiles})
+            if len(part):
+                stats.update({
+                    "mean": part.mean(),
+                    "std": part.std(ddof=1) if len(part) > 1 else None,
+                    "min": _reading(part.min()),
+                    "max": _reading(part.max()),
+                })
+                if percentiles:
+                    for p, value in zip(percentiles, np.percentile(part, percentiles)):
+                        stats[f"p{p:g}"] = _reading(value)
+            group["metrics"][metric] = {
+                name: value if value is None or name == 'count' else float(value) for name, value in stats.items()
+            }
+
+    return sorted((group for group in groups if group["rows"]), key=lambda group: -group["rows"])
+
+
+def enabled():
+    return settings.COLUMN_STORE_DATASET_MAX_BYTES > 0
+
+
+def writer():
+    """A ColumnWriter for an upload parsed in this process, or None when the store is off."""
+    if not enabled():
+        return None
+    return ColumnWriter(settings.COLUMN_STORE_DIR, settings.COLUMN_STORE_DATASET_MAX_BYTES)
+
+
+def store_key(digest):
+    """Stores are named after the content digest; uploads without one get a store of their own."""
+    return digest or uuid.uuid4().hex
+
+
+def store_path(key):
+    return os.path.join(settings.COLUMN_STORE_DIR, key)
+
+
+def lookup(key):
+    """The manifest of store `key` (with its key added), or None when there is no such store."""
+    if not key:
+        return None
+    try:
+        with open(os.path.join(store_path(key), MANIFEST)) as handle:
+            manifest = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    return {**manifest, "key": key}
+
+
+def commit(staged, key):
+    """
+    Move a staged store into place as `key` and return its manifest. When
+    the same content was stored first by someone else, theirs is kept.
+    """
+    try:
+        os.replace(staged, store_path(key))
+    except OSError:
+        if lookup(key) is None:
+            raise
+        shutil.rmtree(staged, ignore_errors=True)
+    return lookup(key)
+
+
+def claim(column_store):
+    """
+    column_store, a manifest from commit() or lookup(), for a dataset about to
+    refer to it; None when its store has been removed since. Call inside the
+    transaction that inserts the dataset: the store stays locked until it
+    ends, so release() waits for the insert and then sees it.
+    """
+    # Imported here: batch worker processes import this module without Django set up.
+    from .models import ColumnStoreLock
+
+    if not column_store:
+        return None
+    ColumnStoreLock.objects.lock(column_store['key'])
+    return column_store if lookup(column_store['key']) is not None else None
+
+
+def open_store(key):
+    """Store `key` as a ColumnSet, opened once per process and reused while it exists."""
+    with _open_stores_lock:
+        store = _open_stores.get(key)
+        if store is not None:
+            if os.path.exists(os.path.join(store.directory, MANIFEST)):
+                _open_stores.move_to_end(key)
+                return store
+            del _open_stores[key]
+
+    manifest = lookup(key)
+    if manifest is None:
+        return None
+    store = ColumnSet(store_path(key), manifest)
+    with _open_stores_lock:
+        _open_stores[key] = store
+        while len(_open_stores) > OPEN_STORES:
+            _open_stores.popitem(last=False)
+    return store
+
+
+def release(key):
+    """
+    Delete a store once no dataset refers to it, returning whether it did.
+    Call after the deleting transaction commits. Holds the store's lock
+    while it checks, so a dataset being stored with it (see claim) is counted.
+    """
+    from .models import ColumnStoreLock, EquipmentDataset
+
+    if not key:
+        return False
+    with transaction.atomic():
+        ColumnStoreLock.objects.lock(key)
+        if EquipmentDataset.objects.filter(column_key=key).exists():
+            return False
+        shutil.rmtree(store_path(key), ignore_errors=True)
+        ColumnStoreLock.objects.filter(key=key).delete()
+    with _open_stores_lock:
+        _open_stores.pop(key, None)
+    return True
+
+
+def usage(user_id):
+    """
+    Column bytes held by the user's datasets (a shared store counts for each)
+    and their quota: one COLUMN_STORE_DATASET_MAX_BYTES per dataset retention keeps.
+    """
+    from .models import EquipmentDataset
+    from .retention import retention_limit
+
+    used = EquipmentDataset.objects.filter(user_id=user_id).aggregate(total=Sum('column_bytes'))['total']
+    return {
+        "bytes": used or 0,
+        "quota": retention_limit(user_id) * settings.COLUMN_STORE_DATASET_MAX_BYTES,
+    }
+
+
+def sweep():
+    """
+    Remove stores no dataset refers to and staged ones abandoned by dead
+    workers. Returns the number of directories removed.
+    """
+    from .models import EquipmentDataset
+
+    root = settings.COLUMN_STORE_DIR
+    if not os.path.isdir(root):
+        return 0
+    # Fresh stores may belong to a dataset whose transaction has not committed yet.
+    cutoff = time.time() - SWEEP_MIN_AGE_SECONDS
+    removed = 0
+    staging = os.path.join(root, STAGING_DIR)
+    if os.path.isdir(staging):
+        for entry in os.scandir(staging):
+            if entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+
+    keys = {
+        entry.name for entry in os.scandir(root)
+        if entry.is_dir() and entry.name != STAGING_DIR and entry.stat().st_mtime < cutoff
+    }
+    referenced = set(
+        EquipmentDataset.objects.filter(column_key__in=keys).values_list('column_key', flat=True).distinct()
+    )
+    for key in keys - referenced:
+        removed += release(key)
+    return removed
@@ -0,0 +1,171 @@
+"""
+In-process publish/subscribe for per-user events, fanned out to the
+server-sent event streams of /api/async/events/.
+
+Publishers call publish() from any thread, usually from a
+transaction.on_commit hook, so subscribers never hear of rows they cannot
+read yet. Each subscription is an asyncio queue on the event loop of the
+stream serving it; an idle subscriber costs a queue and a waiting task, no
+thread. Every user's last REPLAY events are kept so a client reconnecting
+with Last-Event-ID picks up what it missed; when that is no longer possible,
+or a slow subscriber's queue overflows, it gets a `resync` event and
+re-reads its state (for the history, through /api/sync/) instead.
+
+Events only reach streams served by this process. Deployments running
+several server processes, or jobs in external workers, still need the
+polling endpoints, which stay available.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import uuid
+from collections import defaultdict, deque
+
+# Events kept per user for reconnecting clients.
+REPLAY = 100
+# Undelivered events a subscriber may hold before it is told to resync.
+QUEUE_SIZE = 256
+
+DATASET_CREATED = 'dataset.created'
+DATASET_DELETED = 'dataset.deleted'
+JOB_PROGRESS = 'job.progress'
+JOB_FINISHED = 'job.finished'
+RESYNC = 'resync'
+
+
+class Event:
+    __slots__ = ('id', 'name', 'data')
+
+    def __init__(self, id, name, data):
+        self.id, self.name, self.data = id, name, data
+
+    def encode(self):
+        """The event in text/event-stream framing."""
+        return f"id: {self.id}\nevent: {self.name}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class Subscription:
+    """One stream's view of the broker. Read with get() on the loop it was made on."""
+
+    def __init__(self, broker, user_id, loop, backlog):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        for event in backlog:
+            self.queue.put_nowait(event)
+
+    def deliver(self, event):
+        """Called on the subscription's loop. A full queue is replaced by a single resync."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(Event(event.id, RESYNC, {"reason": "overflow"}))
+
+    async def get(self, timeout):
+        """The next event, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker:
+    """
+    Per-user fan-out. Event ids are "<epoch>-<n>": the epoch changes with
+    every process, so ids from before a restart are recognised as such.
+    """
+
+    def __init__(self, replay=REPLAY):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._recent = defaultdict(lambda: deque(maxlen=replay))
+        # Sequence number of the newest event each user's replay has dropped.
+        self._dropped = {}
+        self.published = 0
+
+    def publish(self, user_id, name, data):
+        """Send an event to the user's subscribers. Safe from any thread; never blocks on them."""
+        with self._lock:
+            sequence = next(self._ids)
+            event = Event(f"{self.epoch}-{sequence}", name, data)
+            recent = self._recent[user_id]
+            if len(recent) == recent.maxlen:
+                self._dropped[user_id] = self._sequence(recent[0].id)
+            recent.append(event)
+            subscribers = list(self._subscribers.get(user_id, ()))
+            self.published += 1
+
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Its loop has closed; the stream is going away.
+                self.unsubscribe(subscription)
+        return event
+
+    def subscribe(self, user_id, last_event_id=None):
+        """
+        A Subscription for the user, on the running loop. With
+        last_event_id, it starts with the events published after it, or
+        with a resync when those are no longer all known.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            backlog = self._backlog(user_id, last_event_id) if last_event_id else []
+            subscription = Subscription(self, user_id, loop, backlog)
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscribers.get(user_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "users": len(self._subscribers),
+                "published": self.published,
+            }
+
+    def _backlog(self, user_id, last_event_id):
+        recent = self._recent.get(user_id, ())
+        epoch, _, sequence = last_event_id.partition('-')
+        resync = [Event(f"{self.epoch}-0", RESYNC, {"reason": "gap"})]
+        if epoch != self.epoch or not sequence.isdigit():
+            return resync
+        sequence = int(sequence)
+        if sequence < self._dropped.get(user_id, 0):
+            return resync
+        return [event for event in recent if self._sequence(event.id) > sequence]
+
+    @staticmethod
+    def _sequence(event_id):
+        return int(event_id.rpartition('-')[2])
+
+
+broker = Broker()
+
+
+def publish(user_id, name, data):
+    """Publish through the process-wide broker."""
+    return broker.publish(user_id, name, data)
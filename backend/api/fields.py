@@ -0,0 +1,36 @@
+"""
+Sparse fieldsets: `?fields=total_count,averages` trims a response to the
+named keys, and dots reach into nested ones (`averages.avg_temp`). Upload
+and job responses apply them to the job's dataset summary, leaving the job's
+own keys alone; the history applies them to each of its entries. Names a
+summary lacks are left out rather than refused, as older summaries lack some.
+"""
+
+
+class FieldsError(ValueError):
+    pass
+
+
+def requested_fields(request):
+    """The ?fields= paths of a request as tuples of names, or None without the parameter."""
+    value = request.GET.get('fields')
+    if value is None:
+        return None
+    paths = [tuple(name.split('.')) for name in (part.strip() for part in value.split(',')) if name]
+    if not paths or any('' in path for path in paths):
+        raise FieldsError("fields must be a comma-separated list of names, dotted for nested ones")
+    return paths
+
+
+def select_fields(data, paths):
+    """The parts of `data` the paths name; all of it when paths is None or data is not a mapping."""
+    if paths is None or not isinstance(data, dict):
+        return data
+    nested = {}
+    for head, *rest in paths:
+        if head in data:
+            nested.setdefault(head, []).append(tuple(rest))
+    return {
+        key: data[key] if () in rests else select_fields(data[key], rests)
+        for key, rests in nested.items()
+    }
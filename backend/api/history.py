@@ -0,0 +1,121 @@
+import hashlib
+import json
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
+
+from .models import EquipmentDataset
+
+# Served, rebuilt and 304 counts seen by this process since it started.
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def _listing_key(user_id):
+    return f"history:listing:{user_id}"
+
+
+def _changed_key(user_id):
+    return f"history:changed:{user_id}"
+
+
+def _listing_rows(user_id):
+    return (
+        EquipmentDataset.objects.filter(user_id=user_id)
+        .order_by('-upload_date')
+        .values('id', 'file_name', 'upload_date')
+    )
+
+
+def _build_listing(rows, changed):
+    data = [
+        {
+            "id": row['id'],
+            "name": row['file_name'],
+            "date": row['upload_date'].isoformat(),
+        }
+        for row in rows
+    ]
+    if changed is None:
+        changed = max((row['upload_date'] for row in rows), default=timezone.now()).timestamp()
+
+    return {
+        "data": data,
+        "etag": '"%s"' % hashlib.sha1(json.dumps(data).encode()).hexdigest(),
+        "last_modified": http_date(changed),
+    }
+
+
+def get_listing(user_id):
+    """
+    The user's history listing with its validators, as
+    {"data": [...], "etag": '"..."', "last_modified": <http date>}.
+    Served from the cache until the user's datasets change.
+    """
+    entry = cache.get(_listing_key(user_id))
+    if entry is not None:
+        _count('hits')
+        return entry
+
+    _count('misses')
+    entry = _build_listing(list(_listing_rows(user_id)), cache.get(_changed_key(user_id)))
+    cache.set(_listing_key(user_id), entry, settings.HISTORY_CACHE_TIMEOUT)
+    return entry
+
+
+async def aget_listing(user_id):
+    """get_listing for async views, through the async cache and ORM APIs."""
+    entry = await cache.aget(_listing_key(user_id))
+    if entry is not None:
+        _count('hits')
+        return entry
+
+    _count('misses')
+    rows = [row async for row in _listing_rows(user_id)]
+    entry = _build_listing(rows, await cache.aget(_changed_key(user_id)))
+    await cache.aset(_listing_key(user_id), entry, settings.HISTORY_CACHE_TIMEOUT)
+    return entry
+
+
+def is_not_modified(request, entry):
+    """True when the client's validators still match the listing."""
+    matched = _matches(request, entry)
+    if matched:
+        _count('not_modified')
+    return matched
+
+
+def _matches(request, entry):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or entry['etag'] in tags or f"W/{entry['etag']}" in tags
+
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return since is not None and since >= parse_http_date_safe(entry['last_modified'])
+
+
+def invalidate(user_id):
+    """Drop the cached listing after an upload or delete and note when it changed."""
+    cache.delete(_listing_key(user_id))
+    cache.set(_changed_key(user_id), timezone.now().timestamp(), None)
+
+
+def stats():
+    with _counters_lock:
+        hits, misses, not_modified = _counters['hits'], _counters['misses'], _counters['not_modified']
+    return {
+        "hits": hits,
+        "misses": misses,
+        "not_modified": not_modified,
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0,
+    }
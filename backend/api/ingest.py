@@ -0,0 +1,659 @@
+"""
+Streaming parse and summary of equipment CSVs, shared by the server and the
+desktop client.
+
+The server runs it on every upload (see api.utils). The desktop client runs
+it too, in its local pre-aggregation mode, and uploads only the summary, the
+rollups and, when they fit, the known columns packed by ColumnSample. The
+server then checks what it was sent with check_summary and check_rollups,
+and recomputes the summary from the columns when they came along.
+
+No Django imports: this runs inside batch worker processes and the desktop client.
+"""
+import codecs
+import csv
+import io
+import json
+import math
+import time
+import zipfile
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .rollups import (
+    BUCKET_LADDER, EQUIPMENT_COLUMN, MAX_ROLLUP_ROWS, METRICS, SAMPLE_SIZE, SCOPE_EQUIPMENT, SCOPE_TYPE,
+    timestamp_column,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pa_compute
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_compute = None
+    pa_csv = None
+
+# Bytes pulled from the upload per read and rows handed to pandas per parse
+# step. Together they bound the memory one upload can hold at any moment.
+READ_CHUNK_SIZE = 1024 * 1024
+CHUNK_ROWS = 50_000
+PREVIEW_ROWS = 10
+
+NUMERIC_FIELDS = {
+    "avg_flowrate": "Flowrate",
+    "avg_pressure": "Pressure",
+    "avg_temp": "Temperature",
+}
+READING_COLUMNS = tuple(NUMERIC_FIELDS.values())
+TYPE_COLUMN = 'Type'
+
+# The only columns the summary needs. When the header has all of them the
+# parser skips every other column and pins the labels' dtype up front.
+# Readings end up float64, so their sums match a full parse exactly, but
+# are converted as the full parse converts them (see coerce_readings): a
+# cell like "abc" counts as missing on both paths instead of failing one.
+PROJECTED_DTYPES = {
+    "Flowrate": 'float64',
+    "Pressure": 'float64',
+    "Temperature": 'float64',
+    TYPE_COLUMN: 'category',
+}
+
+# Read alongside them when present, for the per-equipment and time rollups.
+ROLLUP_DTYPES = {
+    EQUIPMENT_COLUMN: 'category',
+}
+
+PARSER_ENGINES = ('auto', 'pyarrow', 'c', 'python')
+
+
+class UploadStream(io.RawIOBase):
+    """
+    Read-only raw stream over a Django UploadedFile.
+    Pulls the file through chunks() so the whole body is never held in memory.
+    """
+
+    def __init__(self, file_obj, chunk_size=READ_CHUNK_SIZE):
+        if hasattr(file_obj, 'chunks'):
+            self._chunks = iter(file_obj.chunks(chunk_size))
+        else:
+            self._chunks = iter(lambda: file_obj.read(chunk_size), b'')
+        self._view = memoryview(b'')
+        self.bytes_read = 0
+        # Time spent waiting on the upload's chunks, apart from parsing them.
+        self.read_seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._view:
+            started = time.perf_counter()
+            chunk = next(self._chunks, None)
+            self.read_seconds += time.perf_counter() - started
+            if chunk is None:
+                return 0
+            self._view = memoryview(chunk)
+
+        size = min(len(buffer), len(self._view))
+        buffer[:size] = self._view[:size]
+        self._view = self._view[size:]
+        self.bytes_read += size
+        return size
+
+
+class PrefixedStream(io.RawIOBase):
+    """Raw stream that replays already-consumed bytes before the rest of a stream."""
+
+    def __init__(self, prefix, stream):
+        self._view = memoryview(prefix)
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._view:
+            return self._stream.readinto(buffer)
+
+        size = min(len(buffer), len(self._view))
+        buffer[:size] = self._view[:size]
+        self._view = self._view[size:]
+        return size
+
+
+class PartialAggregate:
+    """
+    Running sums, counts and Type distribution for a CSV or a slice of one.
+    Partials built over consecutive slices combine with merge().
+    """
+
+    def __init__(self):
+        self.total_count = 0
+        self.sums = dict.fromkeys(NUMERIC_FIELDS, 0.0)
+        self.counts = dict.fromkeys(NUMERIC_FIELDS, 0)
+        self.distribution = Counter()
+        self.preview = []
+
+    def update(self, df, dist_col, preview=True):
+        self.total_count += len(df)
+
+        for key, column in NUMERIC_FIELDS.items():
+            if column in df.columns:
+                values = pd.to_numeric(df[column], errors='coerce').astype('float64', copy=False)
+                self.sums[key] += float(values.sum())
+                self.counts[key] += int(values.count())
+
+        counts = df[dist_col].value_counts()
+        self.distribution.update(counts[counts > 0].to_dict())
+
+        missing = PREVIEW_ROWS - len(self.preview)
+        if preview and missing > 0:
+            self.preview.extend(preview_records(df.head(missing)))
+
+    def merge(self, other):
+        """Fold in a partial that covers rows after this one's."""
+        self.total_count += other.total_count
+        for key in NUMERIC_FIELDS:
+            self.sums[key] += other.sums[key]
+            self.counts[key] += other.counts[key]
+        self.distribution.update(other.distribution)
+        self.preview = (self.preview + other.preview)[:PREVIEW_ROWS]
+        return self
+
+    def to_summary(self):
+        averages = {
+            key: round(self.sums[key] / self.counts[key], 2) if self.counts[key] else 0
+            for key in NUMERIC_FIELDS
+        }
+        return {
+            "total_count": self.total_count,
+            "averages": averages,
+            # Unrounded, so averages across datasets can be combined exactly.
+            "totals": {
+                key: {"sum": self.sums[key], "count": self.counts[key]}
+                for key in NUMERIC_FIELDS
+            },
+            "distribution": dict(self.distribution.most_common()),
+            "raw_data": self.preview,
+        }
+
+
+def resolve_engine(engine='auto'):
+    """Map a configured engine name to one that is usable here."""
+    if engine not in PARSER_ENGINES:
+        raise ValueError(f"Unknown CSV parser engine: {engine}")
+    if engine == 'auto':
+        # pyarrow drops rows with too few fields, which the pandas engines
+        # count, so it is only used when asked for.
+        return 'c'
+    if engine == 'pyarrow' and pa_csv is None:
+        return 'c'
+    return engine
+
+
+def preview_records(df):
+    """Rows as dicts, with None where a value is missing: NaN is not valid JSON."""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+
+def read_header(stream):
+    """Consume the header line, returning its raw bytes and column names as written."""
+    line = stream.readline()
+    while line and not line.strip():
+        line = stream.readline()
+    if not line:
+        raise ValueError("The uploaded CSV file is empty.")
+    # Spreadsheet exports often start with a byte order mark; left on, it hides the first column's name.
+    if line.startswith(codecs.BOM_UTF8):
+        line = line[len(codecs.BOM_UTF8):]
+
+    return line, next(csv.reader([line.decode('utf-8')]), [])
+
+
+def projected_names(columns):
+    """
+    Map each summary column, plus the equipment name and timestamp columns
+    when the header has them, to its name as written in the header.
+    Returns None when a summary column is missing or ambiguous, so the caller falls back.
+    """
+    stripped = Counter(column.strip() for column in columns)
+    if any(stripped[column] != 1 for column in PROJECTED_DTYPES):
+        return None
+    wanted = set(PROJECTED_DTYPES)
+    wanted.update(column for column in ROLLUP_DTYPES if stripped[column] == 1)
+    timestamp = timestamp_column(columns)
+    if timestamp:
+        wanted.add(timestamp)
+    return {column.strip(): column for column in columns if column.strip() in wanted}
+
+
+def _projected_dtype(column):
+    # Timestamps stay text; the rollup parses them with pandas.
+    return PROJECTED_DTYPES.get(column) or ROLLUP_DTYPES.get(column) or 'string'
+
+
+def coerce_readings(df):
+    """
+    Make the reading columns float64, anything non-numeric NaN. Inferred
+    chunks are usually numeric already; only those with a stray value come
+    through as text and need converting.
+    """
+    for column in NUMERIC_FIELDS.values():
+        values = df[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = pd.to_numeric(values, errors='coerce')
+        df[column] = values.astype('float64', copy=False)
+    return df
+
+
+def read_preview(header_line, stream):
+    """
+    Parse the first PREVIEW_ROWS rows with every column, as the legacy path did.
+    Returns the preview rows and the raw bytes consumed past the header.
+    """
+    consumed = []
+    line_budget = PREVIEW_ROWS
+    eof = False
+    while True:
+        while len(consumed) < line_budget:
+            line = stream.readline()
+            if not line:
+                eof = True
+                break
+            consumed.append(line)
+
+        body = header_line + b''.join(consumed)
+        preview = pd.read_csv(io.BytesIO(body), sep=',', on_bad_lines='skip')
+        if len(preview) >= PREVIEW_ROWS or eof:
+            break
+        # Malformed lines were skipped; widen the window and try again.
+        line_budget *= 2
+
+    preview.columns = preview.columns.str.strip()
+    return preview_records(preview.head(PREVIEW_ROWS)), b''.join(consumed)
+
+
+def iter_csv_frames(stream, dtype=None, chunk_rows=CHUNK_ROWS):
+    """Yield a headed CSV stream as DataFrames with every column, dtypes inferred unless given in dtype."""
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    reader = pd.read_csv(text, sep=',', dtype=dtype, on_bad_lines='skip', chunksize=chunk_rows)
+    with reader:
+        for df in reader:
+            df.columns = df.columns.str.strip()
+            yield df
+
+
+def iter_projected_frames(stream, names, engine, chunk_rows=CHUNK_ROWS):
+    """
+    Yield a headed CSV stream as DataFrames holding only the summary (and
+    rollup) columns, readings as float64 (see coerce_readings) and labels
+    categorical. names maps each summary column to its header spelling (see
+    projected_names).
+
+    pyarrow skips the other columns entirely. The pandas engines still tokenize
+    them, because with usecols they stop skipping rows that have too many fields,
+    but they are dropped per chunk. pyarrow also skips rows with too few fields,
+    which pandas pads with NaN, so its counts can be lower.
+    """
+    renames = {raw: column for column, raw in names.items()}
+
+    if engine == 'pyarrow':
+        arrow_types = {
+            'category': pa.dictionary(pa.int32(), pa.string()),
+            'string': pa.string(),
+        }
+        # pyarrow fixes a column's type for the whole file, so readings come as
+        # text and are cast per batch; a batch that will not cast is coerced.
+        column_types = {
+            raw: pa.string() if column in READING_COLUMNS else arrow_types[_projected_dtype(column)]
+            for column, raw in names.items()
+        }
+        reader = pa_csv.open_csv(
+            stream,
+            read_options=pa_csv.ReadOptions(block_size=READ_CHUNK_SIZE * 8),
+            parse_options=pa_csv.ParseOptions(invalid_row_handler=lambda row: 'skip'),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=list(renames),
+                column_types=column_types,
+                strings_can_be_null=True,
+            ),
+        )
+        readings = [raw for column, raw in names.items() if column in READING_COLUMNS]
+        for batch in reader:
+            table = pa.Table.from_batches([batch])
+            for raw in readings:
+                index = table.schema.get_field_index(raw)
+                try:
+                    table = table.set_column(index, raw, pa_compute.cast(table.column(index), pa.float64()))
+                except pa.ArrowInvalid:
+                    pass
+            yield coerce_readings(table.to_pandas().rename(columns=renames))
+        return
+
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    reader = pd.read_csv(
+        text,
+        sep=',',
+        # Readings are inferred per chunk, which is as fast as pinning them when they are clean.
+        dtype={raw: _projected_dtype(column) for column, raw in names.items() if column not in READING_COLUMNS},
+        engine=engine,
+        on_bad_lines='skip',
+        chunksize=chunk_rows,
+    )
+    with reader:
+        for df in reader:
+            yield coerce_readings(df[list(renames)].rename(columns=renames))
+
+
+def summarize(file_obj, engine='auto', projected=True, progress=None, consumers=(), timings=None):
+    """
+    Summarise an equipment CSV in one streaming pass.
+    When the header carries Flowrate, Pressure, Temperature and Type only those
+    columns are parsed; otherwise every column is read and the second one is
+    used for the distribution.
+    progress, if given, is called with the number of bytes read after each chunk.
+    consumers, such as a RollupAggregate or a ColumnWriter, get every chunk's
+    DataFrame through their update() as well.
+    timings, a dict, gets the seconds spent reading the upload, parsing
+    (decoding included), aggregating and in the consumers, and the rows and
+    bytes parsed.
+    """
+    engine = resolve_engine(engine)
+    upload = UploadStream(file_obj)
+    stream = io.BufferedReader(upload)
+    header_line, columns = read_header(stream)
+    aggregate = PartialAggregate()
+
+    names = projected_names(columns) if projected else None
+    if names:
+        aggregate.preview, consumed = read_preview(header_line, stream)
+        frames = iter_projected_frames(io.BufferedReader(PrefixedStream(header_line + consumed, stream)), names, engine)
+        dist_col = TYPE_COLUMN
+    else:
+        # The distribution column is read as text. Inferred per chunk, a label
+        # like 1 would count as 1 in one chunk and '1' in the next.
+        labels = [column for column in columns if column.strip() == TYPE_COLUMN] or columns[1:2]
+        frames = iter_csv_frames(
+            io.BufferedReader(PrefixedStream(header_line, stream)), dtype={column: str for column in labels[:1]},
+        )
+        dist_col = None
+
+    parsing = aggregating = consuming = 0.0
+    rows = 0
+    while True:
+        started = time.perf_counter()
+        df = next(frames, None)
+        parsing += time.perf_counter() - started
+        if df is None:
+            break
+        if dist_col is None:
+            dist_col = TYPE_COLUMN if TYPE_COLUMN in df.columns else df.columns[1]
+        started = time.perf_counter()
+        aggregate.update(df, dist_col, preview=not names)
+        aggregated = time.perf_counter()
+        for consumer in consumers:
+            consumer.update(df)
+        aggregating += aggregated - started
+        consuming += time.perf_counter() - aggregated
+        rows += len(df)
+        if progress:
+            progress(upload.bytes_read)
+
+    summary = aggregate.to_summary()
+    if timings is not None:
+        # The parser pulls the upload as it goes; its waits are counted as reading.
+        timings.update(
+            read=upload.read_seconds, parse=max(parsing - upload.read_seconds, 0.0), aggregate=aggregating,
+            consumers=consuming, rows=rows, bytes=upload.bytes_read,
+        )
+    return summary
+
+
+# Column kinds, shared with the server's columnar store (see api.columnar).
+
+FLOAT = 'float'
+CATEGORY = 'category'
+TIMESTAMP = 'timestamp'
+DTYPES = {
+    FLOAT: np.dtype('<f4'),
+    CATEGORY: np.dtype('<i4'),
+    TIMESTAMP: np.dtype('<M8[ns]'),
+}
+
+
+def column_kinds(names):
+    """The known columns among names, each (name, kind), skipping any that appear twice."""
+    kinds = [(metric, FLOAT) for metric in METRICS]
+    kinds += [(TYPE_COLUMN, CATEGORY), (EQUIPMENT_COLUMN, CATEGORY)]
+    timestamp = timestamp_column(names)
+    if timestamp:
+        kinds.append((timestamp, TIMESTAMP))
+    return [(name, kind) for name, kind in kinds if names.count(name) == 1]
+
+
+def encode_column(kind, codes, series):
+    """
+    A chunk of a column as its kind's dtype. Categories become int32 codes,
+    numbered in codes (a dict of label to code, extended as labels appear), -1 where missing.
+    """
+    if kind == FLOAT:
+        return pd.to_numeric(series, errors='coerce').to_numpy(dtype=DTYPES[FLOAT], na_value=np.nan)
+    if kind == TIMESTAMP:
+        times = pd.to_datetime(series, errors='coerce', utc=True).dt.tz_localize(None)
+        return times.to_numpy(dtype=DTYPES[TIMESTAMP])
+    # Chunk-local codes mapped onto the running codes; the extra -1 keeps missing values missing.
+    chunk_codes, uniques = pd.factorize(series)
+    mapped = [codes.setdefault(str(value), len(codes)) for value in uniques]
+    return np.array(mapped + [-1], dtype=DTYPES[CATEGORY])[chunk_codes]
+
+
+class ColumnSample:
+    """
+    Collects the known columns of every chunk, as a ColumnWriter would, and
+    packs them into one deflated zip: manifest.json, a .npy per column and a
+    JSON label list per category column. Past max_bytes of columns it stops
+    collecting, and pack() returns None.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.kinds = None
+        self.parts = []
+        self.codes = []
+        self.rows = 0
+        self.skipped = False
+
+    def update(self, df):
+        if self.skipped:
+            return
+        if self.kinds is None:
+            self.kinds = column_kinds(list(df.columns))
+            self.parts = [[] for _ in self.kinds]
+            self.codes = [{} if kind == CATEGORY else None for _, kind in self.kinds]
+
+        for (name, kind), parts, codes in zip(self.kinds, self.parts, self.codes):
+            parts.append(encode_column(kind, codes, df[name]))
+        self.rows += len(df)
+        if self.rows * sum(DTYPES[kind].itemsize for _, kind in self.kinds) > self.max_bytes:
+            self.skipped = True
+            self.parts = []
+
+    def pack(self):
+        """
+        The zip's bytes, or None when the columns grew past max_bytes or lack
+        Type, without which they cannot vouch for the summary.
+        """
+        if self.skipped or not self.kinds or TYPE_COLUMN not in dict(self.kinds):
+            return None
+        buffer = io.BytesIO()
+        columns = []
+        with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for i, ((name, kind), parts, codes) in enumerate(zip(self.kinds, self.parts, self.codes)):
+                column = {"name": name, "kind": kind, "file": f"{i}.npy"}
+                with archive.open(column['file'], 'w') as member:
+                    np.lib.format.write_array(member, np.concatenate(parts) if parts else np.empty(0, DTYPES[kind]))
+                if codes is not None:
+                    column["categories"] = f"{i}.categories.json"
+                    archive.writestr(column['categories'], json.dumps(list(codes)))
+                columns.append(column)
+            archive.writestr('manifest.json', json.dumps({"rows": self.rows, "columns": columns}))
+        return buffer.getvalue()
+
+
+def read_column_sample(file_obj, max_bytes, chunk_rows=CHUNK_ROWS):
+    """
+    Unpack a ColumnSample zip, checking it as untrusted input. Returns the
+    row count and an iterator of DataFrames, chunk_rows at a time, shaped
+    like the parser's projected frames. Raises ValueError when the zip is
+    malformed or its columns would take more than max_bytes.
+    """
+    try:
+        archive = zipfile.ZipFile(file_obj)
+        manifest = json.loads(archive.read('manifest.json'))
+        rows = manifest['rows']
+        columns = manifest['columns']
+        names = [column['name'] for column in columns]
+        expected = dict(column_kinds(names))
+        if not isinstance(rows, int) or rows < 0 or any(expected.get(c['name']) != c['kind'] for c in columns):
+            raise ValueError("Unexpected columns")
+        if rows * sum(DTYPES[column['kind']].itemsize for column in columns) > max_bytes:
+            raise ValueError(f"Columns larger than {max_bytes} bytes")
+
+        arrays = {}
+        for column in columns:
+            dtype = DTYPES[column['kind']]
+            with archive.open(column['file']) as member:
+                if np.lib.format.read_magic(member) != (1, 0):
+                    raise ValueError(f"Unexpected array for {column['name']}")
+                shape, fortran_order, header_dtype = np.lib.format.read_array_header_1_0(member)
+                if shape != (rows,) or fortran_order or header_dtype != dtype:
+                    raise ValueError(f"Unexpected array for {column['name']}")
+                data = member.read(rows * dtype.itemsize)
+            values = np.frombuffer(data, dtype=dtype, count=rows)
+            if column['kind'] == CATEGORY:
+                labels = json.loads(archive.read(column['categories']))
+                if not all(isinstance(label, str) for label in labels):
+                    raise ValueError(f"Unexpected categories for {column['name']}")
+                values = pd.Categorical.from_codes(values, categories=pd.Index(labels, dtype=object))
+            arrays[column['name']] = values
+    except (KeyError, TypeError, zipfile.BadZipFile, json.JSONDecodeError) as e:
+        raise ValueError(f"Malformed column sample: {e}")
+
+    def frames():
+        for start in range(0, rows, chunk_rows):
+            yield pd.DataFrame({name: values[start:start + chunk_rows] for name, values in arrays.items()})
+
+    return rows, frames()
+
+
+# Checks for summaries computed elsewhere, as the summary upload receives them.
+
+def check_summary(summary):
+    """
+    Validate a summary made by summarize() and rebuild it from its totals, so
+    the averages always agree with them. Raises ValueError when it is malformed
+    or inconsistent.
+    """
+    try:
+        aggregate = PartialAggregate()
+        aggregate.total_count = _count(summary['total_count'])
+        for key in NUMERIC_FIELDS:
+            totals = summary['totals'][key]
+            aggregate.sums[key] = _number(totals['sum'])
+            aggregate.counts[key] = _count(totals['count'])
+            if aggregate.counts[key] > aggregate.total_count:
+                raise ValueError(f"{key} counts more values than rows")
+        distribution = summary['distribution']
+        if not all(isinstance(label, str) for label in distribution):
+            raise ValueError("Distribution labels must be strings")
+        aggregate.distribution = Counter({label: _count(count) for label, count in distribution.items()})
+        if sum(aggregate.distribution.values()) > aggregate.total_count:
+            raise ValueError("The distribution counts more rows than the file has")
+        aggregate.preview = [_preview_row(row) for row in summary['raw_data']]
+        if len(aggregate.preview) > PREVIEW_ROWS:
+            raise ValueError(f"At most {PREVIEW_ROWS} preview rows are allowed")
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed summary: missing or invalid {e}")
+    return aggregate.to_summary()
+
+
+def check_rollups(rows, summary):
+    """Validate rollup rows made by RollupAggregate.rows() against their summary."""
+    if len(rows) > MAX_ROLLUP_ROWS:
+        raise ValueError(f"At most {MAX_ROLLUP_ROWS} rollup rows are allowed")
+    try:
+        type_rows = Counter()
+        for row in rows:
+            if row['scope'] not in (SCOPE_TYPE, SCOPE_EQUIPMENT) or not isinstance(row['key'], str):
+                raise ValueError("Unknown rollup scope")
+            if row['bucket_start'] is not None and datetime.fromisoformat(row['bucket_start']).tzinfo is None:
+                raise ValueError("Rollup buckets need a UTC offset")
+            if row['bucket_seconds'] not in BUCKET_LADDER:
+                raise ValueError("Unknown rollup bucket size")
+            count = _count(row['count'])
+            for metric in METRICS:
+                n, *moments = row['stats'][metric]
+                if _count(n) > count or len(moments) != 4:
+                    raise ValueError(f"Inconsistent {metric} rollup")
+                for value in moments:
+                    if value is not None:
+                        _number(value)
+            if len(row['sample']) > SAMPLE_SIZE:
+                raise ValueError("Rollup sample too large")
+            for values in row['sample']:
+                if len(values) != len(METRICS):
+                    raise ValueError("Malformed rollup sample")
+                for value in values:
+                    if value is not None:
+                        _number(value)
+            if row['scope'] == SCOPE_TYPE:
+                type_rows[row['key']] += count
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed rollups: {e}")
+
+    # Rollup keys are the distribution's labels, stripped.
+    distribution = Counter()
+    for label, count in summary['distribution'].items():
+        distribution[label.strip()] += count
+    if rows and +type_rows != +distribution:
+        raise ValueError("The Type rollups do not agree with the distribution")
+    return rows
+
+
+def verify_summary(claimed, computed):
+    """Check a claimed summary against one recomputed from the data; raises ValueError on a mismatch."""
+    if claimed['total_count'] != computed['total_count']:
+        raise ValueError(f"Summary counts {claimed['total_count']} rows, the columns hold {computed['total_count']}")
+    if claimed['distribution'] != computed['distribution']:
+        raise ValueError("The Type distribution does not match the columns")
+    for key in NUMERIC_FIELDS:
+        ours, theirs = claimed['totals'][key], computed['totals'][key]
+        # Column readings are float32, so their sums carry its rounding (about 6e-8 of each value).
+        if ours['count'] != theirs['count'] or not math.isclose(ours['sum'], theirs['sum'], rel_tol=1e-6, abs_tol=1e-4):
+            raise ValueError(f"The {key} totals do not match the columns")
+
+
+def _count(value):
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"{value!r} is not a count")
+    return value
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{value!r} is not a finite number")
+    return float(value)
+
+
+def _preview_row(row):
+    if not isinstance(row, dict) or not all(isinstance(key, str) for key in row):
+        raise ValueError("Preview rows must be objects")
+    for value in row.values():
+        if value is not None and not isinstance(value, (str, bool)):
+            _number(value)
+    return row
@@ -0,0 +1,221 @@
+import logging
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import columnar, events, summary_cache
+from .models import ChunkedUpload, UploadJob
+from .rollups import RollupAggregate
+from .services import store_dataset
+from .utils import process_csv
+
+logger = logging.getLogger(__name__)
+
+# Running jobs untouched for this long are assumed orphaned by a dead worker.
+STALE_AFTER = timedelta(minutes=30)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process-wide pool that runs upload jobs off the request thread."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.UPLOAD_WORKERS,
+                thread_name_prefix='upload-worker',
+            )
+        return _executor
+
+
+def spool_path(job_id):
+    return os.path.join(settings.UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+
+
+def spool_upload(file_obj, path):
+    """Keep the uploaded file past the request, moving Django's temp file when there is one."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if hasattr(file_obj, 'temporary_file_path'):
+        try:
+            shutil.move(file_obj.temporary_file_path(), path)
+            return path
+        except OSError:
+            pass
+
+    with open(path, 'wb') as destination:
+        for chunk in file_obj.chunks():
+            destination.write(chunk)
+    return path
+
+
+def enqueue_upload(user, file_obj, digest=''):
+    """
+    Spool an upload to disk and queue it for processing.
+    Content seen before (same SHA-256 digest) completes at once from the summary cache.
+    """
+    cached = summary_cache.reuse(digest)
+    if cached is not None:
+        summary, rollups, column_store = cached
+        with transaction.atomic():
+            dataset = store_dataset(user, file_obj.name, summary, rollups, column_store)
+            return UploadJob.objects.create(
+                user=user,
+                file_name=file_obj.name,
+                digest=digest,
+                status=UploadJob.SUCCEEDED,
+                progress=100,
+                result=summary,
+                dataset=dataset,
+            )
+
+    job = UploadJob(user=user, file_name=file_obj.name, digest=digest)
+    job.spool_path = spool_upload(file_obj, spool_path(job.id))
+    job.save()
+    transaction.on_commit(lambda: dispatch(job.id))
+    return job
+
+
+def dispatch(job_id):
+    """Hand a queued job to the in-process pool unless an external worker drains the queue."""
+    if settings.UPLOAD_WORKER_MODE == 'thread':
+        get_executor().submit(run_job, job_id)
+
+
+def claim_job(job_id):
+    """Atomically move a job from queued to running; False if someone else got it."""
+    return UploadJob.objects.filter(pk=job_id, status=UploadJob.QUEUED).update(
+        status=UploadJob.RUNNING, updated_at=timezone.now()
+    ) == 1
+
+
+def requeue_stale_jobs(max_age):
+    """Put back jobs whose worker died mid-run."""
+    cutoff = timezone.now() - max_age
+    return UploadJob.objects.filter(status=UploadJob.RUNNING, updated_at__lt=cutoff).update(
+        status=UploadJob.QUEUED, progress=0, updated_at=timezone.now()
+    )
+
+
+def announce(job):
+    """Tell the owner's event streams about a finished job, once committed."""
+    data = {"job_id": str(job.pk), "status": job.status, "dataset_id": job.dataset_id}
+    if job.status == UploadJob.FAILED:
+        data["error"] = job.error
+    transaction.on_commit(lambda: events.publish(job.user_id, events.JOB_FINISHED, data))
+
+
+def run_job(job_id):
+    close_old_connections()
+    try:
+        if claim_job(job_id):
+            process_job(UploadJob.objects.select_related('user').get(pk=job_id))
+    except Exception as e:
+        logger.exception(f"Upload worker crashed on job {job_id}: {str(e)}")
+    finally:
+        connection.close()
+
+
+def process_job(job):
+    # Imported here: the chunked module builds on this one.
+    from .chunked import ChunkedUploadReader, ChunksPending, park
+
+    reported = [0]
+
+    def report(bytes_read):
+        # Parsing is the bulk of the work; keep the last percent for the save.
+        percent = min(99, bytes_read * 100 // size)
+        if percent > reported[0]:
+            reported[0] = percent
+            UploadJob.objects.filter(pk=job.pk).update(progress=percent, updated_at=timezone.now())
+            events.publish(job.user_id, events.JOB_PROGRESS, {"job_id": str(job.pk), "progress": percent})
+
+    store = columnar.writer()
+    column_store = None
+    parked = False
+    try:
+        try:
+            rollup = RollupAggregate()
+            upload = ChunkedUpload.objects.filter(job=job).first()
+            if upload:
+                size = max(upload.total_size, 1)
+                with ChunkedUploadReader(upload) as source:
+                    results = process_csv(source, progress=report, rollup=rollup, store=store)
+                    digest = source.hexdigest()
+                if upload.sha256 and upload.sha256 != digest:
+                    raise ValueError("Checksum mismatch: the assembled file differs from what the client declared")
+                job.digest = digest
+            else:
+                size = max(os.path.getsize(job.spool_path), 1)
+                with open(job.spool_path, 'rb') as handle:
+                    results = process_csv(File(handle, name=job.file_name), progress=report, rollup=rollup, store=store)
+
+            rollups = rollup.rows()
+            if store is not None:
+                column_store = columnar.commit(store.finish(), columnar.store_key(job.digest))
+            with transaction.atomic():
+                dataset = store_dataset(job.user, job.file_name, results, rollups, column_store)
+                job.dataset = dataset
+                job.result = results
+                job.status = UploadJob.SUCCEEDED
+                job.progress = 100
+                job.save()
+                announce(job)
+        except ChunksPending as e:
+            logger.info(f"Upload job {job.pk} parked: {str(e)}")
+            if store is not None:
+                store.abort()
+            park(upload, e.index)
+            parked = True
+            return
+        except Exception as e:
+            logger.error(f"Upload job {job.pk} failed for user {job.user.id}: {str(e)}")
+            if store is not None:
+                store.abort()
+            if column_store is not None:
+                columnar.release(column_store['key'])
+            job.dataset = None
+            job.status = UploadJob.FAILED
+            job.error = str(e)
+            job.save(update_fields=['status', 'error', 'updated_at'])
+            announce(job)
+            return
+
+        # The dataset is committed: nothing from here on may fail the job or drop its columns.
+        try:
+            summary_cache.store(job.digest, results, rollups)
+        except Exception as e:
+            logger.exception(f"Could not cache the summary of upload job {job.pk}: {str(e)}")
+        logger.info(f"Successfully processed file {job.file_name} for user {job.user.username}")
+    finally:
+        # A parked upload keeps the chunks received so far for when it resumes.
+        if not parked:
+            try:
+                os.remove(job.spool_path)
+            except OSError:
+                pass
+
+
+def drain_queue(limit=None):
+    """Process queued jobs in this thread, oldest first. Used by external workers."""
+    processed = 0
+    while limit is None or processed < limit:
+        job_id = (
+            UploadJob.objects.filter(status=UploadJob.QUEUED)
+            .order_by('created_at').values_list('pk', flat=True).first()
+        )
+        if job_id is None:
+            break
+        if claim_job(job_id):
+            process_job(UploadJob.objects.select_related('user').get(pk=job_id))
+            processed += 1
+    return processed
+
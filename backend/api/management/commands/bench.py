@@ -0,0 +1,64 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import SUITES, BenchError, BenchSuite, compare, scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark CSV parsing and the upload, history and PDF endpoints (through the Django test client) "
+        "on seeded synthetic files, at several sizes and concurrency levels, in a throwaway copy of the "
+        "database. Writes the results as JSON and, given a baseline run, fails on cases whose median "
+        "slowed down past --threshold."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suites', nargs='+', choices=SUITES, default=list(SUITES))
+        parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000],
+                            help="CSV sizes for the parse and upload suites.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4],
+                            help="Concurrent clients for the endpoint suites.")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per case and client.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Write the results here as JSON.")
+        parser.add_argument('--baseline', help="Results of an earlier run to compare with.")
+        parser.add_argument('--threshold', type=float, default=0.15,
+                            help="Slowdown of a case's median, as a fraction, that counts as a regression.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as handle:
+                    baseline = json.load(handle)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Cannot read baseline {options['baseline']}: {e}")
+
+        with scratch_database():
+            suite = BenchSuite(
+                User.objects.create_user(username='bench'), options['rows'], options['concurrency'],
+                options['repeat'], options['seed'], log=self.stdout.write,
+            )
+            try:
+                results = suite.run(options['suites'])
+            except BenchError as e:
+                raise CommandError(str(e))
+            run = {"meta": suite.meta(options['suites']), "results": results}
+
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(run, handle, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            changes, regressions = compare(results, baseline, options['threshold'])
+            for case, change in changes:
+                line = f"  {case:<44} {change:+7.1%}"
+                self.stdout.write(self.style.ERROR(line) if change > options['threshold'] else line)
+            if regressions:
+                raise CommandError(
+                    f"{len(regressions)} of {len(changes)} cases slowed down by more than {options['threshold']:.0%}"
+                )
+            self.stdout.write(self.style.SUCCESS(f"No regressions across {len(changes)} cases"))
@@ -0,0 +1,61 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api import authentication
+from api.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Count the queries and time of token-authenticated requests with the token caches cold "
+        "(one lookup per request, as before they existed) and warm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--url', default='/api/history/',
+                            help="Endpoint to request; the history listing is cached, so auth is all it queries.")
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f"auth-bench-{uuid.uuid4().hex[:8]}")
+        token, key = AuthToken.objects.issue(user)
+        client = Client(HTTP_AUTHORIZATION=f"Token {key}")
+
+        def fetch():
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = client.get(options['url'])
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise RuntimeError(f"{options['url']} returned {response.status_code}")
+            return elapsed, len(queries)
+
+        try:
+            # Warms the endpoint's own caches, so only authentication differs below.
+            fetch()
+            runs = {"cold": [], "warm": []}
+            for _ in range(options['repeat']):
+                authentication.invalidate(token.pk)
+                runs['cold'].append(fetch())
+            for _ in range(options['repeat']):
+                runs['warm'].append(fetch())
+        finally:
+            user.delete()
+
+        for name, samples in runs.items():
+            timings = [elapsed for elapsed, _ in samples]
+            self.stdout.write(
+                f"{name}: {statistics.mean(count for _, count in samples):.2f} queries/request  "
+                f"mean {statistics.mean(timings) * 1000:7.3f} ms  median {statistics.median(timings) * 1000:7.3f} ms"
+            )
+        stats = authentication.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['hits']:,} cache hits, {stats['shared_hits']:,} shared, {stats['misses']:,} database lookups"
+        ))
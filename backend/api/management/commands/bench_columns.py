@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from api import columnar
+from api.rollups import METRICS
+from api.synthetic import write_equipment_csv
+from api.utils import process_csv
+
+PAGE_ROWS = 100
+
+
+class Command(BaseCommand):
+    help = "Compare answering a new question by reparsing the CSV with reading its memory-mapped columnar copy."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as workdir:
+            for rows in options['rows']:
+                csv_path = os.path.join(workdir, f"equipment_{rows}.csv")
+                write_equipment_csv(csv_path, rows, seed=options['seed'])
+                size_mb = os.path.getsize(csv_path) / (1024 * 1024)
+
+                parse = self.timed(lambda: self.parse(csv_path))
+                writer = columnar.ColumnWriter(workdir, max_bytes=2 ** 62)
+                ingest = self.timed(lambda: self.parse(csv_path, writer))
+                directory = os.path.join(workdir, f"store-{rows}")
+                os.replace(writer.finish(), directory)
+                with open(os.path.join(directory, columnar.MANIFEST)) as handle:
+                    manifest = json.load(handle)
+
+                def open_store():
+                    return columnar.ColumnSet(directory, manifest)
+
+                describe = self.timed(lambda: columnar.describe(open_store(), list(METRICS), 'Type'))
+                page = self.timed(lambda: [
+                    open_store().series(name, slice(rows // 2, rows // 2 + PAGE_ROWS)) for name in ('Flowrate', 'Type')
+                ])
+                store_mb = sum(entry.stat().st_size for entry in os.scandir(directory)) / (1024 * 1024)
+
+                self.stdout.write(f"{rows:,} rows: CSV {size_mb:,.0f} MB, columns {store_mb:,.0f} MB")
+                self.stdout.write(f"  parse CSV                {parse:8.3f}s")
+                self.stdout.write(f"  parse and write columns  {ingest:8.3f}s  (+{(ingest - parse) / parse:.0%})")
+                self.stdout.write(f"  describe by Type         {describe:8.3f}s  x{parse / describe:.1f} vs reparse")
+                self.stdout.write(f"  read {PAGE_ROWS} rows mid-file    {page * 1000:8.2f}ms")
+                os.remove(csv_path)
+
+    @staticmethod
+    def parse(csv_path, store=None):
+        with open(csv_path, 'rb') as handle:
+            process_csv(File(handle), store=store)
+
+    @staticmethod
+    def timed(work):
+        started = time.perf_counter()
+        work()
+        return time.perf_counter() - started
@@ -0,0 +1,121 @@
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from urllib3 import encode_multipart_formdata
+
+from api.models import AuthToken
+from api.services import store_dataset
+from api.synthetic import equipment_frame
+
+ENDPOINTS = {
+    'history': ('get', 'history/'),
+    'pdf': ('get', 'download-pdf/'),
+    'upload': ('post', 'upload/'),
+}
+
+SUMMARY = {
+    "total_count": 15,
+    "averages": {"avg_flowrate": 119.8, "avg_pressure": 6.11, "avg_temp": 117.47},
+    "distribution": {"Pump": 4, "Valve": 3, "Compressor": 2},
+    "raw_data": [],
+}
+
+
+class TrickleBody:
+    """A request body sent in pieces at a fixed rate. Sized, so it still goes out with a Content-Length."""
+
+    def __init__(self, body, kbps):
+        self.body = body
+        self.step = max(1024, kbps * 1024 // 10)
+
+    def __len__(self):
+        return len(self.body)
+
+    def __iter__(self):
+        for start in range(0, len(self.body), self.step):
+            yield self.body[start:start + self.step]
+            time.sleep(0.1)
+
+
+class Command(BaseCommand):
+    help = (
+        "Hit a running server with many concurrent clients and report throughput and latency. "
+        "Run it once against the WSGI deployment (gunicorn chemical_project.wsgi --threads N) and "
+        "once against uvicorn (uvicorn chemical_project.asgi:application) with --async, sharing "
+        "this command's database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Server root.")
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='history')
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help="Use the /api/async/ variants.")
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--rows', type=int, default=20_000, help="Rows in the uploaded CSV.")
+        parser.add_argument('--trickle-kbps', type=int, default=0,
+                            help="Send upload bodies at this rate per client, like slow links do.")
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f"concurrency-bench-{uuid.uuid4().hex[:8]}")
+        token = AuthToken.objects.issue(user)[1]
+        store_dataset(user, 'bench.csv', SUMMARY)
+
+        body, content_type = None, None
+        if options['endpoint'] == 'upload':
+            csv = equipment_frame(options['rows'], seed=0, offset=0).to_csv(index=False).encode()
+            body, content_type = encode_multipart_formdata({'file': ('bench.csv', csv, 'text/csv')})
+
+        prefix = 'api/async/' if options['use_async'] else 'api/'
+        method, path = ENDPOINTS[options['endpoint']]
+        url = f"{options['url'].rstrip('/')}/{prefix}{path}"
+        local = threading.local()
+
+        def send(_):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                local.session.headers['Authorization'] = f"Token {token}"
+            kwargs = {}
+            if body is not None:
+                kwargs['data'] = TrickleBody(body, options['trickle_kbps']) if options['trickle_kbps'] else body
+                kwargs['headers'] = {'Content-Type': content_type}
+            started = time.perf_counter()
+            try:
+                response = local.session.request(method, url, timeout=120, **kwargs)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        if not send(None)[1]:
+            user.delete()
+            raise CommandError(f"{method.upper()} {url} failed; is the server running on this database?")
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['clients']) as pool:
+                results = list(pool.map(send, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        finally:
+            user.delete()
+
+        latencies = sorted(latency for latency, ok in results if ok)
+        errors = sum(1 for _, ok in results if not ok)
+        if not latencies:
+            raise CommandError(f"All {errors} requests failed")
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f"{method.upper()} {url}: {len(results)} requests from {options['clients']} clients in {elapsed:.2f}s\n"
+            f"  {len(results) / elapsed:.1f} req/s, {errors} errors\n"
+            f"  latency ms: mean {statistics.mean(latencies) * 1000:.1f}  p50 {percentile(0.5):.1f}  "
+            f"p95 {percentile(0.95):.1f}  p99 {percentile(0.99):.1f}"
+        )
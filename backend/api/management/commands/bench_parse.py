@@ -0,0 +1,53 @@
+import os
+import tempfile
+import time
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from api.ingest import pa_csv
+from api.synthetic import write_equipment_csv
+from api.utils import process_csv, resolve_engine
+
+
+class Command(BaseCommand):
+    help = "Compare the legacy all-column CSV parse with the projected fast path on synthetic files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 50_000_000])
+        parser.add_argument('--paths', nargs='+', default=['legacy', 'c', 'pyarrow'],
+                            help="legacy = every column with inferred dtypes; c/pyarrow = projected path.")
+        parser.add_argument('--repeat', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        paths = options['paths']
+        if 'pyarrow' in paths and pa_csv is None:
+            self.stdout.write(self.style.WARNING("pyarrow is not installed; skipping that path."))
+            paths = [path for path in paths if path != 'pyarrow']
+
+        with tempfile.TemporaryDirectory() as workdir:
+            for rows in options['rows']:
+                csv_path = os.path.join(workdir, f"equipment_{rows}.csv")
+                started = time.perf_counter()
+                write_equipment_csv(csv_path, rows, seed=options['seed'])
+                size_mb = os.path.getsize(csv_path) / (1024 * 1024)
+                self.stdout.write(
+                    f"{rows:,} rows ({size_mb:,.0f} MB) generated in {time.perf_counter() - started:.1f}s"
+                )
+
+                baseline = None
+                for path in paths:
+                    best = min(self.time_parse(csv_path, path) for _ in range(options['repeat']))
+                    baseline = baseline or best
+                    self.stdout.write(
+                        f"  {path:<8} {best:8.2f}s  {rows / best:12,.0f} rows/s  x{baseline / best:.2f}"
+                    )
+                os.remove(csv_path)
+
+    def time_parse(self, csv_path, path):
+        engine = resolve_engine('c' if path == 'legacy' else path)
+        with open(csv_path, 'rb') as handle:
+            started = time.perf_counter()
+            process_csv(File(handle), engine=engine, projected=path != 'legacy')
+            return time.perf_counter() - started
@@ -0,0 +1,113 @@
+import gzip
+import json
+import statistics
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from rest_framework.renderers import JSONRenderer
+
+from api.models import AuthToken, UploadJob
+from api.renderers import MSGPACK, MessagePackRenderer, msgpack
+from api.services import store_dataset
+from api.synthetic import equipment_csv, type_labels
+from api.utils import process_csv
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# ?fields= sets compared: everything, and what each client asks for.
+RESULT_FIELDS = {
+    "all": None,
+    "web": "total_count,averages,raw_data",
+    "desktop": "total_count,averages",
+}
+HISTORY_FIELDS = {
+    "all": None,
+    "id,name": "id,name",
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Bytes on the wire for upload results and the history, per format (JSON, MessagePack), "
+        "?fields= selection and compression, with the time to serialize, compress and parse each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--types', type=int, nargs='+', default=[6, 1000],
+                            help="Distinct equipment types, i.e. distribution size, of the summaries.")
+        parser.add_argument('--rows', type=int, default=10_000, help="CSV rows summarised.")
+        parser.add_argument('--repeat', type=int, default=50, help="Timed runs per serialization.")
+
+    def handle(self, *args, **options):
+        if msgpack is None:
+            raise CommandError("bench_payloads needs msgpack installed")
+        self.repeat = options['repeat']
+        self.encodings = ['gzip'] + (['br'] if brotli is not None else [])
+
+        user = User.objects.create_user(username=f"payload-bench-{uuid.uuid4().hex[:8]}")
+        client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(user)[1]}")
+        try:
+            for types in options['types']:
+                content = equipment_csv(options['rows'], types=type_labels(types))
+                summary = process_csv(ContentFile(content, name='bench.csv'))
+                job = UploadJob.objects.create(
+                    user=user, file_name='bench.csv', status=UploadJob.SUCCEEDED, progress=100, result=summary,
+                )
+                self.measure(client, f"job types={types}", f"/api/jobs/{job.pk}/", RESULT_FIELDS)
+            for n in range(settings.DATASET_RETENTION_LIMIT):
+                store_dataset(user, f"history-{n}.csv", summary)
+            self.measure(client, "history", "/api/history/", HISTORY_FIELDS)
+        finally:
+            user.delete()
+
+        if brotli is None:
+            self.stdout.write("brotli is not installed: responses are gzip-compressed only")
+
+    def timed(self, work):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            work()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000
+
+    def measure(self, client, name, url, field_sets):
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(
+            f"  {'fields':<8} {'format':<8} {'identity':>9} "
+            + ''.join(f"{encoding:>9}" for encoding in self.encodings)
+            + f" {'render':>9} " + ''.join(f"{encoding + ' ms':>9}" for encoding in self.encodings) + f" {'parse':>9}"
+        )
+        for fields_name, fields in field_sets.items():
+            params = {"fields": fields} if fields else {}
+            for format_name, media_type, renderer, parse in (
+                ('json', 'application/json', JSONRenderer(), json.loads),
+                ('msgpack', MSGPACK, MessagePackRenderer(), msgpack.unpackb),
+            ):
+                response = client.get(url, params, HTTP_ACCEPT=media_type)
+                if response.status_code != 200:
+                    raise CommandError(f"{url} returned {response.status_code}")
+                body = response.content
+                data = parse(body)
+                sizes = [len(body)]
+                for encoding in self.encodings:
+                    sizes.append(len(client.get(url, params, HTTP_ACCEPT=media_type, HTTP_ACCEPT_ENCODING=encoding).content))
+
+                render = self.timed(lambda: renderer.render(data))
+                compress = [self.timed(lambda: gzip.compress(body, 6))]
+                if brotli is not None:
+                    compress.append(self.timed(lambda: brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)))
+                parsed = self.timed(lambda: parse(body))
+                self.stdout.write(
+                    f"  {fields_name:<8} {format_name:<8} "
+                    + ''.join(f"{size:>9,}" for size in sizes)
+                    + f" {render:>9.3f} " + ''.join(f"{ms:>9.3f}" for ms in compress) + f" {parsed:>9.3f}"
+                )
@@ -0,0 +1,66 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from api import reports
+from api.models import AuthToken
+from api.services import store_dataset
+
+
+class Command(BaseCommand):
+    help = "Time PDF report requests cold (drawn on the request) and warm (served from the report cache)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--categories', type=int, default=50,
+                            help="Distinct equipment types in the sample dataset.")
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f"report-bench-{uuid.uuid4().hex[:8]}")
+        token = AuthToken.objects.issue(user)[1]
+        client = Client(HTTP_AUTHORIZATION=f"Token {token}")
+
+        summary = {
+            "total_count": 1_000_000,
+            "averages": {"avg_flowrate": 119.8, "avg_pressure": 6.11, "avg_temp": 117.47},
+            "distribution": {f"Type-{n}": 100_000 // (n + 1) for n in range(options['categories'])},
+            "raw_data": [
+                {"Equipment Name": f"Pump-{n}", "Type": "Pump", "Flowrate": 120, "Pressure": 5.2, "Temperature": 110}
+                for n in range(10)
+            ],
+        }
+
+        try:
+            dataset = store_dataset(user, 'bench.csv', summary)
+            url = f"/api/download-pdf/{dataset.pk}/"
+
+            def fetch():
+                started = time.perf_counter()
+                response = client.get(url)
+                size = sum(len(block) for block in response.streaming_content)
+                return time.perf_counter() - started, size
+
+            cold, warm = [], []
+            for _ in range(options['repeat']):
+                reports.delete_report(dataset.pk)
+                elapsed, size = fetch()
+                cold.append(elapsed)
+            for _ in range(options['repeat']):
+                elapsed, _ = fetch()
+                warm.append(elapsed)
+        finally:
+            reports.delete_report(dataset.pk)
+            user.delete()
+
+        for name, timings in (('cold', cold), ('warm', warm)):
+            self.stdout.write(
+                f"{name}: mean {statistics.mean(timings) * 1000:8.2f} ms  "
+                f"median {statistics.median(timings) * 1000:8.2f} ms  max {max(timings) * 1000:8.2f} ms"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"{size:,} byte report; warm is {statistics.mean(cold) / statistics.mean(warm):.0f}x faster"
+        ))
@@ -0,0 +1,91 @@
+import statistics
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from api import columnar, rowquery
+from api.models import AuthToken
+from api.services import store_dataset
+from api.synthetic import equipment_frame
+
+QUERIES = {
+    "first page": {},
+    "projected": {"fields": "Type,Pressure"},
+    "sorted": {"sort": "-Pressure"},
+    "filtered": {"where": "Pressure>9"},
+    "rare match": {"where": "Pressure>12"},
+    "category": {"where": "Type=Pump", "sort": "Temperature"},
+    "rare, sorted": {"where": "Pressure>12", "sort": "Temperature"},
+    "range on sort": {"where": ["Temperature>=100", "Temperature<101"], "sort": "Temperature"},
+}
+
+
+class Command(BaseCommand):
+    help = "Time /api/datasets/<id>/rows/ pages (first, deep and followed cursors) against a large columnar store."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--requests', type=int, default=50, help="Timed requests per query and page kind.")
+        parser.add_argument('--limit', type=int, default=rowquery.DEFAULT_LIMIT)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        started = time.perf_counter()
+        writer = columnar.ColumnWriter(settings.COLUMN_STORE_DIR, max_bytes=2 ** 62)
+        for offset in range(0, rows, 1_000_000):
+            frame = equipment_frame(min(1_000_000, rows - offset), seed=offset, offset=offset)
+            writer.update(frame.astype({"Type": 'category', "Equipment Name": 'category'}))
+        column_store = columnar.commit(writer.finish(), columnar.store_key(''))
+        self.stdout.write(f"{rows:,} rows stored in {time.perf_counter() - started:.1f}s")
+
+        user = User.objects.create_user(username=f"rows-bench-{uuid.uuid4().hex[:8]}")
+        client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(user)[1]}")
+        try:
+            dataset = store_dataset(user, 'bench.csv', {"total_count": rows}, column_store=column_store)
+            url = f"/api/datasets/{dataset.pk}/rows/"
+            store = columnar.open_store(column_store['key'])
+
+            self.stdout.write(f"{'query':<14} {'cold':>9} {'p50':>9} {'p95':>9} {'deep p95':>9} {'next p95':>9}")
+            for name, params in QUERIES.items():
+                params = {**params, "limit": options['limit']}
+                cold, _ = self.get(client, url, params)
+
+                def percentile(timings, q):
+                    return statistics.quantiles(timings, n=100)[q - 1] * 1000
+
+                first = [self.get(client, url, params)[0] for _ in range(options['requests'])]
+                # Halfway through whatever the ordering spans, through a cursor.
+                query = rowquery.RowQuery(store, sort=params.get('sort'), where=self.where(params))
+                deep_params = {**params, "cursor": query.cursor(rows // 2)}
+                deep = [self.get(client, url, deep_params)[0] for _ in range(options['requests'])]
+                following, page = [], self.get(client, url, params)[1]
+                for _ in range(options['requests']):
+                    if not page['next']:
+                        break
+                    elapsed, page = self.get(client, page['next'])
+                    following.append(elapsed)
+
+                self.stdout.write(
+                    f"{name:<14} {cold * 1000:7.1f}ms {percentile(first, 50):7.1f}ms {percentile(first, 95):7.1f}ms "
+                    f"{percentile(deep, 95):7.1f}ms "
+                    + (f"{percentile(following, 95):7.1f}ms" if len(following) > 1 else f"{'-':>9}")
+                )
+        finally:
+            user.delete()
+
+    @staticmethod
+    def where(params):
+        where = params.get('where', [])
+        return [where] if isinstance(where, str) else where
+
+    @staticmethod
+    def get(client, url, params=None):
+        started = time.perf_counter()
+        response = client.get(url, params)
+        elapsed = time.perf_counter() - started
+        assert response.status_code == 200, response.content
+        return elapsed, response.json()
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections, transaction
+
+from api.models import DatasetDistribution, DatasetPreview, EquipmentDataset
+
+MODES = {
+    'default': {},
+    'tuned': settings.SQLITE_TUNED_OPTIONS,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare write throughput on a local SQLite file with stock settings and "
+        "with SQLITE_TUNED_OPTIONS, using concurrent dataset inserts plus history reads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--read-interval', type=float, default=0.01,
+                            help="Pause between one reader's history reads, in seconds.")
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--keep', type=int, default=5, help="Datasets kept per user, as in retention.")
+        parser.add_argument('--dir', help="Where to create the database files; pick the disk production uses, "
+                                               "since fsync cost is most of the difference.")
+        parser.add_argument('--mode', choices=sorted(MODES), action='append', dest='modes')
+
+    def handle(self, *args, **options):
+        results = {}
+        with tempfile.TemporaryDirectory(dir=options['dir']) as workdir:
+            for mode in options['modes'] or ['default', 'tuned']:
+                alias = f"bench_{mode}"
+                connections.settings[alias] = {
+                    **connections.settings['default'],
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': os.path.join(workdir, f"{mode}.sqlite3"),
+                    'OPTIONS': MODES[mode],
+                    'TEST': {},
+                }
+                try:
+                    call_command('migrate', database=alias, verbosity=0)
+                    results[mode] = self.run(alias, options)
+                finally:
+                    connections[alias].close()
+                    del connections.settings[alias]
+
+        for mode, (commits, reads, errors, elapsed) in results.items():
+            self.stdout.write(
+                f"{mode:>8}: {commits / elapsed:8.1f} writes/s  {reads / elapsed:8.1f} reads/s  "
+                f"{errors} 'database is locked' errors"
+            )
+        if 'default' in results and 'tuned' in results and results['default'][0]:
+            speedup = results['tuned'][0] / results['default'][0]
+            self.stdout.write(self.style.SUCCESS(f"tuned writes {speedup:.1f}x default"))
+
+    def run(self, alias, options):
+        users = [
+            User.objects.db_manager(alias).create(username=f"writer-{n}")
+            for n in range(options['writers'])
+        ]
+        counts = {'commits': 0, 'reads': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def count(name):
+            with lock:
+                counts[name] += 1
+
+        def writer(user):
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        self.store(alias, user, options['keep'])
+                        count('commits')
+                    except OperationalError:
+                        count('errors')
+            finally:
+                connections[alias].close()
+
+        def reader(n):
+            user = users[n % len(users)]
+            try:
+                while time.monotonic() < deadline:
+                    try:
+                        list(EquipmentDataset.objects.using(alias).filter(user=user)
+                             .values('id', 'file_name', 'upload_date'))
+                        count('reads')
+                    except OperationalError:
+                        count('errors')
+                    time.sleep(options['read_interval'])
+            finally:
+                connections[alias].close()
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['writers'] + options['readers']) as pool:
+            futures = [pool.submit(writer, user) for user in users]
+            futures += [pool.submit(reader, n) for n in range(options['readers'])]
+            for future in futures:
+                future.result()
+        return counts['commits'], counts['reads'], counts['errors'], time.monotonic() - started
+
+    def store(self, alias, user, keep):
+        """The same statements store_dataset issues, against the bench database."""
+        with transaction.atomic(using=alias):
+            dataset = EquipmentDataset.objects.using(alias).create(
+                user=user, file_name='bench.csv', total_count=15,
+                avg_flowrate=119.8, avg_pressure=6.11, avg_temp=117.47,
+            )
+            DatasetDistribution.objects.using(alias).bulk_create([
+                DatasetDistribution(dataset=dataset, category=category, count=n)
+                for n, category in enumerate(['Pump', 'Valve', 'Compressor', 'Reactor'], start=1)
+            ])
+            DatasetPreview.objects.using(alias).create(dataset=dataset, rows=[{"Type": "Pump"}] * 10)
+            newest_first = EquipmentDataset.objects.using(alias).filter(user=user).order_by('-upload_date', '-pk')
+            EquipmentDataset.objects.using(alias).filter(
+                user=user, pk__in=newest_first.values('pk')[keep:]
+            ).delete()
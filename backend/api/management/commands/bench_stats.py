@@ -0,0 +1,87 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from api.models import AuthToken, EquipmentDataset, RetentionPolicy
+
+
+def _summary(n):
+    flowrate, pressure, temp = 100 + n % 7, 5 + n % 3, 80 + n % 11
+    return {
+        "total_count": 1000,
+        "averages": {"avg_flowrate": flowrate, "avg_pressure": pressure, "avg_temp": temp},
+        "totals": {
+            "avg_flowrate": {"sum": flowrate * 1000.0, "count": 1000},
+            "avg_pressure": {"sum": pressure * 990.0, "count": 990},
+            "avg_temp": {"sum": temp * 1000.0, "count": 1000},
+        },
+        "distribution": {"Pump": 600, "Valve": 400},
+        "raw_data": [],
+    }
+
+
+def _combine_summaries(datasets):
+    """What a client had to do before /api/stats/: fetch every summary and combine the rounded averages."""
+    count = 0
+    weighted = dict.fromkeys(("avg_flowrate", "avg_pressure", "avg_temp"), 0.0)
+    for dataset in datasets:
+        summary = dataset.to_summary(include_preview=False)
+        count += summary['total_count']
+        for key in weighted:
+            weighted[key] += (summary['averages'][key] or 0) * summary['total_count']
+    return {key: value / count for key, value in weighted.items()} if count else {}
+
+
+class Command(BaseCommand):
+    help = "Time /api/stats/ as a user's history grows, against combining every stored summary."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,5000',
+                            help="Comma-separated history sizes (datasets per user).")
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--naive-limit', type=int, default=1000,
+                            help="Skip the summary-combining baseline above this history size.")
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        header = f"{'datasets':>9} {'all':>10} {'last=10':>10} {'last=half':>10} {'combine summaries':>18}"
+        self.stdout.write(header)
+
+        for size in sizes:
+            user = User.objects.create_user(username=f"stats-bench-{uuid.uuid4().hex[:8]}")
+            RetentionPolicy.objects.create(user=user, max_datasets=size)
+            client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(user)[1]}")
+            try:
+                for start in range(0, size, 1000):
+                    EquipmentDataset.objects.bulk_create_from_summaries(user, [
+                        (f"bench-{n}.csv", _summary(n), None, None) for n in range(start, min(start + 1000, size))
+                    ])
+
+                def median_ms(url):
+                    timings = []
+                    for _ in range(options['requests']):
+                        started = time.perf_counter()
+                        response = client.get(url)
+                        timings.append(time.perf_counter() - started)
+                        assert response.status_code == 200, response.content
+                    return statistics.median(timings) * 1000
+
+                row = [median_ms('/api/stats/'), median_ms('/api/stats/?last=10'),
+                       median_ms(f'/api/stats/?last={max(size // 2, 1)}')]
+                if size <= options['naive_limit']:
+                    started = time.perf_counter()
+                    _combine_summaries(EquipmentDataset.objects.filter(user=user))
+                    naive = f"{(time.perf_counter() - started) * 1000:15.2f} ms"
+                else:
+                    naive = f"{'skipped':>18}"
+                self.stdout.write(f"{size:>9} " + " ".join(f"{value:7.2f} ms" for value in row) + f" {naive}")
+            finally:
+                user.delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            "'all' reads the running totals: flat in history size. Selections sum indexed columns in the database."
+        ))
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import columnar
+from api.chunked import expire_uploads
+from api.models import AuthToken, DatasetChange, RetentionPolicy
+from api.retention import compact, users_over_limit
+
+
+class Command(BaseCommand):
+    help = (
+        "Trim every user's history to their retention limit. Uploads trim as they go; "
+        "run this after lowering a limit or to clear a backlog."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME',
+                            help="Only compact these users. Repeatable.")
+        parser.add_argument('--set-limit', type=int, metavar='N',
+                            help="Give the --user(s) their own retention limit first; 0 removes it.")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be removed.")
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            users = dict(User.objects.filter(username__in=options['usernames']).values_list('username', 'pk'))
+            unknown = set(options['usernames']) - set(users)
+            if unknown:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(unknown))}")
+            user_ids = list(users.values())
+
+        if options['set_limit'] is not None:
+            if user_ids is None:
+                raise CommandError("--set-limit needs at least one --user")
+            self.set_limit(user_ids, options['set_limit'])
+
+        if options['dry_run']:
+            candidates = users_over_limit()
+            if user_ids is not None:
+                candidates = candidates.filter(user_id__in=user_ids)
+            for user_id, total, limit in candidates:
+                self.stdout.write(f"user {user_id}: {total} datasets, would remove {total - limit}")
+            return
+
+        removed = compact(user_ids)
+        for user_id, count in removed.items():
+            self.stdout.write(f"user {user_id}: removed {count} dataset(s)")
+        # Trimmed datasets release their columnar stores; this catches any a crash left behind.
+        swept = columnar.sweep()
+        pruned = DatasetChange.objects.prune(timezone.now() - timedelta(days=settings.SYNC_CHANGE_LOG_DAYS))
+        expired = AuthToken.objects.prune()
+        abandoned = expire_uploads(timezone.now() - timedelta(hours=settings.CHUNKED_UPLOAD_EXPIRE_HOURS))
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {len(removed)} user(s), {sum(removed.values())} dataset(s) removed, "
+            f"{swept} orphaned column store(s) swept, {pruned} sync change(s) pruned, "
+            f"{expired} expired login token(s) removed, {abandoned} abandoned upload(s) aborted"
+        ))
+
+    def set_limit(self, user_ids, limit):
+        if limit < 0:
+            raise CommandError("--set-limit must be 0 or more")
+        if limit == 0:
+            RetentionPolicy.objects.filter(user_id__in=user_ids).delete()
+            return
+        for user_id in user_ids:
+            RetentionPolicy.objects.update_or_create(user_id=user_id, defaults={"max_datasets": limit})
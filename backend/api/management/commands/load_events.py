@@ -0,0 +1,179 @@
+import asyncio
+import json
+import os
+import socket
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api import events
+from api.models import AuthToken
+
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) > 1 else values[0] * 1000
+
+
+class Subscriber:
+    """One raw SSE connection: reads the stream, counts heartbeats and notes when bench events land."""
+
+    def __init__(self, token):
+        self.token = token
+        self.heartbeats = 0
+        self.latencies = []
+        self.connected = False
+        self.reader = self.writer = None
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', port)
+        self.writer.write((
+            f"GET /api/async/events/ HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"Authorization: Token {self.token}\r\nAccept: text/event-stream\r\n\r\n"
+        ).encode())
+        await self.writer.drain()
+        status = await self.reader.readline()
+        if b' 200 ' not in status:
+            raise CommandError(f"Subscribe failed: {status.decode().strip()}")
+        while await self.reader.readline() not in (b'\r\n', b''):
+            pass
+        self.connected = True
+
+    async def listen(self):
+        name = None
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                # Chunked transfer framing around the event lines is skipped here.
+                line = line.strip()
+                if line == b':':
+                    self.heartbeats += 1
+                elif line.startswith(b'event: '):
+                    name = line[7:].decode()
+                elif line.startswith(b'data: ') and name == 'bench':
+                    self.latencies.append(time.perf_counter() - json.loads(line[6:])['sent'])
+        finally:
+            self.connected = False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class Command(BaseCommand):
+    help = (
+        "Hold many idle /api/async/events/ subscribers open against an in-process uvicorn server, "
+        "then time fan-out through the broker and check that disconnects unsubscribe."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=1000)
+        parser.add_argument('--users', type=int, default=100, help="Subscribers are spread over this many users.")
+        parser.add_argument('--hold', type=float, default=None,
+                            help="Seconds to hold them idle; defaults to two heartbeats.")
+        parser.add_argument('--events', type=int, default=20, help="Events published to every user.")
+        parser.add_argument('--interval', type=float, default=0.5, help="Seconds between rounds of events.")
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn
+        except ImportError:
+            raise CommandError("load_events needs uvicorn installed")
+        if options['subscribers'] > options['users'] * settings.EVENTS_MAX_STREAMS_PER_USER:
+            raise CommandError("More subscribers than --users times EVENTS_MAX_STREAMS_PER_USER allows")
+
+        # Imported here: building the ASGI app sets up Django's handler, which only this command needs.
+        from chemical_project.asgi import application
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(
+            application, host='127.0.0.1', port=port, log_level='warning', lifespan='off',
+            backlog=max(2048, options['subscribers']),
+        ))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.05)
+
+        prefix = f"events-load-{uuid.uuid4().hex[:8]}"
+        users = User.objects.bulk_create([User(username=f"{prefix}-{i}") for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith=prefix))
+        tokens = [AuthToken.objects.issue(user)[1] for user in users]
+        try:
+            asyncio.run(self.run(port, users, tokens, options))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+            User.objects.filter(username__startswith=prefix).delete()
+
+    async def run(self, port, users, tokens, options):
+        count = options['subscribers']
+        hold = options['hold'] if options['hold'] is not None else 2 * settings.EVENTS_HEARTBEAT_SECONDS + 1
+        subscribers = [Subscriber(tokens[i % len(tokens)]) for i in range(count)]
+        before, fds = rss_mb(), len(os.listdir('/proc/self/fd'))
+
+        started = time.perf_counter()
+        # In waves, as a fleet of clients starting up would, not as one SYN flood.
+        for first in range(0, count, 100):
+            await asyncio.gather(*(subscriber.connect(port) for subscriber in subscribers[first:first + 100]))
+        connect_time = time.perf_counter() - started
+        listeners = [asyncio.create_task(subscriber.listen()) for subscriber in subscribers]
+        while events.broker.subscriber_count() < count:
+            await asyncio.sleep(0.05)
+        after = rss_mb()
+        self.stdout.write(
+            f"{count:,} subscribers over {len(users)} users connected in {connect_time:.2f}s; "
+            f"RSS {before:,.0f} -> {after:,.0f} MB ({(after - before) * 1024 / count:.1f} KB each, "
+            f"client side included), {len(os.listdir('/proc/self/fd')) - fds:,} more open fds"
+        )
+
+        await asyncio.sleep(hold)
+        alive = sum(subscriber.connected for subscriber in subscribers)
+        heartbeats = [subscriber.heartbeats for subscriber in subscribers]
+        self.stdout.write(
+            f"after {hold:.0f}s idle: {alive:,}/{count:,} connected, {events.broker.subscriber_count():,} subscribed, "
+            f"heartbeats per stream min {min(heartbeats)} max {max(heartbeats)}"
+        )
+
+        started = time.perf_counter()
+        for _ in range(options['events']):
+            for user in users:
+                events.publish(user.pk, 'bench', {"sent": time.perf_counter()})
+            await asyncio.sleep(options['interval'])
+        expected = options['events'] * count
+        while sum(len(s.latencies) for s in subscribers) < expected and time.perf_counter() - started < 30:
+            await asyncio.sleep(0.05)
+        latencies = [latency for subscriber in subscribers for latency in subscriber.latencies]
+        self.stdout.write(
+            f"fan-out: {len(latencies):,}/{expected:,} events delivered; latency "
+            f"p50 {percentile(latencies, 50):.1f}ms p95 {percentile(latencies, 95):.1f}ms "
+            f"max {max(latencies) * 1000:.1f}ms"
+        )
+
+        for subscriber in subscribers:
+            subscriber.close()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        deadline = time.perf_counter() + 10
+        while events.broker.subscriber_count() and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        remaining = events.broker.subscriber_count()
+        self.stdout.write(
+            self.style.SUCCESS(f"all {count:,} disconnected; {remaining} subscriptions left in the broker")
+            if not remaining else self.style.ERROR(f"{remaining} subscriptions were not released")
+        )
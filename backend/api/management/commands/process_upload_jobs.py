@@ -0,0 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import STALE_AFTER, drain_queue, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = "Process queued upload jobs. Run alongside the web server when UPLOAD_WORKER_MODE=external."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument('--stale-minutes', type=int, default=int(STALE_AFTER.total_seconds() // 60),
+                            help="Requeue running jobs not updated for this long.")
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options['stale_minutes'])
+        while True:
+            requeued = requeue_stale_jobs(stale_after)
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale job(s)"))
+
+            processed = drain_queue()
+            if processed:
+                self.stdout.write(f"Processed {processed} job(s)")
+
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,47 @@
+import os
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import scratch_database
+from api.simulations import InterruptedUpload, SimulationError
+from api.synthetic import write_equipment_csv
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the resumable upload API through dropped and truncated chunk transfers, in a throwaway "
+        "copy of the database, resuming from the server's received ranges, and check the result "
+        "matches a one-shot parse."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000)
+        parser.add_argument('--chunk-size', type=int, default=256 * 1024)
+        parser.add_argument('--drop-rate', type=float, default=0.3,
+                            help="Share of chunk sends cut off half way.")
+        parser.add_argument('--interrupt-after', type=int, default=5,
+                            help="Chunks sent per connection before it is dropped and resumed.")
+        parser.add_argument('--parallel', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with scratch_database() as workdir:
+            csv_path = write_equipment_csv(os.path.join(workdir, 'harness.csv'), options['rows'], seed=options['seed'])
+            transfer = InterruptedUpload(
+                User.objects.create_user(username='chunked-harness'), csv_path, random.Random(options['seed']),
+                options['chunk_size'], options['drop_rate'], options['interrupt_after'], options['parallel'],
+            )
+            try:
+                figures = transfer.run()
+            except SimulationError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(
+            f"{figures['chunks']} chunks, {figures['sends']} sends over {figures['rounds']} rounds, "
+            f"{figures['dropped']} cut off and resent"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Resumed upload matches a one-shot parse ({figures['job'].result['total_count']:,} rows)"
+        ))
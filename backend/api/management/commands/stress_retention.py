@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import scratch_database
+from api.simulations import SimulationError, stress_retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Store datasets for one user from many threads at once, in a throwaway copy of the "
+        "database, and check the retention limit holds throughout and at the end."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploaders', type=int, default=8)
+        parser.add_argument('--uploads', type=int, default=25, help="Datasets stored per uploader.")
+        parser.add_argument('--limit', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            user = User.objects.create_user(username='retention-stress')
+            try:
+                figures = stress_retention(user, options['uploaders'], options['uploads'], options['limit'])
+            except SimulationError as e:
+                raise CommandError(str(e))
+
+        self.stdout.write(
+            f"{figures['stored']} datasets stored by {options['uploaders']} threads in {figures['elapsed']:.2f}s "
+            f"({figures['retries']} lock retries); peak {figures['peak']}, final {figures['final']}, "
+            f"limit {options['limit']}"
+        )
+        self.stdout.write(self.style.SUCCESS("Retention limit held"))
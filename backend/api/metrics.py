@@ -0,0 +1,182 @@
+"""
+In-process histograms and counters of where the server spends its time,
+rendered in the Prometheus text format at /api/metrics/.
+
+Code marks a hot path with span(name); its duration goes to the
+vista_span_seconds histogram and, inside a request, to that request's
+Server-Timing header (see api.middleware). Database queries are timed by a
+wrapper on every connection, CSV parses by phase (see record_parse).
+
+No Django imports, so parsing code running in batch worker processes can use
+it; those processes send their timings back with their results. Figures are
+per process: a deployment with several server processes has to scrape each.
+"""
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a quick query to a large upload's parse.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+
+# Spans observed in the current request, as (name, seconds); None outside one.
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return lines + list(self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{self._label_text(key)} {_format(value)}"
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Count per bucket, the last one past every bound, and the sum.
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self._label_text(key, [('le', _format(bound))])} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(key)} {_format(total)}"
+            yield f"{self.name}_count{self._label_text(key)} {cumulative}"
+
+
+REQUESTS = Histogram(
+    'vista_http_request_seconds', "Time to produce a response, by URL pattern.", ['method', 'route', 'status'],
+)
+SPANS = Histogram('vista_span_seconds', "Time spent in instrumented code paths.", ['span'])
+QUERIES = Histogram('vista_db_query_seconds', "Time per database query.")
+CSV_ROWS = Counter('vista_csv_rows_total', "CSV rows parsed; over vista_span_seconds_sum{span=\"csv.parse\"}, rows per second.")
+CSV_BYTES = Counter('vista_csv_bytes_total', "CSV bytes parsed.")
+
+
+def observe(name, seconds):
+    """Count `seconds` spent in the span `name`, as span() does."""
+    SPANS.observe(seconds, span=name)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((name, seconds))
+
+
+@contextmanager
+def span(name):
+    """Time the block as the span `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+@contextmanager
+def request_spans():
+    """Collect the spans observed in this context into the list it yields; sync_to_async carries it to threads."""
+    spans = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def record_parse(timings):
+    """Record the phase timings ingest.summarize filled in for one CSV."""
+    for phase in ('read', 'parse', 'aggregate', 'consumers'):
+        observe(f"csv.{phase}", timings[phase])
+    CSV_ROWS.inc(timings['rows'])
+    CSV_BYTES.inc(timings['bytes'])
+
+
+def time_query(execute, sql, params, many, context):
+    """A connection execute_wrapper timing every query; see django.db.connection.execute_wrapper."""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        QUERIES.observe(elapsed)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append(('db', elapsed))
+
+
+def render(extra=()):
+    """
+    Every metric in the Prometheus text format. extra adds figures kept
+    elsewhere, each (name, 'counter' or 'gauge', help, [(labels dict, value), ...]).
+    """
+    lines = []
+    for metric in _registry:
+        lines += metric.render()
+    for name, kind, help, values in extra:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        for labels, value in values:
+            label_text = ','.join(f'{key}="{_escape(label)}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {_format(value)}" if label_text else f"{name} {_format(value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,111 @@
+"""
+Request timing. Every response's duration goes to the
+vista_http_request_seconds histogram under its URL pattern, and the spans
+observed while producing it (database queries, CSV phases, report drawing)
+to its Server-Timing header, sent to staff only unless SERVER_TIMING_PUBLIC
+is set.
+
+Staff can profile a request by sending `X-Profile: 1`: the response is then
+replaced by cProfile's report of it, as text, with the original status in
+X-Profile-Status. One request is profiled at a time per process, and only
+under WSGI; under ASGI sync views run on other threads than the profiler's.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+
+from . import authentication, metrics
+from .models import AuthToken
+
+# Functions listed in a profile report, by cumulative time.
+PROFILE_LINES = 60
+
+_profiling = threading.Lock()
+
+
+def wants_profile(request):
+    """True for `X-Profile: 1` from a staff user's token."""
+    if request.headers.get('X-Profile') != '1':
+        return False
+    key = authentication.token_key(request)
+    if key is None:
+        return False
+    # Not through authentication.resolve(), which may rotate the token before the view sees it.
+    return AuthToken.objects.filter(
+        pk=AuthToken.digest_of(key), expires_at__gt=timezone.now(), user__is_active=True, user__is_staff=True,
+    ).exists()
+
+
+def server_timing(spans, total):
+    """A Server-Timing header value: each span's total and the request's, in milliseconds."""
+    totals = {}
+    for name, seconds in spans:
+        count, elapsed = totals.get(name, (0, 0.0))
+        totals[name] = (count + 1, elapsed + seconds)
+    entries = [f'{name};desc="{count}x";dur={elapsed * 1000:.1f}' for name, (count, elapsed) in totals.items()]
+    return ', '.join(entries + [f"total;dur={total * 1000:.1f}"])
+
+
+def profile_response(profiler, response, elapsed):
+    out = io.StringIO()
+    out.write(f"{response.status_code} in {elapsed * 1000:.1f}ms\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+    profiled = HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+    profiled['X-Profile-Status'] = str(response.status_code)
+    return profiled
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        with metrics.request_spans() as spans:
+            if wants_profile(request) and _profiling.acquire(blocking=False):
+                profiler = cProfile.Profile()
+                try:
+                    response = profiler.runcall(self.get_response, request)
+                finally:
+                    _profiling.release()
+                elapsed = time.perf_counter() - started
+                self.record(request, response, spans, elapsed)
+                return profile_response(profiler, response, elapsed)
+            response = self.get_response(request)
+        return self.record(request, response, spans, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with metrics.request_spans() as spans:
+            response = await self.get_response(request)
+        if request.headers.get('X-Profile') == '1':
+            response['X-Profile'] = 'unavailable under ASGI'
+        return self.record(request, response, spans, time.perf_counter() - started)
+
+    @staticmethod
+    def record(request, response, spans, elapsed):
+        match = request.resolver_match
+        metrics.REQUESTS.observe(
+            elapsed, method=request.method, route=match.route if match else 'unmatched', status=response.status_code,
+        )
+        # The view has authenticated the request by now, token or not.
+        user = getattr(request, 'user', None)
+        if settings.SERVER_TIMING_PUBLIC or (user is not None and user.is_staff):
+            response['Server-Timing'] = server_timing(spans, elapsed)
+        return response
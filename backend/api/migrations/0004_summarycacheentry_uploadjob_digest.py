@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_uploadjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SummaryCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('summary', models.JSONField()),
+                ('size', models.PositiveIntegerField(help_text='Serialized summary size in bytes')),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Summary Cache Entry',
+                'verbose_name_plural': 'Summary Cache Entries',
+            },
+        ),
+        migrations.AddField(
+            model_name='uploadjob',
+            name='digest',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 5.2.10 on 2026-10-17 23:54
+
+import math
+from collections import Counter
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def split_summaries(apps, schema_editor):
+    EquipmentDataset = apps.get_model('api', 'EquipmentDataset')
+    DatasetDistribution = apps.get_model('api', 'DatasetDistribution')
+    DatasetPreview = apps.get_model('api', 'DatasetPreview')
+    db = schema_editor.connection.alias
+
+    for dataset in EquipmentDataset.objects.using(db).iterator(chunk_size=500):
+        summary = dataset.summary_data or {}
+        averages = summary.get('averages') or {}
+        dataset.total_count = int(summary.get('total_count') or 0)
+        dataset.avg_flowrate = _number(averages.get('avg_flowrate'))
+        dataset.avg_pressure = _number(averages.get('avg_pressure'))
+        dataset.avg_temp = _number(averages.get('avg_temp'))
+        dataset.save(update_fields=['total_count', 'avg_flowrate', 'avg_pressure', 'avg_temp'])
+
+        # Labels that agree in their first 255 characters share a row, or they would collide.
+        counts = Counter()
+        for category, count in (summary.get('distribution') or {}).items():
+            counts[str(category)[:255]] += int(count)
+        DatasetDistribution.objects.using(db).bulk_create([
+            DatasetDistribution(dataset=dataset, category=category, count=count)
+            for category, count in counts.items()
+        ])
+        DatasetPreview.objects.using(db).create(dataset=dataset, rows=summary.get('raw_data') or [])
+
+
+def join_summaries(apps, schema_editor):
+    EquipmentDataset = apps.get_model('api', 'EquipmentDataset')
+    DatasetDistribution = apps.get_model('api', 'DatasetDistribution')
+    DatasetPreview = apps.get_model('api', 'DatasetPreview')
+    db = schema_editor.connection.alias
+
+    for dataset in EquipmentDataset.objects.using(db).iterator(chunk_size=500):
+        distribution = DatasetDistribution.objects.using(db).filter(dataset=dataset).order_by('-count', 'category')
+        preview = DatasetPreview.objects.using(db).filter(dataset=dataset).values_list('rows', flat=True).first()
+        dataset.summary_data = {
+            "total_count": dataset.total_count,
+            "averages": {
+                "avg_flowrate": dataset.avg_flowrate,
+                "avg_pressure": dataset.avg_pressure,
+                "avg_temp": dataset.avg_temp,
+            },
+            "distribution": dict(distribution.values_list('category', 'count')),
+            "raw_data": preview or [],
+        }
+        dataset.save(update_fields=['summary_data'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_chunkedupload_uploadchunk'),
+    ]
+
+    operations = [
+        # Nullable while the data moves, so the reverse migration can re-add it to existing rows.
+        migrations.AlterField(
+            model_name='equipmentdataset',
+            name='summary_data',
+            field=models.JSONField(null=True),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='avg_flowrate',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='avg_pressure',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='avg_temp',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='total_count',
+            field=models.PositiveBigIntegerField(db_index=True, default=0),
+        ),
+        migrations.CreateModel(
+            name='DatasetPreview',
+            fields=[
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='preview', serialize=False, to='api.equipmentdataset')),
+                ('rows', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DatasetDistribution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=255)),
+                ('count', models.PositiveBigIntegerField()),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='distribution', to='api.equipmentdataset')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('dataset', 'category'), name='unique_dataset_category')],
+            },
+        ),
+        migrations.RunPython(split_summaries, join_summaries),
+        migrations.RemoveField(
+            model_name='equipmentdataset',
+            name='summary_data',
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='summarycacheentry',
+            name='rollups',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AlterField(
+            model_name='summarycacheentry',
+            name='size',
+            field=models.PositiveIntegerField(help_text='Serialized summary and rollups size in bytes'),
+        ),
+        migrations.CreateModel(
+            name='DatasetRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(choices=[('type', 'Equipment Type'), ('equipment', 'Equipment Name')], max_length=16)),
+                ('key', models.CharField(max_length=255)),
+                ('bucket_start', models.DateTimeField(blank=True, null=True)),
+                ('bucket_seconds', models.PositiveIntegerField(blank=True, null=True)),
+                ('count', models.PositiveBigIntegerField()),
+                ('stats', models.JSONField()),
+                ('sample', models.JSONField(default=list, help_text='Uniform sample of readings, for percentiles')),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='api.equipmentdataset')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dataset', 'scope', 'key', 'bucket_start'], name='rollup_window_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+METRIC_TOTALS = {
+    "avg_flowrate": ("sum_flowrate", "count_flowrate"),
+    "avg_pressure": ("sum_pressure", "count_pressure"),
+    "avg_temp": ("sum_temp", "count_temp"),
+}
+TOTAL_FIELDS = ['total_count'] + [field for fields in METRIC_TOTALS.values() for field in fields]
+
+
+def backfill_totals(apps, schema_editor):
+    EquipmentDataset = apps.get_model('api', 'EquipmentDataset')
+    UserAggregate = apps.get_model('api', 'UserAggregate')
+    db = schema_editor.connection.alias
+
+    # Existing datasets only kept rounded averages; their sums are rebuilt from them.
+    for average, (sum_field, count_field) in METRIC_TOTALS.items():
+        EquipmentDataset.objects.using(db).filter(**{f"{average}__isnull": False}).update(**{
+            sum_field: F(average) * F('total_count'),
+            count_field: F('total_count'),
+        })
+
+    per_user = (
+        EquipmentDataset.objects.using(db).order_by().values('user_id')
+        .annotate(dataset_count=Count('pk'), **{field: Sum(field) for field in TOTAL_FIELDS})
+    )
+    UserAggregate.objects.using(db).bulk_create([UserAggregate(**row) for row in per_user], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_dataset_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='count_flowrate',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='count_pressure',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='count_temp',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='sum_flowrate',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='sum_pressure',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='sum_temp',
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name='UserAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dataset_count', models.PositiveIntegerField(default=0)),
+                ('total_count', models.BigIntegerField(default=0)),
+                ('sum_flowrate', models.FloatField(default=0)),
+                ('count_flowrate', models.BigIntegerField(default=0)),
+                ('sum_pressure', models.FloatField(default=0)),
+                ('count_pressure', models.BigIntegerField(default=0)),
+                ('sum_temp', models.FloatField(default=0)),
+                ('count_temp', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dataset_aggregate', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
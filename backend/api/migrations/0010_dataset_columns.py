@@ -0,0 +1,23 @@
+# Generated by Django 5.2.10 on 2026-10-18 00:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_dataset_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='column_bytes',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='equipmentdataset',
+            name='column_key',
+            field=models.CharField(blank=True, db_index=True, help_text='Columnar copy under COLUMN_STORE_DIR, if kept', max_length=64),
+        ),
+    ]
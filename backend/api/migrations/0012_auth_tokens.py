@@ -0,0 +1,48 @@
+# Generated by Django 5.2.10 on 2026-10-18 01:32
+
+import hashlib
+from datetime import timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def hash_existing_tokens(apps, schema_editor):
+    Token = apps.get_model('authtoken', 'Token')
+    AuthToken = apps.get_model('api', 'AuthToken')
+    db = schema_editor.connection.alias
+
+    # Clients already signed in keep their key, with a full lifetime from now;
+    # the plain-text copies go.
+    now = django.utils.timezone.now()
+    expires_at = now + timedelta(seconds=settings.AUTH_TOKEN_TTL_SECONDS)
+    AuthToken.objects.using(db).bulk_create([
+        AuthToken(digest=hashlib.sha256(key.encode()).hexdigest(), user_id=user_id, created_at=now, expires_at=expires_at)
+        for key, user_id in Token.objects.using(db).values_list('key', 'user_id')
+    ], batch_size=500)
+    Token.objects.using(db).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_dataset_changes'),
+        ('authtoken', '0004_alter_tokenproxy_options'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthToken',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('replaced_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auth_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(hash_existing_tokens, migrations.RunPython.noop),
+    ]
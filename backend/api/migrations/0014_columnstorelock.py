@@ -0,0 +1,21 @@
+# Generated by Django 5.2.10 on 2026-10-18 02:16
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_uploadjob_waiting'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ColumnStoreLock',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('locked_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -1,17 +1,583 @@
-from django.db import models
+import hashlib
+import secrets
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Sum
 from django.contrib.auth.models import User
+from django.core.validators import MinValueValidator
+from django.utils import timezone
+
+from . import columnar, events
+
+# Exact running sum and count columns behind each average, on datasets and user aggregates.
+METRIC_TOTALS = {
+    "avg_flowrate": ("sum_flowrate", "count_flowrate"),
+    "avg_pressure": ("sum_pressure", "count_pressure"),
+    "avg_temp": ("sum_temp", "count_temp"),
+}
+TOTAL_FIELDS = ['total_count'] + [field for fields in METRIC_TOTALS.values() for field in fields]
+
+
+class EquipmentDatasetManager(models.Manager):
+    @staticmethod
+    def _columns(summary):
+        averages = summary.get('averages', {})
+        totals = summary.get('totals', {})
+        columns = {
+            "total_count": summary.get('total_count', 0),
+            "avg_flowrate": averages.get('avg_flowrate'),
+            "avg_pressure": averages.get('avg_pressure'),
+            "avg_temp": averages.get('avg_temp'),
+        }
+        for key, (sum_field, count_field) in METRIC_TOTALS.items():
+            if key in totals:
+                columns[sum_field], columns[count_field] = totals[key]['sum'], totals[key]['count']
+            elif columns[key] is not None:
+                # Summaries cached before totals existed: rebuilt from the rounded average.
+                columns[sum_field], columns[count_field] = columns[key] * columns['total_count'], columns['total_count']
+        return columns
+
+    @staticmethod
+    def _children(dataset, summary):
+        # Labels that agree in their first 255 characters share a row, or they would collide.
+        counts = Counter()
+        for category, count in summary.get('distribution', {}).items():
+            counts[str(category)[:255]] += count
+        distribution = [
+            DatasetDistribution(dataset=dataset, category=category, count=count)
+            for category, count in counts.items()
+        ]
+        return distribution, DatasetPreview(dataset=dataset, rows=summary.get('raw_data', []))
+
+    @staticmethod
+    def _store_columns(column_store):
+        if not column_store:
+            return {}
+        return {"column_key": column_store['key'], "column_bytes": column_store['bytes']}
+
+    @staticmethod
+    def _rollups(dataset, rollups):
+        return [
+            DatasetRollup(
+                dataset=dataset,
+                scope=row['scope'],
+                key=str(row['key'])[:255],
+                bucket_start=datetime.fromisoformat(row['bucket_start']) if row['bucket_start'] else None,
+                bucket_seconds=row['bucket_seconds'],
+                count=row['count'],
+                stats=row['stats'],
+                sample=row['sample'],
+            )
+            for row in rollups or ()
+        ]
+
+    def create_from_summary(self, user, file_name, summary, rollups=None, column_store=None):
+        """
+        Store a process_csv summary, and its rollup rows, across the dataset row
+        and its child tables. column_store is the manifest of its columnar copy;
+        should that store be gone by the time the row goes in, the dataset is
+        stored without one (see columnar.claim).
+        """
+        with transaction.atomic():
+            column_store = columnar.claim(column_store)
+            dataset = self.create(
+                user=user, file_name=file_name, **self._columns(summary), **self._store_columns(column_store)
+            )
+            distribution, preview = self._children(dataset, summary)
+            DatasetDistribution.objects.bulk_create(distribution)
+            preview.save(force_insert=True)
+            DatasetRollup.objects.bulk_create(self._rollups(dataset, rollups), batch_size=1000)
+            UserAggregate.objects.add(user.pk, [dataset])
+            DatasetChange.objects.record(user.pk, [dataset.pk], DatasetChange.CREATED)
+        return dataset
+
+    def bulk_create_from_summaries(self, user, items):
+        """
+        Store many (file_name, summary, rollups, column_store) tuples with one
+        bulk insert per table. Like any bulk_create, this sends no post_save signals.
+        """
+        with transaction.atomic():
+            # Each shared store claimed once, in key order, so concurrent batches lock them alike.
+            stores = {column_store['key']: column_store for _, _, _, column_store in items if column_store}
+            claimed = {key: columnar.claim(stores[key]) for key in sorted(stores)}
+            datasets = self.bulk_create([
+                self.model(
+                    user=user, file_name=file_name, **self._columns(summary),
+                    **self._store_columns(claimed[column_store['key']] if column_store else None),
+                )
+                for file_name, summary, _, column_store in items
+            ])
+            distributions, previews, rollups = [], [], []
+            for dataset, (_, summary, dataset_rollups, _) in zip(datasets, items):
+                distribution, preview = self._children(dataset, summary)
+                distributions.extend(distribution)
+                previews.append(preview)
+                rollups.extend(self._rollups(dataset, dataset_rollups))
+            DatasetDistribution.objects.bulk_create(distributions, batch_size=1000)
+            DatasetPreview.objects.bulk_create(previews, batch_size=500)
+            DatasetRollup.objects.bulk_create(rollups, batch_size=1000)
+            UserAggregate.objects.add(user.pk, datasets)
+            DatasetChange.objects.record(user.pk, [dataset.pk for dataset in datasets], DatasetChange.CREATED)
+        return datasets
+
+
+class ExpiredDatasets(models.QuerySet):
+    """Datasets retention is deleting, which does dataset_deleted's work for them at once (see retention.trim_history)."""
 
 
 class EquipmentDataset(models.Model):
+    """
+    One processed upload. Scalar aggregates live in indexed columns; the Type
+    distribution and the preview rows live in child tables, so listing and
+    reporting never load more than they show.
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='equipment_datasets')
     file_name = models.CharField(max_length=255)
-    summary_data = models.JSONField()
     upload_date = models.DateTimeField(auto_now_add=True)
+    total_count = models.PositiveBigIntegerField(default=0, db_index=True)
+    avg_flowrate = models.FloatField(null=True, blank=True, db_index=True)
+    avg_pressure = models.FloatField(null=True, blank=True, db_index=True)
+    avg_temp = models.FloatField(null=True, blank=True, db_index=True)
+    sum_flowrate = models.FloatField(default=0)
+    count_flowrate = models.PositiveBigIntegerField(default=0)
+    sum_pressure = models.FloatField(default=0)
+    count_pressure = models.PositiveBigIntegerField(default=0)
+    sum_temp = models.FloatField(default=0)
+    count_temp = models.PositiveBigIntegerField(default=0)
+    column_key = models.CharField(
+        max_length=64, blank=True, db_index=True, help_text="Columnar copy under COLUMN_STORE_DIR, if kept"
+    )
+    column_bytes = models.PositiveBigIntegerField(default=0)
+
+    objects = EquipmentDatasetManager()
     
     class Meta:
         ordering = ['-upload_date']
+        indexes = [
+            # Serves history listings and retention trims.
+            models.Index(fields=['user', '-upload_date'], name='dataset_user_recent_idx'),
+        ]
         verbose_name = 'Equipment Dataset'
         verbose_name_plural = 'Equipment Datasets'
     
     def __str__(self):
-        return f"{self.file_name} - {self.user.username} ({self.upload_date.strftime('%Y-%m-%d')})"
\ No newline at end of file
+        return f"{self.file_name} - {self.user.username} ({self.upload_date.strftime('%Y-%m-%d')})"
+
+    @property
+    def averages(self):
+        return {
+            "avg_flowrate": self.avg_flowrate,
+            "avg_pressure": self.avg_pressure,
+            "avg_temp": self.avg_temp,
+        }
+
+    def distribution_dict(self):
+        rows = self.distribution.order_by('-count', 'category').values_list('category', 'count')
+        return dict(rows)
+
+    def to_summary(self, include_preview=True):
+        """Rebuild the process_csv summary shape; the preview costs an extra query."""
+        summary = {
+            "total_count": self.total_count,
+            "averages": self.averages,
+            "distribution": self.distribution_dict(),
+        }
+        if include_preview:
+            preview = DatasetPreview.objects.filter(dataset=self).values_list('rows', flat=True).first()
+            summary["raw_data"] = preview or []
+        return summary
+
+
+class UserAggregateManager(models.Manager):
+    def _shift(self, user_id, datasets, sign):
+        changes = {
+            field: F(field) + sign * sum(getattr(dataset, field) for dataset in datasets)
+            for field in TOTAL_FIELDS
+        }
+        return self.filter(user_id=user_id).update(
+            dataset_count=F('dataset_count') + sign * len(datasets), **changes
+        )
+
+    def add(self, user_id, datasets):
+        """Count freshly inserted datasets in. Call in the inserting transaction."""
+        if self._shift(user_id, datasets, 1):
+            return
+        # First dataset, or the row was never built: the rebuild counts these too.
+        try:
+            with transaction.atomic():
+                self.rebuild(user_id)
+        except IntegrityError:
+            # A concurrent first upload created the row from what it could see,
+            # which excludes our uncommitted datasets; add just those.
+            self._shift(user_id, datasets, 1)
+
+    def subtract(self, user_id, datasets):
+        """Count deleted datasets out. Without a row there is nothing to correct."""
+        self._shift(user_id, datasets, -1)
+
+    def rebuild(self, user_id):
+        """Recompute a user's totals from their datasets."""
+        totals = EquipmentDataset.objects.filter(user_id=user_id).aggregate(
+            dataset_count=Count('pk'), **{field: Sum(field) for field in TOTAL_FIELDS}
+        )
+        totals = {field: value or 0 for field, value in totals.items()}
+        aggregate, _ = self.update_or_create(user_id=user_id, defaults=totals)
+        return aggregate
+
+
+class UserAggregate(models.Model):
+    """
+    Running totals over all of a user's stored datasets, kept in step on
+    every insert and delete, so whole-history statistics read one row.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='dataset_aggregate')
+    dataset_count = models.PositiveIntegerField(default=0)
+    total_count = models.BigIntegerField(default=0)
+    sum_flowrate = models.FloatField(default=0)
+    count_flowrate = models.BigIntegerField(default=0)
+    sum_pressure = models.FloatField(default=0)
+    count_pressure = models.BigIntegerField(default=0)
+    sum_temp = models.FloatField(default=0)
+    count_temp = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserAggregateManager()
+
+    def __str__(self):
+        return f"{self.user.username}: {self.dataset_count} datasets"
+
+
+class DatasetChangeManager(models.Manager):
+    def record(self, user_id, dataset_ids, action):
+        """
+        Log datasets as created or deleted, and tell the user's event streams
+        once committed. Call in the transaction making the change. Takes the
+        user's row lock first (as retention.lock_user does), so one user's
+        change ids commit in the order they were issued and a sync cursor
+        never skips past one still in flight.
+        """
+        if not dataset_ids:
+            return
+        User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True).first()
+        changes = self.bulk_create([self.model(user_id=user_id, dataset_id=pk, action=action) for pk in dataset_ids])
+        name = events.DATASET_CREATED if action == DatasetChange.CREATED else events.DATASET_DELETED
+
+        def announce():
+            for change in changes:
+                events.publish(user_id, name, {"id": change.dataset_id, "cursor": change.pk})
+
+        transaction.on_commit(announce)
+
+    def prune(self, before):
+        """
+        Drop changes logged before `before`, always keeping the newest one, so
+        the lowest remaining id tells which cursors are too old to resume.
+        Returns the number of changes removed.
+        """
+        floor = self.filter(created_at__gte=before).order_by('pk').values_list('pk', flat=True).first()
+        if floor is None:
+            floor = self.order_by('-pk').values_list('pk', flat=True).first()
+        if floor is None:
+            return 0
+        removed, _ = self.filter(pk__lt=floor).delete()
+        return removed
+
+
+class DatasetChange(models.Model):
+    """
+    Append-only log of datasets created and deleted, per user. Datasets never
+    change after they are stored, so this is everything a client caching the
+    history needs; ids are the cursors of the delta sync endpoint.
+    """
+    CREATED = 'created'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (DELETED, 'Deleted'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='dataset_changes')
+    # Not a foreign key: deletions outlive their dataset.
+    dataset_id = models.PositiveBigIntegerField()
+    action = models.CharField(max_length=8, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = DatasetChangeManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='change_user_cursor_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.pk} {self.action} dataset {self.dataset_id} ({self.user_id})"
+
+
+class DatasetDistribution(models.Model):
+    dataset = models.ForeignKey(EquipmentDataset, on_delete=models.CASCADE, related_name='distribution')
+    category = models.CharField(max_length=255)
+    count = models.PositiveBigIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['dataset', 'category'], name='unique_dataset_category'),
+        ]
+
+    def __str__(self):
+        return f"{self.category}: {self.count}"
+
+
+class DatasetPreview(models.Model):
+    """The first rows of an upload, kept apart so only preview requests load them."""
+    dataset = models.OneToOneField(
+        EquipmentDataset, on_delete=models.CASCADE, primary_key=True, related_name='preview'
+    )
+    rows = models.JSONField(default=list)
+
+
+class DatasetRollup(models.Model):
+    """
+    Aggregates of one upload for a single equipment Type or name and time
+    bucket, as built by api.rollups. Rows without a timestamp column have no
+    bucket. stats holds [n, mean, M2, min, max] per metric, so buckets merge
+    exactly into coarser windows at query time.
+    """
+    SCOPE_TYPE = 'type'
+    SCOPE_EQUIPMENT = 'equipment'
+    SCOPE_CHOICES = [
+        (SCOPE_TYPE, 'Equipment Type'),
+        (SCOPE_EQUIPMENT, 'Equipment Name'),
+    ]
+
+    dataset = models.ForeignKey(EquipmentDataset, on_delete=models.CASCADE, related_name='rollups')
+    scope = models.CharField(max_length=16, choices=SCOPE_CHOICES)
+    key = models.CharField(max_length=255)
+    bucket_start = models.DateTimeField(null=True, blank=True)
+    bucket_seconds = models.PositiveIntegerField(null=True, blank=True)
+    count = models.PositiveBigIntegerField()
+    stats = models.JSONField()
+    sample = models.JSONField(default=list, help_text="Uniform sample of readings, for percentiles")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'scope', 'key', 'bucket_start'], name='rollup_window_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} @ {self.bucket_start or 'all'}: {self.count}"
+
+
+class RetentionPolicy(models.Model):
+    """Overrides DATASET_RETENTION_LIMIT for one user."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='retention_policy')
+    max_datasets = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+
+    def __str__(self):
+        return f"{self.user.username}: keep {self.max_datasets}"
+
+
+class UploadJob(models.Model):
+    """
+    A queued CSV ingestion. The row is the queue: workers claim it by moving
+    it from queued to running, so no external broker is needed. A resumable
+    upload's job waits, unclaimable, until chunks arrive for it to read.
+    """
+    WAITING = 'waiting'
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting for chunks'),
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    FINISHED = (SUCCEEDED, FAILED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_jobs')
+    file_name = models.CharField(max_length=255)
+    spool_path = models.CharField(max_length=500)
+    digest = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    progress = models.PositiveSmallIntegerField(default=0)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    dataset = models.ForeignKey(
+        EquipmentDataset, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Upload Job'
+        verbose_name_plural = 'Upload Jobs'
+
+    def __str__(self):
+        return f"{self.file_name} - {self.user.username} ({self.status})"
+
+
+class SummaryCacheEntry(models.Model):
+    """
+    Summary of a previously processed upload, keyed by the SHA-256 of its bytes.
+    Content-addressed and shared across users, so it is only ever looked up
+    with a digest the server computed from bytes it received, never one a
+    client declared: only someone holding the same bytes can hit an entry,
+    and each upload still gets its own dataset row.
+    """
+    digest = models.CharField(max_length=64, unique=True)
+    summary = models.JSONField()
+    rollups = models.JSONField(default=list)
+    size = models.PositiveIntegerField(help_text="Serialized summary and rollups size in bytes")
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Summary Cache Entry'
+        verbose_name_plural = 'Summary Cache Entries'
+
+    def __str__(self):
+        return f"{self.digest[:12]} ({self.hits} hits)"
+
+
+class ColumnStoreLockManager(models.Manager):
+    def lock(self, key):
+        """
+        Hold columnar store `key`'s lock until the transaction ends. Datasets
+        taking up the store and release() removing it both hold it, so a
+        removal never misses a dataset about to refer to the store.
+        """
+        while True:
+            if self.filter(key=key).update(locked_at=timezone.now()):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(key=key)
+                return
+            except IntegrityError:
+                # Created by someone else in the meantime: wait on theirs.
+                continue
+
+
+class ColumnStoreLock(models.Model):
+    """
+    A row to lock per columnar store (see ColumnStoreLockManager.lock); an
+    UPDATE, so SQLite serializes on it as PostgreSQL does on the row.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    locked_at = models.DateTimeField(default=timezone.now)
+
+    objects = ColumnStoreLockManager()
+
+    def __str__(self):
+        return self.key
+
+
+class ChunkedUpload(models.Model):
+    """
+    A resumable upload assembled from numbered, fixed-size chunks written into
+    a preallocated temp file. Its job can start parsing before the last chunk
+    lands; it goes back to waiting whenever the chunk it needs is slow to come.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chunked_uploads')
+    job = models.OneToOneField(UploadJob, on_delete=models.CASCADE, related_name='chunked_upload')
+    file_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    temp_path = models.CharField(max_length=500)
+    sha256 = models.CharField(max_length=64, blank=True, help_text="Digest declared by the client, if any")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Chunked Upload'
+        verbose_name_plural = 'Chunked Uploads'
+
+    def __str__(self):
+        return f"{self.file_name} - {self.user.username} ({self.total_size} bytes)"
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def expected_size(self, index):
+        """Byte length chunk `index` must have; only the last one may be short."""
+        return min(self.chunk_size, self.total_size - index * self.chunk_size)
+
+
+class UploadChunk(models.Model):
+    upload = models.ForeignKey(ChunkedUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    size = models.PositiveIntegerField()
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['upload', 'index'], name='unique_upload_chunk'),
+        ]
+
+
+class AuthTokenManager(models.Manager):
+    def issue(self, user):
+        """
+        A new token for the user and its key. Only the key's digest is
+        stored, so this is the one chance to read it.
+        """
+        key = secrets.token_hex(20)
+        now = timezone.now()
+        token = self.create(
+            digest=AuthToken.digest_of(key), user=user, created_at=now,
+            expires_at=now + timedelta(seconds=settings.AUTH_TOKEN_TTL_SECONDS),
+        )
+        return token, key
+
+    def rotate(self, token):
+        """
+        Replace a token that is still in use: the new token and its key, or
+        None when another request replaced it first. The old token keeps
+        working for AUTH_TOKEN_GRACE_SECONDS, for requests already sent with it.
+        """
+        now = timezone.now()
+        expires_at = min(token.expires_at, now + timedelta(seconds=settings.AUTH_TOKEN_GRACE_SECONDS))
+        with transaction.atomic():
+            claimed = self.filter(pk=token.pk, replaced_at__isnull=True).update(replaced_at=now, expires_at=expires_at)
+            if not claimed:
+                return None
+            return self.issue(token.user)
+
+    def prune(self, before=None):
+        """Drop tokens that expired before `before` (default now). Returns the number removed."""
+        removed, _ = self.filter(expires_at__lt=before or timezone.now()).delete()
+        return removed
+
+
+class AuthToken(models.Model):
+    """
+    A login token, stored as the SHA-256 of its key: a copy of the table
+    does not let anyone sign in. Users hold one per login, so signing out
+    on one client leaves the others signed in.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='auth_tokens')
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+    replaced_at = models.DateTimeField(null=True, blank=True)
+
+    objects = AuthTokenManager()
+
+    def __str__(self):
+        return f"{self.digest[:12]} - {self.user_id} (expires {self.expires_at:%Y-%m-%d %H:%M})"
+
+    @staticmethod
+    def digest_of(key):
+        # Keys are 160 random bits; a plain hash is as hard to reverse as a slow one.
+        return hashlib.sha256(key.encode()).hexdigest()
@@ -0,0 +1,45 @@
+"""
+MessagePack responses, for clients that send `Accept: application/msgpack`.
+Everything else still gets JSON. Values JSON has no type for (datetimes,
+decimals, UUIDs) are written the way DRF's JSON encoder writes them, so both
+encodings decode to the same data.
+"""
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK = 'application/msgpack'
+
+_encoder = JSONEncoder()
+
+
+def packb(data):
+    return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = MSGPACK
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(data)
+
+
+def negotiated_response(request, data, status=200):
+    """For views outside DRF: a JsonResponse, or MessagePack if the client prefers it."""
+    if msgpack is not None and request.get_preferred_type(['application/json', MSGPACK]) == MSGPACK:
+        response = HttpResponse(packb(data), content_type=MSGPACK, status=status)
+    else:
+        response = JsonResponse(data, status=status, safe=False)
+    patch_vary_headers(response, ['Accept'])
+    return response
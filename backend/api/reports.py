@@ -0,0 +1,323 @@
+"""
+PDF reports for stored datasets. A report is drawn once per dataset and
+layout version, kept on disk under REPORT_CACHE_DIR, and served from there
+with Range support.
+"""
+import io
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from reportlab.graphics.charts.barcharts import HorizontalBarChart, VerticalBarChart
+from reportlab.graphics.shapes import Drawing
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from . import metrics
+from .models import EquipmentDataset
+
+# Bump when the layout changes so cached reports are redrawn.
+REPORT_VERSION = 2
+
+# Past this the distribution table is cut short; the chart shows the top categories anyway.
+MAX_DISTRIBUTION_ROWS = 500
+CHART_CATEGORIES = 12
+PREVIEW_CELL_CHARS = 24
+
+TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f2937')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f3f4f6')]),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#9ca3af')),
+])
+
+PLAIN_TABLE_STYLE = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#9ca3af')),
+])
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# _byte_range() for a well-formed range that starts past the end of the file.
+UNSATISFIABLE = object()
+
+# Cache hits and renders seen by this process since it started.
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+# One lock per dataset being drawn, so simultaneous first requests render once,
+# with the number of requests holding or waiting on it. It is dropped only
+# when that falls to zero, so a request arriving mid-render finds the same lock.
+_render_locks = {}
+_render_locks_guard = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def report_path(dataset_id):
+    return os.path.join(settings.REPORT_CACHE_DIR, f"{dataset_id}-v{REPORT_VERSION}.pdf")
+
+
+def report_etag(dataset_id):
+    return f'"report-{dataset_id}-v{REPORT_VERSION}"'
+
+
+def get_report(dataset_id):
+    """Path to the dataset's report, drawing it first if it is not cached yet."""
+    path = report_path(dataset_id)
+    if os.path.exists(path):
+        _count('hits')
+        return path
+
+    with _render_locks_guard:
+        entry = _render_locks.setdefault(dataset_id, [threading.Lock(), 0])
+        entry[1] += 1
+        lock = entry[0]
+    try:
+        with lock:
+            if os.path.exists(path):
+                _count('hits')
+                return path
+
+            _count('renders')
+            dataset = EquipmentDataset.objects.select_related('user').get(pk=dataset_id)
+            with metrics.span('report.render'):
+                pdf = render_report(dataset)
+
+            # Write aside and rename, so a concurrent request never serves half a file.
+            os.makedirs(settings.REPORT_CACHE_DIR, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=settings.REPORT_CACHE_DIR, suffix='.part')
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(pdf)
+            os.replace(temp_path, path)
+            return path
+    finally:
+        with _render_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _render_locks[dataset_id]
+
+
+def delete_report(dataset_id):
+    try:
+        os.remove(report_path(dataset_id))
+    except OSError:
+        pass
+
+
+def stats():
+    with _counters_lock:
+        hits, renders = _counters['hits'], _counters['renders']
+    return {
+        "hits": hits,
+        "renders": renders,
+        "hit_ratio": round(hits / (hits + renders), 4) if hits + renders else 0,
+    }
+
+
+def _number(value, unit=''):
+    return 'N/A' if value is None else f"{value}{unit}"
+
+
+def _table(rows, col_widths=None, header=True):
+    table = Table(rows, colWidths=col_widths, repeatRows=1 if header else 0)
+    table.setStyle(TABLE_STYLE if header else PLAIN_TABLE_STYLE)
+    return table
+
+
+def _distribution_chart(distribution):
+    top = list(distribution.items())[:CHART_CATEGORIES]
+    drawing = Drawing(6.5 * inch, 2.8 * inch)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 40, 40
+    chart.width, chart.height = 6.5 * inch - 60, 2.8 * inch - 60
+    chart.data = [[count for _, count in top]]
+    chart.categoryAxis.categoryNames = [str(name)[:12] for name, _ in top]
+    chart.categoryAxis.labels.angle = 30
+    chart.categoryAxis.labels.boxAnchor = 'ne'
+    chart.categoryAxis.labels.fontSize = 7
+    chart.valueAxis.valueMin = 0
+    chart.bars[0].fillColor = colors.HexColor('#2563eb')
+    drawing.add(chart)
+    return drawing
+
+
+def _averages_chart(averages):
+    labels = [('Flowrate', averages['avg_flowrate']), ('Pressure', averages['avg_pressure']),
+              ('Temperature', averages['avg_temp'])]
+    drawing = Drawing(6.5 * inch, 1.6 * inch)
+    chart = HorizontalBarChart()
+    chart.x, chart.y = 70, 10
+    chart.width, chart.height = 6.5 * inch - 90, 1.6 * inch - 20
+    chart.data = [[value or 0 for _, value in labels]]
+    chart.categoryAxis.categoryNames = [name for name, _ in labels]
+    chart.valueAxis.valueMin = 0
+    chart.bars[0].fillColor = colors.HexColor('#059669')
+    drawing.add(chart)
+    return drawing
+
+
+def _footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 8)
+    canvas.drawString(doc.leftMargin, 0.5 * inch, "V.I.S.T.A. Analytics Report")
+    canvas.drawRightString(letter[0] - doc.rightMargin, 0.5 * inch, f"Page {doc.page}")
+    canvas.restoreState()
+
+
+def render_report(dataset):
+    """Draw the full report for a dataset (summary, charts, distribution, preview) and return the PDF bytes."""
+    summary = dataset.to_summary()
+    averages = summary['averages']
+    distribution = summary['distribution']
+    preview = summary['raw_data']
+
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph("V.I.S.T.A. Analytics Report", styles['Title']),
+        _table([
+            ["Source", dataset.file_name],
+            ["User", dataset.user.username],
+            ["Uploaded", dataset.upload_date.strftime('%Y-%m-%d %H:%M')],
+        ], col_widths=[1.5 * inch, 5 * inch], header=False),
+        Spacer(1, 0.25 * inch),
+        Paragraph("Summary", styles['Heading2']),
+        _table([
+            ["Metric", "Value"],
+            ["Total Equipment", f"{summary['total_count']:,}"],
+            ["Avg Flowrate", _number(averages['avg_flowrate'])],
+            ["Avg Pressure", _number(averages['avg_pressure'], ' PSI')],
+            ["Avg Temp", _number(averages['avg_temp'], ' °C')],
+            ["Equipment Types", f"{len(distribution):,}"],
+        ], col_widths=[2.5 * inch, 4 * inch]),
+        Spacer(1, 0.2 * inch),
+        _averages_chart(averages),
+    ]
+
+    if distribution:
+        story += [
+            PageBreak(),
+            Paragraph("Equipment Type Distribution", styles['Heading2']),
+            _distribution_chart(distribution),
+            Spacer(1, 0.2 * inch),
+        ]
+        total = summary['total_count'] or 1
+        rows = [["Type", "Count", "Share"]] + [
+            [str(name)[:60], f"{count:,}", f"{count * 100 / total:.1f}%"]
+            for name, count in list(distribution.items())[:MAX_DISTRIBUTION_ROWS]
+        ]
+        story.append(_table(rows, col_widths=[3.5 * inch, 1.5 * inch, 1.5 * inch]))
+        if len(distribution) > MAX_DISTRIBUTION_ROWS:
+            story.append(Paragraph(
+                f"… and {len(distribution) - MAX_DISTRIBUTION_ROWS:,} more types.", styles['Italic']
+            ))
+
+    if preview:
+        columns = list(preview[0].keys())
+        story += [
+            PageBreak(),
+            Paragraph(f"Data Preview (first {len(preview)} rows)", styles['Heading2']),
+            _table(
+                [[str(column)[:PREVIEW_CELL_CHARS] for column in columns]] + [
+                    [str(row.get(column, ''))[:PREVIEW_CELL_CHARS] for column in columns]
+                    for row in preview
+                ],
+                col_widths=[6.5 * inch / len(columns)] * len(columns),
+            ),
+        ]
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, title=f"Report {dataset.file_name}",
+                            author="V.I.S.T.A.", leftMargin=inch, rightMargin=inch)
+    doc.build(story, onFirstPage=_footer, onLaterPages=_footer)
+    return buffer.getvalue()
+
+
+def report_response(request, path, filename, etag):
+    """
+    Serve a cached report. Supports If-None-Match and a single
+    'Range: bytes=' request (206), so interrupted downloads can resume;
+    other Range headers get the whole file.
+    """
+    size = os.path.getsize(path)
+
+    # Weakly, as compressed responses carry the ETag as W/"...".
+    if etag in (tag.strip().removeprefix('W/') for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')):
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    requested = request.META.get('HTTP_RANGE', '')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+    # Clients echo the full response's ETag, weakened when it was compressed; the
+    # file behind it, which ranges count, is the same either way.
+    if requested and (if_range is None or if_range.strip().removeprefix('W/') == etag):
+        byte_range = _byte_range(requested, size)
+
+    if byte_range is UNSATISFIABLE:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{size}"
+        return response
+    if byte_range is not None:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type='application/pdf')
+        response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/pdf')
+
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _byte_range(header, size):
+    """
+    The (start, end) of a single 'bytes=' range over a file of `size` bytes,
+    UNSATISFIABLE if it lies past the end, or None for a header to ignore:
+    several ranges, which are not served, or one that does not parse.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            return UNSATISFIABLE
+        return start, min(int(last), size - 1) if last else size - 1
+    if not last:
+        return None
+    if int(last) == 0 or size == 0:
+        return UNSATISFIABLE
+    return max(size - int(last), 0), size - 1
+
+
+def _read_range(path, start, end, block_size=64 * 1024):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = handle.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
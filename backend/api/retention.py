@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Value
+from django.db.models.functions import Coalesce
+
+from . import columnar, history, reports
+from .models import TOTAL_FIELDS, DatasetChange, EquipmentDataset, ExpiredDatasets, RetentionPolicy, UserAggregate
+
+
+def retention_limit(user_id):
+    limit = RetentionPolicy.objects.filter(user_id=user_id).values_list('max_datasets', flat=True).first()
+    return limit or settings.DATASET_RETENTION_LIMIT
+
+
+def lock_user(user_id):
+    """
+    Serialize trims for one user until the transaction ends, so each one
+    sees the datasets every earlier concurrent upload committed.
+    """
+    User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True).first()
+
+
+def trim_history(user_id, limit=None):
+    """
+    Delete the user's datasets beyond the newest `limit`. Call inside the
+    transaction that inserted the new dataset, after lock_user().
+    Their totals come off the user's aggregate in one UPDATE and their change
+    records go in with one INSERT, in place of dataset_deleted's per-row work,
+    so a trim costs the same few statements however many datasets it drops.
+    Returns the number of datasets removed.
+    """
+    limit = retention_limit(user_id) if limit is None else limit
+    newest_first = EquipmentDataset.objects.filter(user_id=user_id).order_by('-upload_date', '-pk')
+    expired = list(
+        EquipmentDataset.objects.filter(user_id=user_id, pk__in=newest_first.values('pk')[limit:])
+        .only('pk', 'column_key', *TOTAL_FIELDS)
+    )
+    if not expired:
+        return 0
+
+    ids = [dataset.pk for dataset in expired]
+    ExpiredDatasets(EquipmentDataset).filter(pk__in=ids).delete()
+    UserAggregate.objects.subtract(user_id, expired)
+    DatasetChange.objects.record(user_id, ids, DatasetChange.DELETED)
+
+    column_keys = {dataset.column_key for dataset in expired if dataset.column_key}
+
+    def clean_up():
+        history.invalidate(user_id)
+        for dataset_id in ids:
+            reports.delete_report(dataset_id)
+        for key in column_keys:
+            columnar.release(key)
+
+    transaction.on_commit(clean_up)
+    return len(ids)
+
+
+def users_over_limit():
+    """(user_id, dataset count, limit) for every user holding more datasets than allowed."""
+    return (
+        EquipmentDataset.objects.order_by()
+        .values('user_id')
+        .annotate(
+            total=Count('pk'),
+            limit=Coalesce(
+                F('user__retention_policy__max_datasets'),
+                Value(settings.DATASET_RETENTION_LIMIT),
+                output_field=IntegerField(),
+            ),
+        )
+        .filter(total__gt=F('limit'))
+        .values_list('user_id', 'total', 'limit')
+    )
+
+
+def compact(user_ids=None):
+    """Trim every over-limit user (or just `user_ids`), one short transaction each."""
+    removed = {}
+    candidates = users_over_limit()
+    if user_ids is not None:
+        candidates = candidates.filter(user_id__in=user_ids)
+
+    for user_id, total, limit in list(candidates):
+        with transaction.atomic():
+            lock_user(user_id)
+            removed[user_id] = trim_history(user_id, limit)
+    return removed
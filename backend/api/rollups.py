@@ -0,0 +1,348 @@
+"""
+Windowed aggregates per equipment Type and equipment name.
+
+RollupAggregate is fed the same chunks as the summary and keeps, for every
+(scope, key, time bucket), mergeable moments per metric (count, mean, M2,
+min, max) plus a small uniform sample of rows for percentiles. Moments merge
+exactly, so coarser windows are answered from stored rows without the raw
+data; percentiles are estimated from the bucket samples, each weighted by
+the rows it stands for.
+
+No Django imports: this runs inside batch worker processes too.
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+METRICS = ('Flowrate', 'Pressure', 'Temperature')
+TYPE_COLUMN = 'Type'
+EQUIPMENT_COLUMN = 'Equipment Name'
+# Header names taken as the reading's time, first match wins.
+TIMESTAMP_COLUMNS = ('Timestamp', 'Time', 'DateTime', 'Date')
+
+SCOPE_TYPE = 'type'
+SCOPE_EQUIPMENT = 'equipment'
+
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+GRANULARITIES = {'hour': HOUR, 'day': DAY, 'week': WEEK, 'all': None}
+# Buckets get coarser along this ladder while a file yields more than
+# MAX_ROLLUP_ROWS groups; past 'all', per-equipment rollups are dropped.
+BUCKET_LADDER = (HOUR, DAY, WEEK, None)
+MAX_ROLLUP_ROWS = 10_000
+SAMPLE_SIZE = 16
+
+# Buckets are kept as epoch seconds; rows without a time share this one.
+# (Grouping on an all-NaT column silently yields no groups in pandas 1.5.)
+NO_BUCKET = np.iinfo('int64').min
+
+_KEYS = ['scope', 'key', 'bucket']
+_MOMENTS = ('n', 'mean', 'm2', 'min', 'max')
+# 1970-01-01 was a Thursday; weeks start on Monday the 5th.
+_WEEK_ORIGIN = 4 * DAY
+
+
+def timestamp_column(columns):
+    """The stripped name of the header's timestamp column, or None."""
+    stripped = [column.strip() for column in columns]
+    for name in TIMESTAMP_COLUMNS:
+        for candidate in (name, name.lower(), name.upper()):
+            if stripped.count(candidate) == 1:
+                return candidate
+    return None
+
+
+def epoch_seconds(times):
+    """Seconds since the epoch for a UTC datetime Series; NO_BUCKET where the time is missing."""
+    nanos = times.dt.tz_localize(None).to_numpy().view('int64')
+    return pd.Series(np.where(times.isna(), NO_BUCKET, nanos // 10 ** 9), index=times.index)
+
+
+def floor_buckets(seconds_since_epoch, seconds):
+    """Floor epoch seconds to buckets of `seconds` (weeks start on Monday); None gives one bucket."""
+    if seconds is None:
+        return pd.Series(NO_BUCKET, index=seconds_since_epoch.index)
+    origin = _WEEK_ORIGIN if seconds == WEEK else 0
+    floored = (seconds_since_epoch - origin) // seconds * seconds + origin
+    return floored.where(seconds_since_epoch != NO_BUCKET, NO_BUCKET)
+
+
+class RollupAggregate:
+    """Accumulates rollups chunk by chunk; call rows() at the end."""
+
+    def __init__(self, max_rows=MAX_ROLLUP_ROWS, sample_size=SAMPLE_SIZE, seed=0):
+        self.max_rows = max_rows
+        self.sample_size = sample_size
+        self.rng = np.random.default_rng(seed)
+        self.level = 0
+        self.per_equipment = True
+        self.timestamp = None
+        self.parts = []
+        self.part_rows = 0
+        self.sample = None
+
+    @property
+    def bucket_seconds(self):
+        return BUCKET_LADDER[self.level] if self.timestamp else None
+
+    def update(self, df):
+        if df.empty or TYPE_COLUMN not in df.columns or not all(metric in df.columns for metric in METRICS):
+            return
+        if self.timestamp is None:
+            self.timestamp = timestamp_column(df.columns) or ''
+
+        values = df[list(METRICS)].apply(pd.to_numeric, errors='coerce').astype('float64')
+        if self.timestamp:
+            times = epoch_seconds(pd.to_datetime(df[self.timestamp], errors='coerce', utc=True))
+        else:
+            times = pd.Series(NO_BUCKET, index=df.index)
+        bucket = floor_buckets(times, self.bucket_seconds)
+
+        scopes = [(SCOPE_TYPE, df[TYPE_COLUMN])]
+        if self.per_equipment and EQUIPMENT_COLUMN in df.columns:
+            scopes.append((SCOPE_EQUIPMENT, df[EQUIPMENT_COLUMN]))
+        for scope, column in scopes:
+            if column.isna().all():
+                continue
+            moments, sample = self._summarise(values.to_numpy(), _categorical_keys(column), bucket.to_numpy())
+            self.parts.append(moments.assign(scope=scope))
+            self.part_rows += len(moments)
+            self.sample = _bottom_k(pd.concat([self.sample, sample.assign(scope=scope)], ignore_index=True),
+                                    self.sample_size)
+        if self.part_rows > 4 * self.max_rows:
+            self._compact()
+
+    def _summarise(self, values, keys, buckets):
+        """
+        Moments and a bottom-k sample per (key, bucket) of one scope, with
+        np.bincount over factorized group codes rather than a pandas groupby.
+        """
+        key_codes = keys.cat.codes.to_numpy()
+        valid = key_codes >= 0
+        values, key_codes, buckets = values[valid], key_codes[valid], buckets[valid]
+        bucket_codes, bucket_values = pd.factorize(buckets)
+        codes, groups = pd.factorize(key_codes.astype('int64') * len(bucket_values) + bucket_codes)
+        size = len(groups)
+
+        moments = {
+            'key': keys.cat.categories.take(groups // len(bucket_values)).astype(str),
+            'bucket': bucket_values[groups % len(bucket_values)],
+            'rows': np.bincount(codes, minlength=size),
+        }
+        for column, metric in enumerate(METRICS):
+            x = values[:, column]
+            observed = ~np.isnan(x)
+            n = np.bincount(codes, weights=observed, minlength=size)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = np.bincount(codes, weights=np.where(observed, x, 0.0), minlength=size) / n
+            # Two passes: squared deviations from the group mean, not from zero.
+            deviation = np.where(observed, x - mean[codes], 0.0)
+            low, high = np.full(size, np.inf), np.full(size, -np.inf)
+            np.fmin.at(low, codes[observed], x[observed])
+            np.fmax.at(high, codes[observed], x[observed])
+            moments[f"n_{metric}"] = n
+            moments[f"mean_{metric}"] = mean
+            moments[f"m2_{metric}"] = np.bincount(codes, weights=deviation ** 2, minlength=size)
+            moments[f"min_{metric}"] = np.where(n > 0, low, np.nan)
+            moments[f"max_{metric}"] = np.where(n > 0, high, np.nan)
+
+        # Visiting rows in random order with ascending priorities is the same as
+        # drawing priorities and sorting by them; keep each group's first k.
+        order = self.rng.permutation(len(codes))
+        priorities = np.sort(self.rng.random(len(codes)))
+        by_group = np.argsort(codes[order], kind='stable')
+        grouped_codes = codes[order][by_group]
+        rank = np.arange(len(codes)) - np.searchsorted(grouped_codes, grouped_codes)
+        picked = by_group[rank < self.sample_size]
+        rows = order[picked]
+        sample = pd.DataFrame(values[rows], columns=list(METRICS)).assign(
+            key=moments['key'][codes[rows]], bucket=buckets[rows], p=priorities[picked]
+        )
+        return pd.DataFrame(moments), sample
+
+    def _compact(self):
+        moments = combine_moments(self.parts)
+        while len(moments) > self.max_rows:
+            if self.bucket_seconds is not None:
+                self.level += 1
+            elif self.per_equipment:
+                self.per_equipment = False
+                moments = moments[moments['scope'] != SCOPE_EQUIPMENT]
+                self.sample = self.sample[self.sample['scope'] != SCOPE_EQUIPMENT]
+            else:
+                break
+            moments = combine_moments([self._rebucket(moments)])
+            self.sample = _bottom_k(self._rebucket(self.sample), self.sample_size)
+        self.parts = [moments]
+        self.part_rows = len(moments)
+
+    def _rebucket(self, frame):
+        return frame.assign(bucket=floor_buckets(frame['bucket'], self.bucket_seconds))
+
+    def rows(self):
+        """The rollups as JSON-ready dicts, one per (scope, key, bucket)."""
+        if not self.parts:
+            return []
+        self._compact()
+        moments = self.parts[0]
+
+        # Split the sample per group without a Python-level groupby loop.
+        sample = moments[_KEYS].reset_index().merge(self.sample, on=_KEYS).sort_values(['index', 'p'])
+        codes = sample['index'].to_numpy()
+        values = _json_values(sample[list(METRICS)].to_numpy())
+        bounds = np.searchsorted(codes, np.arange(len(moments) + 1))
+
+        groups = moments[['scope', 'key']].itertuples(index=False, name=None)
+        starts = [
+            None if bucket == NO_BUCKET else datetime.fromtimestamp(bucket, tz=timezone.utc).isoformat()
+            for bucket in moments['bucket'].tolist()
+        ]
+        counts = moments['rows'].astype('int64').tolist()
+        stats = {
+            metric: _json_values(moments[[f"{name}_{metric}" for name in _MOMENTS]].to_numpy())
+            for metric in METRICS
+        }
+        return [
+            {
+                "scope": scope,
+                "key": key,
+                "bucket_start": starts[i],
+                "bucket_seconds": self.bucket_seconds if starts[i] else None,
+                "count": counts[i],
+                "stats": {metric: [int(stats[metric][i][0]), *stats[metric][i][1:]] for metric in METRICS},
+                "sample": values[bounds[i]:bounds[i + 1]],
+            }
+            for i, (scope, key) in enumerate(groups)
+        ]
+
+
+def _categorical_keys(column):
+    """Group keys as a categorical with stripped labels, so grouping works on integer codes."""
+    keys = column if isinstance(column.dtype, pd.CategoricalDtype) else column.astype('category')
+    labels = keys.cat.categories.astype(str)
+    stripped = labels.str.strip()
+    if stripped.is_unique:
+        return keys.cat.rename_categories(stripped)
+    return keys.astype(str).str.strip().astype('category')
+
+
+def combine_moments(parts):
+    """
+    Merge moment frames that may share groups, in one vectorized pass:
+    the pairwise update of Chan et al. generalised to any number of parts.
+    """
+    frame = pd.concat(parts, ignore_index=True)
+    grouped = frame.groupby(_KEYS, sort=False)
+    merged = {'rows': grouped['rows'].sum()}
+    by = [frame[key] for key in _KEYS]
+    for metric in METRICS:
+        n, mean = frame[f"n_{metric}"], frame[f"mean_{metric}"].fillna(0.0)
+        weighted = (n * mean).groupby(by, sort=False)
+        total = grouped[f"n_{metric}"].transform('sum')
+        group_mean = (weighted.transform('sum') / total.where(total > 0)).fillna(0.0)
+        count = grouped[f"n_{metric}"].sum()
+        merged[f"n_{metric}"] = count
+        merged[f"mean_{metric}"] = weighted.sum() / count.where(count > 0)
+        merged[f"m2_{metric}"] = (
+            grouped[f"m2_{metric}"].sum()
+            + (n * (mean - group_mean) ** 2).groupby(by, sort=False).sum()
+        )
+        merged[f"min_{metric}"] = grouped[f"min_{metric}"].min()
+        merged[f"max_{metric}"] = grouped[f"max_{metric}"].max()
+    return pd.DataFrame(merged).reset_index()
+
+
+def _bottom_k(frame, k):
+    """The k rows with the smallest random priority per group: a uniform sample that merges exactly."""
+    return frame.sort_values('p', kind='stable').groupby(_KEYS, sort=False).head(k)[[*_KEYS, 'p', *METRICS]]
+
+
+def _json_values(array):
+    array = np.round(array.astype('float64'), 6)
+    return [[None if value != value else value for value in row] for row in array.tolist()]
+
+
+# Query time: stored rows merged to the requested window and granularity.
+
+def merge_stored(rows, seconds):
+    """
+    Merge stored rollup rows into buckets of `seconds` (None for one bucket
+    per key). Rows are dicts with scope, key, bucket_start (an aware datetime
+    or None), count, stats and sample, as DatasetRollup stores them.
+    Returns {(scope, key, bucket_start): merged} in first-seen order.
+    """
+    groups = {}
+    for row in rows:
+        start = _floor_datetime(row['bucket_start'], seconds)
+        merged = groups.setdefault((row['scope'], row['key'], start), {
+            "count": 0, "stats": {}, "strata": [],
+        })
+        merged['count'] += row['count']
+        for metric, values in row['stats'].items():
+            current = merged['stats'].get(metric)
+            merged['stats'][metric] = values if current is None else _merge_metric(current, values)
+        merged['strata'].append((row['stats'], row['sample']))
+    return groups
+
+
+def _floor_datetime(start, seconds):
+    if start is None or seconds is None:
+        return None
+    origin = _WEEK_ORIGIN if seconds == WEEK else 0
+    epoch = int(start.timestamp())
+    return datetime.fromtimestamp((epoch - origin) // seconds * seconds + origin, tz=timezone.utc)
+
+
+def _merge_metric(a, b):
+    na, mean_a, m2_a, min_a, max_a = a
+    nb, mean_b, m2_b, min_b, max_b = b
+    if not na or not nb:
+        return list(a if na else b)
+    n = na + nb
+    delta = mean_b - mean_a
+    return [n, mean_a + delta * nb / n, m2_a + m2_b + delta ** 2 * na * nb / n,
+            min(min_a, min_b), max(max_a, max_b)]
+
+
+def weighted_percentiles(values, weights, percentiles):
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    # Midpoint rule, so equal weights reproduce the usual linear interpolation closely.
+    positions = (np.cumsum(weights) - weights / 2) / weights.sum() * 100
+    return np.interp(percentiles, positions, values)
+
+
+def describe(merged, metrics=METRICS, percentiles=(50, 95)):
+    """Final statistics for one merged group: count, mean, std, min, max and percentiles per metric."""
+    result = {}
+    for metric in metrics:
+        n, mean, m2, low, high = merged['stats'][metric]
+        column = METRICS.index(metric)
+        values, weights = [], []
+        for stats, sample in merged['strata']:
+            observed = [row[column] for row in sample if row[column] is not None]
+            if observed:
+                values.extend(observed)
+                # Each sampled value stands for an equal share of its bucket's readings.
+                weights.extend([stats[metric][0] / len(observed)] * len(observed))
+        estimates = (
+            weighted_percentiles(np.array(values), np.array(weights), list(percentiles)) if values else None
+        )
+        result[metric] = {
+            "count": n,
+            "mean": _round(mean) if n else None,
+            "std": _round(np.sqrt(m2 / (n - 1))) if n > 1 else None,
+            "min": _round(low),
+            "max": _round(high),
+            **{
+                f"p{p:g}": None if estimates is None else _round(estimates[i])
+                for i, p in enumerate(percentiles)
+            },
+        }
+    return result
+
+
+def _round(value):
+    return None if value is None or value != value else round(float(value), 4)
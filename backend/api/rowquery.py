@@ -0,0 +1,258 @@
+"""
+Pages of raw rows from a dataset's columnar copy, with column projection,
+sorting and simple predicates such as `Pressure>120` or `Type=Pump`.
+
+Rows are read in an ordering: file order, or a column's SortIndex. A page is
+the next `limit` rows of that ordering matching every predicate, starting at
+a cursor, which is a position in the ordering; stores never change, so
+positions stay valid. Predicates on the sort column become a binary search
+over the index's sorted keys. The rest are checked block by block, each
+block larger than the last, until the page is full. When matches are too
+rare for that, every row is checked at once in file order and the matches
+are placed through the index's row positions, rather than gathering every
+row of the ordering.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import re
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from .columnar import CATEGORY, FLOAT
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_PREDICATES = 10
+FIRST_BLOCK = 16_384
+MAX_BLOCK = 1 << 20
+# Rows scanned in blocks before checking the whole file at once.
+SCAN_BEFORE_MASK = 1 << 18
+
+PREDICATE_RE = re.compile(r'^(?P<column>.+?)\s*(?P<op>>=|<=|!=|=|>|<)\s*(?P<value>.*)$')
+RANGE_OPS = ('>', '>=', '<', '<=')
+COMPARE = {
+    '=': np.equal,
+    '!=': np.not_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+}
+
+
+class QueryError(ValueError):
+    """The query does not fit this dataset's columns."""
+
+
+class Predicate:
+    """
+    One `<column><op><value>` condition. Category columns take = and !=, with
+    alternatives separated by |. Missing values never match.
+    """
+
+    def __init__(self, store, text):
+        match = PREDICATE_RE.match(text.strip())
+        if not match:
+            raise QueryError(f"Cannot parse predicate: {text}")
+        self.column, self.op, value = match['column'].strip(), match['op'], match['value'].strip()
+        if self.column not in store.columns:
+            raise QueryError(f"Unknown column: {self.column}")
+        self.kind = store.kind(self.column)
+
+        if self.kind == CATEGORY:
+            if self.op in RANGE_OPS:
+                raise QueryError(f"{self.column} only supports = and !=")
+            codes = store.codes(self.column)
+            self.codes = np.array([codes[label] for label in value.split('|') if label in codes], dtype='<i4')
+            self.key = int(store.ranks(self.column)[self.codes[0]]) if len(self.codes) == 1 else None
+        elif self.kind == FLOAT:
+            try:
+                self.value = np.float32(value)
+            except ValueError:
+                raise QueryError(f"{self.column} needs a number, not {value!r}")
+            if np.isnan(self.value):
+                raise QueryError(f"{self.column} needs a number, not {value!r}")
+            self.key = self.value
+        else:
+            try:
+                stamp = pd.Timestamp(value)
+            except ValueError:
+                raise QueryError(f"{self.column} needs an ISO 8601 date or time, not {value!r}")
+            if pd.isna(stamp):
+                raise QueryError(f"{self.column} needs an ISO 8601 date or time, not {value!r}")
+            if stamp.tzinfo is not None:
+                stamp = stamp.tz_convert('UTC').tz_localize(None)
+            self.value = stamp.to_datetime64()
+            self.key = np.int64(stamp.value)
+
+    def __str__(self):
+        return f"{self.column}{self.op}{self.value if self.kind != CATEGORY else self.codes.tolist()}"
+
+    def mask(self, values):
+        """Which of `values`, raw values of the column, match."""
+        if self.kind == CATEGORY:
+            hit = values == self.codes[0] if len(self.codes) == 1 else np.isin(values, self.codes)
+            return hit if self.op == '=' else ~hit & (values >= 0)
+        hit = COMPARE[self.op](values, self.value)
+        if self.op == '!=':
+            hit &= ~(np.isnan(values) if self.kind == FLOAT else np.isnat(values))
+        return hit
+
+    def bounds(self):
+        """
+        This predicate as (low, high, low_open, high_open) over the column's
+        sort keys, for SortIndex.span; None when it is not a single range.
+        """
+        if self.kind == CATEGORY:
+            if self.op != '=':
+                return None
+            if not len(self.codes):
+                # No such category: a range that holds no rank.
+                return 0, 0, True, True
+            return (self.key, self.key, False, False) if self.key is not None else None
+        return {
+            '=': (self.key, self.key, False, False),
+            '>': (self.key, None, True, False),
+            '>=': (self.key, None, False, False),
+            '<': (None, self.key, False, True),
+            '<=': (None, self.key, False, False),
+        }.get(self.op)
+
+
+class RowQuery:
+    """A validated rows request against one store; page() finds rows, fetch() reads them."""
+
+    def __init__(self, store, fields=None, sort=None, where=(), limit=DEFAULT_LIMIT):
+        self.store = store
+        self.fields = fields or list(store.columns)
+        unknown = [name for name in self.fields if name not in store.columns]
+        if unknown:
+            raise QueryError(f"Unknown columns: {', '.join(unknown)}")
+
+        self.descending = bool(sort) and sort.startswith('-')
+        self.sort = sort.lstrip('-') if sort else None
+        if self.sort is not None and self.sort not in store.columns:
+            raise QueryError(f"Unknown sort column: {self.sort}")
+
+        if len(where) > MAX_PREDICATES:
+            raise QueryError(f"At most {MAX_PREDICATES} predicates are allowed")
+        self.predicates = [Predicate(store, text) for text in where]
+        if not 1 <= limit <= MAX_LIMIT:
+            raise QueryError(f"limit must be between 1 and {MAX_LIMIT}")
+        self.limit = limit
+
+        # Cursors only resume the query they came from.
+        shape = [store.directory, sort, sorted(str(predicate) for predicate in self.predicates)]
+        self.signature = hashlib.sha1(json.dumps(shape).encode()).hexdigest()[:16]
+
+    def _ordering(self):
+        """The SortIndex to walk (None for file order), the positions in range, and predicates left to check."""
+        scan = list(self.predicates)
+        if self.sort is None:
+            return None, 0, self.store.rows, scan
+
+        index = self.store.sort_index(self.sort, self.descending)
+        start, stop = 0, len(index)
+        for predicate in self.predicates:
+            bounds = predicate.bounds() if predicate.column == self.sort else None
+            if bounds is not None:
+                low, high = index.span(*bounds)
+                start, stop = max(start, low), min(stop, high)
+                scan.remove(predicate)
+        return index, start, max(start, stop), scan
+
+    def page(self, position=0):
+        """
+        Row numbers of the page at `position`, the position to continue from
+        (None after the last page), and the number of matching rows when it
+        was counted along the way (else None).
+        """
+        index, start, stop, scan = self._ordering()
+        matched = stop - start if not scan else None
+        position = max(position, start)
+        needed = self.limit
+        block = FIRST_BLOCK
+        scanned = 0
+        found = []
+        while needed and position < stop:
+            if scan and scanned >= SCAN_BEFORE_MASK:
+                rows, position, matched = self._page_by_mask(index, scan, start, stop, position, needed)
+                found.append(rows)
+                break
+            end = min(stop, position + (block if scan else needed))
+            selector = slice(position, end) if index is None else index.rows(position, end)
+            if scan:
+                mask = reduce(np.logical_and, (
+                    predicate.mask(self.store.array(predicate.column)[selector]) for predicate in scan
+                ))
+                offsets = np.flatnonzero(mask)[:needed]
+                if len(offsets) == needed:
+                    end = position + int(offsets[-1]) + 1
+            else:
+                offsets = np.arange(end - position)
+            found.append(position + offsets if index is None else selector[offsets])
+            needed -= len(offsets)
+            scanned += end - position
+            position = end
+            block = min(block * 4, MAX_BLOCK)
+
+        rows = np.concatenate(found) if found else np.empty(0, dtype='<i8')
+        return rows, (position if position < stop else None), matched
+
+    def _page_by_mask(self, index, scan, start, stop, position, needed):
+        """page() for rare matches: check every row in file order, then order just the matches."""
+        rows = np.flatnonzero(reduce(np.logical_and, (
+            predicate.mask(self.store.array(predicate.column)) for predicate in scan
+        )))
+        positions = rows if index is None else index.positions_of(rows)
+        inside = (positions >= start) & (positions < stop)
+        matched = int(inside.sum())
+        ahead = inside & (positions >= position)
+        rows, positions = rows[ahead], positions[ahead]
+        if len(positions) > needed:
+            nearest = np.argpartition(positions, needed - 1)[:needed]
+            rows, positions = rows[nearest], positions[nearest]
+        ordered = np.argsort(positions)
+        rows, positions = rows[ordered], positions[ordered]
+        next_position = int(positions[-1]) + 1 if len(positions) == needed else stop
+        return rows, next_position, matched
+
+    def fetch(self, rows):
+        """The `fields` of the given rows as dicts, with each row's number in the file as _row."""
+        columns = {}
+        for name in self.fields:
+            values = self.store.array(name)[rows]
+            kind = self.store.kind(name)
+            if kind == FLOAT:
+                # Through str for float32's shortest repr, so 5.01 stays 5.01.
+                columns[name] = [None if text == 'nan' else float(text) for text in values.astype(str)]
+            elif kind == CATEGORY:
+                categories = self.store.categories(name)
+                columns[name] = [categories[code] if code >= 0 else None for code in values.tolist()]
+            else:
+                times = pd.DatetimeIndex(values).tz_localize('UTC')
+                columns[name] = [None if pd.isna(time) else time.to_pydatetime() for time in times]
+
+        return [
+            {"_row": row, **{name: columns[name][i] for name in self.fields}}
+            for i, row in enumerate(np.asarray(rows).tolist())
+        ]
+
+    def cursor(self, position):
+        payload = json.dumps({"p": position, "q": self.signature}).encode()
+        return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+    def position(self, cursor):
+        """The position a cursor from an earlier page of this query points at."""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            position, signature = int(payload['p']), payload['q']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise QueryError("Malformed cursor")
+        if signature != self.signature or position < 0:
+            raise QueryError("The cursor belongs to a different query")
+        return position
@@ -0,0 +1,18 @@
+from django.db import transaction
+
+from .models import EquipmentDataset
+from .retention import lock_user, trim_history
+
+
+def store_dataset(user, file_name, summary, rollups=None, column_store=None):
+    """
+    Save a processed upload, with its rollups and columnar copy, and trim the
+    user's history to their retention limit.
+    """
+    with transaction.atomic():
+        # Insert first: on SQLite the first statement then takes the write lock
+        # (and waits for it) instead of failing to upgrade from a read.
+        dataset = EquipmentDataset.objects.create_from_summary(user, file_name, summary, rollups, column_store)
+        lock_user(user.pk)
+        trim_history(user.pk)
+    return dataset
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import authentication, columnar, history, metrics, reports
+from .models import AuthToken, DatasetChange, EquipmentDataset, ExpiredDatasets, UserAggregate
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    # Requests and background jobs alike; the wrapper outlives reconnects, so only once.
+    if metrics.time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.time_query)
+
+
+@receiver(post_save, sender=EquipmentDataset)
+def dataset_saved(sender, instance, created, **kwargs):
+    if created:
+        # After commit, so a concurrent read cannot re-cache the old listing.
+        transaction.on_commit(lambda: history.invalidate(instance.user_id))
+
+
+@receiver(post_delete, sender=EquipmentDataset)
+def dataset_deleted(sender, instance, **kwargs):
+    # Explicit deletes; inside the deleting transaction. Retention trims do all this once per trim.
+    if isinstance(kwargs.get('origin'), ExpiredDatasets):
+        return
+    UserAggregate.objects.subtract(instance.user_id, [instance])
+    # A deleted user takes their change log along; nobody is left to sync.
+    if not isinstance(kwargs.get('origin'), User):
+        DatasetChange.objects.record(instance.user_id, [instance.pk], DatasetChange.DELETED)
+    transaction.on_commit(lambda: history.invalidate(instance.user_id))
+    transaction.on_commit(lambda: reports.delete_report(instance.pk))
+    if instance.column_key:
+        transaction.on_commit(lambda: columnar.release(instance.column_key))
+
+
+@receiver(post_delete, sender=AuthToken)
+def auth_token_deleted(sender, instance, **kwargs):
+    # Logout and pruning. Again after commit: a request in between could cache it back from the database.
+    digest = instance.pk
+    authentication.invalidate(digest)
+    transaction.on_commit(lambda: authentication.invalidate(digest))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Deactivation above all, but any change: cached tokens carry a copy of the user.
+    user_id = instance.pk
+    transaction.on_commit(lambda: authentication.invalidate_user(user_id))
@@ -0,0 +1,164 @@
+"""
+Load simulations behind `manage.py stress_retention` and
+`manage.py simulate_chunked_upload`, and their test cases. Each returns its
+figures and raises SimulationError when what it checks does not hold; the
+commands run them in api.benchmarks.scratch_database().
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import OperationalError, connection
+from django.test import Client
+
+from .jobs import drain_queue
+from .models import AuthToken, EquipmentDataset, RetentionPolicy, UploadJob
+from .services import store_dataset
+from .utils import process_csv
+
+RETENTION_SUMMARY = {
+    "total_count": 1,
+    "averages": {"avg_flowrate": 1.0, "avg_pressure": 1.0, "avg_temp": 1.0},
+    "distribution": {"Pump": 1},
+    "raw_data": [],
+}
+
+# Parts of an upload's summary a resumed transfer must reproduce exactly.
+COMPARED_KEYS = ('total_count', 'averages', 'distribution')
+
+
+class SimulationError(AssertionError):
+    """What a simulation checks did not hold."""
+
+
+def stress_retention(user, uploaders, uploads, limit):
+    """
+    Store datasets for `user`, under a RetentionPolicy of `limit`, from
+    `uploaders` threads at once, checking the limit holds throughout and at the end.
+    """
+    RetentionPolicy.objects.update_or_create(user=user, defaults={"max_datasets": limit})
+    lock = threading.Lock()
+    figures = {"stored": uploaders * uploads, "peak": 0, "retries": 0}
+
+    def uploader(n):
+        try:
+            for i in range(uploads):
+                while True:
+                    try:
+                        store_dataset(user, f"stress-{n}-{i}.csv", RETENTION_SUMMARY)
+                        break
+                    except OperationalError:
+                        # SQLite may refuse a writer outright instead of waiting; try again.
+                        with lock:
+                            figures["retries"] += 1
+                        time.sleep(0.01)
+                # Counted outside the insert transaction, as any reader would see it.
+                count = EquipmentDataset.objects.filter(user=user).count()
+                with lock:
+                    figures["peak"] = max(figures["peak"], count)
+        finally:
+            connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=uploaders) as pool:
+        for future in [pool.submit(uploader, n) for n in range(uploaders)]:
+            future.result()
+    figures["elapsed"] = time.perf_counter() - started
+    figures["final"] = EquipmentDataset.objects.filter(user=user).count()
+
+    if figures["peak"] > limit or figures["final"] != min(figures["stored"], limit):
+        raise SimulationError(f"Retention limit {limit} was not held: peak {figures['peak']}, final {figures['final']}")
+    return figures
+
+
+class InterruptedUpload:
+    """
+    Drive the resumable upload API, as `user`, through dropped and truncated
+    chunk transfers of the file at csv_path, resuming from the server's
+    received ranges, and check the result matches a one-shot parse.
+    """
+
+    def __init__(self, user, csv_path, rng, chunk_size=None, drop_rate=0.3, interrupt_after=5, parallel=1):
+        self.auth = {"HTTP_AUTHORIZATION": f"Token {AuthToken.objects.issue(user)[1]}"}
+        self.csv_path = csv_path
+        self.rng = rng
+        self.chunk_size = chunk_size
+        self.drop_rate = drop_rate
+        self.interrupt_after = interrupt_after
+        self.parallel = parallel
+
+    def run(self, timeout=600):
+        with open(self.csv_path, 'rb') as handle:
+            expected = process_csv(File(handle))
+        client = Client(**self.auth)
+        response = client.post(
+            '/api/uploads/',
+            data=json.dumps({
+                "file_name": os.path.basename(self.csv_path),
+                "total_size": os.path.getsize(self.csv_path),
+                "chunk_size": self.chunk_size,
+            }),
+            content_type='application/json',
+        )
+        if response.status_code != 201:
+            raise SimulationError(f"Could not start upload: {response.content!r}")
+        base = f"/api/uploads/{response.json()['upload_id']}/"
+
+        figures = {"rounds": 0, "sends": 0, "dropped": 0}
+        while True:
+            status = client.get(base).json()
+            received = {i for first, last in status['received'] for i in range(first, last + 1)}
+            missing = [i for i in range(status['total_chunks']) if i not in received]
+            if not missing:
+                break
+
+            figures["rounds"] += 1
+            self.rng.shuffle(missing)
+            # The connection "drops" after interrupt_after chunks; the next round resumes.
+            plans = [(index, self.rng.random() < self.drop_rate) for index in missing[:self.interrupt_after]]
+            with ThreadPoolExecutor(max_workers=self.parallel) as pool:
+                outcomes = list(pool.map(lambda plan: self.send_chunk(base, status, *plan), plans))
+            figures["sends"] += len(outcomes)
+            figures["dropped"] += sum(1 for ok in outcomes if not ok)
+        figures["chunks"] = status['total_chunks']
+
+        job_id = client.post(f"{base}complete/").json()['job_id']
+        if settings.UPLOAD_WORKER_MODE != 'thread':
+            drain_queue()
+        job = figures["job"] = self.wait_for_job(job_id, timeout)
+        if job.status != UploadJob.SUCCEEDED:
+            raise SimulationError(f"Job ended {job.status}: {job.error}")
+
+        result = {key: job.result[key] for key in COMPARED_KEYS}
+        wanted = {key: expected[key] for key in COMPARED_KEYS}
+        if result != wanted:
+            raise SimulationError(f"Assembled upload summary differs:\n{result}\n!=\n{wanted}")
+        return figures
+
+    def send_chunk(self, base, status, index, cut_off):
+        try:
+            with open(self.csv_path, 'rb') as handle:
+                handle.seek(index * status['chunk_size'])
+                data = handle.read(status['chunk_size'])
+            if cut_off:
+                data = data[:len(data) // 2]
+            response = Client(**self.auth).put(
+                f"{base}chunks/{index}/", data=data, content_type='application/octet-stream'
+            )
+            if cut_off and response.status_code != 400:
+                raise SimulationError(f"Truncated chunk {index} was accepted")
+            return response.status_code == 200
+        finally:
+            connection.close()
+
+    def wait_for_job(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = UploadJob.objects.get(pk=job_id)
+            if job.status in UploadJob.FINISHED or time.monotonic() > deadline:
+                return job
+            time.sleep(0.1)
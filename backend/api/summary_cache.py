@@ -0,0 +1,116 @@
+import json
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import columnar
+from .models import SummaryCacheEntry
+
+# Hits and misses seen by this process since it started.
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def _count(name):
+    with _counters_lock:
+        _counters[name] += 1
+
+
+def lookup(digest):
+    """Return the cached summary for a content digest, or None."""
+    if not digest:
+        return None
+
+    entry = SummaryCacheEntry.objects.filter(digest=digest).only('pk', 'summary').first()
+    if entry is None:
+        _count('misses')
+        return None
+
+    SummaryCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _count('hits')
+    return entry.summary
+
+
+def rollups_for(digest):
+    """Rollup rows stored with a cached summary; call after a lookup() hit."""
+    if not digest:
+        return []
+    rollups = SummaryCacheEntry.objects.filter(digest=digest).values_list('rollups', flat=True).first()
+    return rollups or []
+
+
+def reuse(digest):
+    """
+    What a repeat upload needs to be stored without parsing: (summary, rollups,
+    columnar store manifest), or None. While the columnar store is on, a hit
+    also needs the content's store on disk; without it the upload is parsed
+    again, which rebuilds the store.
+    """
+    column_store = columnar.lookup(digest)
+    if column_store is None and columnar.enabled():
+        if digest:
+            _count('misses')
+        return None
+    summary = lookup(digest)
+    if summary is None:
+        return None
+    return summary, rollups_for(digest), column_store
+
+
+def store(digest, summary, rollups=None):
+    """Remember a freshly computed summary and its rollups, then trim the cache back under its bounds."""
+    if not digest:
+        return
+
+    rollups = rollups or []
+    try:
+        SummaryCacheEntry.objects.get_or_create(
+            digest=digest,
+            defaults={
+                "summary": summary,
+                "rollups": rollups,
+                "size": len(json.dumps(summary)) + len(json.dumps(rollups)),
+            },
+        )
+    except IntegrityError:
+        # Another worker stored the same content first.
+        pass
+    evict()
+
+
+def evict():
+    """Drop least recently used entries beyond SUMMARY_CACHE_MAX_ENTRIES or SUMMARY_CACHE_MAX_BYTES."""
+    max_entries = settings.SUMMARY_CACHE_MAX_ENTRIES
+    max_bytes = settings.SUMMARY_CACHE_MAX_BYTES
+
+    stale = []
+    total = 0
+    entries = SummaryCacheEntry.objects.order_by('-last_used_at').values_list('pk', 'size')
+    for position, (pk, size) in enumerate(entries.iterator()):
+        total += size
+        if position >= max_entries or total > max_bytes:
+            stale.append(pk)
+
+    if stale:
+        SummaryCacheEntry.objects.filter(pk__in=stale).delete()
+    return len(stale)
+
+
+def stats():
+    totals = SummaryCacheEntry.objects.aggregate(bytes=Sum('size'), lifetime_hits=Sum('hits'))
+    with _counters_lock:
+        hits, misses = _counters['hits'], _counters['misses']
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0,
+        "lifetime_hits": totals['lifetime_hits'] or 0,
+        "entries": SummaryCacheEntry.objects.count(),
+        "bytes": totals['bytes'] or 0,
+        "max_entries": settings.SUMMARY_CACHE_MAX_ENTRIES,
+        "max_bytes": settings.SUMMARY_CACHE_MAX_BYTES,
+    }
@@ -0,0 +1,111 @@
+"""
+Uploads of CSVs the client has already summarised with api.ingest, sent
+instead of the file: a JSON document with the summary and its rollups, and
+optionally the file's known columns packed by ingest.ColumnSample.
+
+A summary alone is checked for consistency and stored as sent. With the
+columns, the summary and rollups are recomputed from them and the claimed
+summary must match. The claimed summary is kept, its float64 totals being
+exact where the float32 columns are not, along with the recomputed rollups,
+and the columns become the dataset's columnar copy.
+"""
+import gzip
+import json
+import logging
+
+from django.conf import settings
+
+from . import columnar, ingest
+from .rollups import RollupAggregate
+from .services import store_dataset
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class SummaryUploadError(ValueError):
+    """The uploaded summary or columns cannot be accepted."""
+
+
+def read_document(upload, max_bytes):
+    """The JSON in an uploaded file, gzipped or not, refusing more than max_bytes once decompressed."""
+    magic = upload.read(2)
+    upload.seek(0)
+    stream = gzip.GzipFile(fileobj=upload) if magic == GZIP_MAGIC else upload
+    try:
+        data = stream.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise SummaryUploadError(f"The summary is larger than {max_bytes} bytes")
+        return json.loads(data, parse_constant=_reject_constant)
+    except (OSError, EOFError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise SummaryUploadError(f"The summary is not valid JSON: {e}")
+
+
+def _reject_constant(name):
+    raise SummaryUploadError(f"The summary holds {name}, which is not a number")
+
+
+def accept_summary(user, file_name, summary_file, columns_file=None):
+    """
+    Check an uploaded summary, against its columns when given, and store it.
+    Returns the dataset, the stored summary and whether the columns vouched for it.
+    """
+    document = read_document(summary_file, settings.SUMMARY_UPLOAD_MAX_BYTES)
+    if not isinstance(document, dict) or not isinstance(document.get('rollups', []), list):
+        raise SummaryUploadError("Expected an object with a summary and a list of rollups")
+    try:
+        summary = ingest.check_summary(document.get('summary'))
+        rollups = ingest.check_rollups(document.get('rollups', []), summary)
+    except ValueError as e:
+        raise SummaryUploadError(str(e))
+
+    column_store = None
+    if columns_file is not None:
+        summary, rollups, column_store = recompute(summary, columns_file)
+
+    try:
+        dataset = store_dataset(user, file_name, summary, rollups, column_store)
+    except Exception:
+        if column_store is not None:
+            columnar.release(column_store['key'])
+        raise
+    verified = columns_file is not None
+    logger.info(f"Stored summary of {file_name} for user {user.username} ({'verified' if verified else 'unverified'})")
+    return dataset, summary, verified
+
+
+def recompute(claimed, columns_file):
+    """
+    The claimed summary once checked against the uploaded columns, the
+    columns' rollups, and the columnar store they were written to (None when
+    the store is off or the columns outgrow it).
+    """
+    try:
+        _, frames = ingest.read_column_sample(columns_file, settings.SUMMARY_UPLOAD_COLUMNS_MAX_BYTES)
+    except ValueError as e:
+        raise SummaryUploadError(str(e))
+
+    aggregate = ingest.PartialAggregate()
+    rollup = RollupAggregate()
+    store = columnar.writer()
+    try:
+        for df in frames:
+            if ingest.TYPE_COLUMN not in df.columns:
+                raise SummaryUploadError(f"The columns lack {ingest.TYPE_COLUMN}, so the summary cannot be checked")
+            aggregate.update(df, ingest.TYPE_COLUMN, preview=False)
+            rollup.update(df)
+            if store is not None:
+                store.update(df)
+        computed = aggregate.to_summary()
+        try:
+            ingest.verify_summary(claimed, computed)
+        except ValueError as e:
+            raise SummaryUploadError(str(e))
+    except Exception:
+        if store is not None:
+            store.abort()
+        raise
+
+    column_store = columnar.commit(store.finish(), columnar.store_key('')) if store is not None else None
+    return claimed, rollup.rows(), column_store
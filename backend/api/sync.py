@@ -0,0 +1,111 @@
+"""
+Delta sync of a user's history for clients that keep their own copy, such as
+the desktop dashboard's offline cache. A client holds a cursor, the id of the
+last DatasetChange it applied, and asks for what changed after it: datasets
+created since, with their summaries, and ids of datasets deleted since.
+Without a cursor, or with one older than the pruned log, it gets a full
+snapshot to replace its copy with.
+"""
+from django.db.models import Max, Min
+
+from .models import DatasetChange, DatasetDistribution, DatasetPreview, EquipmentDataset
+
+
+class SyncError(ValueError):
+    """The cursor is not one this server handed out."""
+
+
+def parse_cursor(value):
+    if value in (None, ''):
+        return None
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        raise SyncError(f"Malformed cursor: {value!r}")
+    if cursor < 0:
+        raise SyncError(f"Malformed cursor: {value!r}")
+    return cursor
+
+
+def _resumable(cursor):
+    """Whether every change after `cursor` is still in the log."""
+    bounds = DatasetChange.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['last'] is None:
+        return cursor == 0
+    # Past the end: the log was reset under the client.
+    return bounds['first'] - 1 <= cursor <= bounds['last']
+
+
+def _floor():
+    """The cursor just before the oldest logged change; every change up to it is gone."""
+    first = DatasetChange.objects.aggregate(first=Min('pk'))['first']
+    return first - 1 if first is not None else 0
+
+
+def serialize(datasets):
+    """Datasets as sync items: the history listing's fields plus the summary, from three queries."""
+    datasets = list(datasets)
+    ids = [dataset.pk for dataset in datasets]
+    distributions = {pk: {} for pk in ids}
+    rows = (
+        DatasetDistribution.objects.filter(dataset_id__in=ids)
+        .order_by('-count', 'category').values_list('dataset_id', 'category', 'count')
+    )
+    for dataset_id, category, count in rows:
+        distributions[dataset_id][category] = count
+    previews = dict(DatasetPreview.objects.filter(dataset_id__in=ids).values_list('dataset_id', 'rows'))
+
+    return [
+        {
+            "id": dataset.pk,
+            "name": dataset.file_name,
+            "date": dataset.upload_date.isoformat(),
+            "summary": {
+                "total_count": dataset.total_count,
+                "averages": dataset.averages,
+                "distribution": distributions[dataset.pk],
+                "raw_data": previews.get(dataset.pk) or [],
+            },
+        }
+        for dataset in datasets
+    ]
+
+
+def changes_since(user_id, cursor=None):
+    """
+    What changed for the user after `cursor`, as {"cursor", "reset",
+    "datasets", "deleted"}; None when nothing did. With reset set, datasets
+    is the whole history and the client drops everything else it holds.
+    """
+    user_changes = DatasetChange.objects.filter(user_id=user_id)
+    if cursor is None or not _resumable(cursor):
+        # Cursor first: whatever commits after it is replayed by the next sync.
+        latest = user_changes.aggregate(last=Max('pk'))['last'] or 0
+        datasets = EquipmentDataset.objects.filter(user_id=user_id).order_by('-upload_date')
+        return {
+            # An idle user's cursor moves up to the floor, so later syncs can resume.
+            "cursor": max(latest, _floor()),
+            "reset": True,
+            "datasets": serialize(datasets),
+            "deleted": [],
+        }
+
+    log = list(user_changes.filter(pk__gt=cursor).order_by('pk').values_list('pk', 'dataset_id', 'action'))
+    if not log:
+        return None
+
+    created, deleted = [], set()
+    for _, dataset_id, action in log:
+        if action == DatasetChange.CREATED:
+            created.append(dataset_id)
+        else:
+            deleted.add(dataset_id)
+    datasets = EquipmentDataset.objects.filter(
+        user_id=user_id, pk__in=[pk for pk in created if pk not in deleted]
+    ).order_by('-upload_date')
+    return {
+        "cursor": log[-1][0],
+        "reset": False,
+        "datasets": serialize(datasets),
+        "deleted": sorted(deleted),
+    }
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+EQUIPMENT_TYPES = ['Pump', 'Valve', 'Compressor', 'HeatExchanger', 'Reactor', 'Condenser']
+
+
+def type_labels(count, accented=False):
+    """
+    `count` distinct Type labels: the usual six first, then numbered ones.
+    accented puts non-ASCII letters in them, so the file's encoding matters.
+    """
+    labels = [
+        EQUIPMENT_TYPES[n] if n < len(EQUIPMENT_TYPES) else f"{EQUIPMENT_TYPES[n % len(EQUIPMENT_TYPES)]}-{n}"
+        for n in range(count)
+    ]
+    return [label.replace('e', 'é') for label in labels] if accented else labels
+
+
+def equipment_frame(rows, seed=0, offset=0, types=None):
+    """Build rows of equipment telemetry shaped like sample_equipment_data.csv, drawing Type from `types`."""
+    rng = np.random.default_rng(seed)
+    types = rng.choice(types or EQUIPMENT_TYPES, size=rows)
+    ids = np.arange(offset, offset + rows).astype(str)
+    return pd.DataFrame({
+        "Equipment Name": pd.Series(types, dtype=object) + '-' + ids,
+        "Type": types,
+        "Flowrate": rng.normal(110, 30, rows).round(2),
+        "Pressure": rng.normal(6, 1.5, rows).round(2),
+        "Temperature": rng.normal(110, 15, rows).round(1),
+    })
+
+
+def equipment_csv(rows, seed=0, offset=0, types=None, malformed=0.0, encoding='utf-8'):
+    """
+    equipment_frame's rows as CSV bytes in `encoding`, header included when
+    offset is 0. A `malformed` share of lines carries extra fields, which the
+    parser skips.
+    """
+    text = equipment_frame(rows, seed=seed, offset=offset, types=types).to_csv(index=False, header=offset == 0)
+    if malformed:
+        lines = text.splitlines(keepends=True)
+        first = 1 if offset == 0 else 0
+        rng = np.random.default_rng(seed + 1)
+        for index in np.flatnonzero(rng.random(len(lines) - first) < malformed) + first:
+            lines[index] = lines[index].rstrip('\r\n') + ',extra,fields\n'
+        text = ''.join(lines)
+    # A byte order mark belongs at the start of the file only.
+    if offset and encoding == 'utf-8-sig':
+        encoding = 'utf-8'
+    return text.encode(encoding)
+
+
+def write_equipment_csv(path, rows, seed=0, batch_rows=1_000_000, types=None, malformed=0.0, encoding='utf-8'):
+    """Write a synthetic equipment CSV of the given size in bounded batches; see equipment_csv."""
+    written = 0
+    with open(path, 'wb') as handle:
+        while written < rows:
+            size = min(batch_rows, rows - written)
+            handle.write(equipment_csv(size, seed + written, written, types, malformed, encoding))
+            written += size
+    return path
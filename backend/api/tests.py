@@ -0,0 +1,903 @@
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+import zipfile
+from unittest import mock, skipUnless
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from . import authentication, columnar, events, ingest, reports, rowquery, summary_cache
+from .benchmarks import SUITES, BenchSuite, compare, scratch_files, summarize_samples
+from .compression import brotli
+from .models import AuthToken, DatasetChange, EquipmentDataset, UploadJob, UserAggregate
+from .renderers import msgpack
+from .retention import lock_user, trim_history
+from .services import store_dataset
+from .simulations import InterruptedUpload, stress_retention
+from .synthetic import equipment_csv, equipment_frame, type_labels, write_equipment_csv
+from .utils import process_csv_path
+
+
+def wait_for_job(job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    job = UploadJob.objects.get(pk=job_id)
+    while job.status not in UploadJob.FINISHED and time.monotonic() < deadline:
+        time.sleep(0.05)
+        job = UploadJob.objects.get(pk=job_id)
+    return job
+
+
+class ScratchFilesMixin:
+    """Spool, reports, columns and cache of each test's own, as the database is."""
+
+    def setUp(self):
+        super().setUp()
+        self.workdir = self.enterContext(scratch_files())
+        # Ids restart with every test database; cached history would outlive them.
+        cache.clear()
+
+
+class SyntheticDataTests(SimpleTestCase):
+    def test_seeded_rows_repeat(self):
+        self.assertEqual(equipment_csv(200, seed=3), equipment_csv(200, seed=3))
+        self.assertNotEqual(equipment_csv(200, seed=3), equipment_csv(200, seed=4))
+
+    def test_types_malformed_lines_and_encoding(self):
+        self.assertEqual(equipment_frame(1000, types=type_labels(40))['Type'].nunique(), 40)
+        lines = equipment_csv(1000, malformed=0.1).decode().splitlines()
+        self.assertEqual(len(lines), 1001)
+        self.assertTrue(50 < sum(line.endswith(',extra,fields') for line in lines) < 150)
+        accented = equipment_csv(10, types=type_labels(6, accented=True), encoding='utf-8-sig')
+        self.assertTrue(accented.startswith(b'\xef\xbb\xbf'))
+        self.assertIn('é', accented.decode('utf-8-sig'))
+
+
+class IngestTests(SimpleTestCase):
+    def test_types_read_as_numbers_in_one_chunk_keep_one_key(self):
+        # The first chunks' Type values all look numeric; a later one does not.
+        content = b"Equipment Name,Type,Flowrate\n" + b"a,1,2\n" * 60000 + b"b,X,3\n"
+        summary = ingest.summarize(io.BytesIO(content))
+        self.assertEqual(summary['distribution'], {'1': 60000, 'X': 1})
+
+    def test_short_rows_count_and_sums_stay_exact(self):
+        content = (
+            b"Equipment Name,Type,Flowrate,Pressure,Temperature\n"
+            b"P1,Pump,1.1,30.1,100.3\nV1,Valve\nP2,Pump,2.2,61.5,90.1\n"
+        )
+        for engine in ('auto', 'c', 'python'):
+            with self.subTest(engine=engine):
+                summary = ingest.summarize(io.BytesIO(content), engine=engine)
+                self.assertEqual(summary['total_count'], 3)
+                self.assertEqual(summary['distribution'], {'Pump': 2, 'Valve': 1})
+                self.assertEqual(summary['totals']['avg_pressure']['count'], 2)
+                self.assertAlmostEqual(summary['totals']['avg_pressure']['sum'], 91.6, places=9)
+
+    def test_non_numeric_readings_count_as_missing_on_both_paths(self):
+        content = (
+            b"Equipment Name,Type,Flowrate,Pressure,Temperature\n"
+            b"P1,Pump,1.5,abc,100\nV1,Valve,n/a,6,\nP2,Pump,2.5,8,90\n"
+        )
+        fallback = ingest.summarize(io.BytesIO(content), projected=False)
+        self.assertEqual(fallback['totals']['avg_pressure'], {'sum': 14.0, 'count': 2})
+        for engine in ('c', 'python', 'pyarrow'):
+            with self.subTest(engine=engine):
+                summary = ingest.summarize(io.BytesIO(content), engine=engine)
+                for key in ('total_count', 'averages', 'totals', 'distribution'):
+                    self.assertEqual(summary[key], fallback[key], key)
+
+
+class DatasetStorageTests(ScratchFilesMixin, TestCase):
+    def test_labels_alike_in_their_first_255_characters_share_a_row(self):
+        user = User.objects.create_user(username='alice')
+        prefix = 'P' * 255
+        summary = dict(REPORT_SUMMARY, distribution={prefix + '-a': 2, prefix + '-b': 3, 'Valve': 1})
+        dataset = store_dataset(user, 'long.csv', summary)
+        self.assertEqual(dataset.distribution_dict(), {prefix: 5, 'Valve': 1})
+
+
+class BenchmarkComparisonTests(SimpleTestCase):
+    def test_summarize_samples(self):
+        figures = summarize_samples([0.3, 0.1, 0.2], throughput=10.0)
+        self.assertEqual(figures['samples'], 3)
+        self.assertEqual((figures['p50'], figures['min'], figures['max']), (0.2, 0.1, 0.3))
+        self.assertEqual(figures['throughput'], 10.0)
+
+    def test_compare_flags_slowdowns_past_the_threshold(self):
+        baseline = {'a': {'p50': 1.0}, 'b': {'p50': 1.0}, 'gone': {'p50': 1.0}}
+        results = {'a': {'p50': 1.1}, 'b': {'p50': 1.5}, 'new': {'p50': 9.0}}
+        changes, regressions = compare(results, baseline, 0.15)
+        self.assertEqual([case for case, _ in changes], ['a', 'b'])
+        self.assertEqual([case for case, _ in regressions], ['b'])
+
+
+class BenchSuiteTests(ScratchFilesMixin, TransactionTestCase):
+    """The benchmark suite at small sizes: every case runs and comes out as figures."""
+
+    def test_every_suite_runs(self):
+        suite = BenchSuite(User.objects.create_user(username='bench'), rows=[300], concurrency=[1, 2], repeat=1)
+        results = suite.run()
+
+        self.assertEqual({case.split('/')[0] for case in results}, set(SUITES))
+        self.assertIn('upload/rows=300/c=2', results)
+        self.assertIn('pdf/warm/types=500/c=2', results)
+        for case, figures in results.items():
+            self.assertGreater(figures['p50'], 0, case)
+        self.assertEqual(results['upload/rows=300/c=2']['samples'], 2)
+        json.dumps({"meta": suite.meta(), "results": results})
+
+
+class RetentionTests(ScratchFilesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+
+    def trim(self, stored, limit):
+        for n in range(stored):
+            EquipmentDataset.objects.create_from_summary(self.user, f"{n}.csv", REPORT_SUMMARY)
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                lock_user(self.user.pk)
+                removed = trim_history(self.user.pk, limit)
+        return removed, len(queries)
+
+    def test_trim_costs_the_same_statements_however_many_it_drops(self):
+        removed, statements = self.trim(3, 2)
+        self.assertEqual(removed, 1)
+        removed, more_statements = self.trim(8, 2)
+        self.assertEqual(removed, 8)
+        self.assertEqual(more_statements, statements)
+
+    def test_trim_keeps_the_aggregate_and_change_log_in_step(self):
+        self.trim(5, 2)
+        self.assertEqual(
+            list(EquipmentDataset.objects.filter(user=self.user).order_by('pk').values_list('file_name', flat=True)),
+            ['3.csv', '4.csv'],
+        )
+        aggregate = UserAggregate.objects.get(user=self.user)
+        self.assertEqual((aggregate.dataset_count, aggregate.total_count), (2, 2 * REPORT_SUMMARY['total_count']))
+        self.assertEqual(DatasetChange.objects.filter(user=self.user, action=DatasetChange.DELETED).count(), 3)
+        self.assertEqual(aggregate.total_count, UserAggregate.objects.rebuild(self.user.pk).total_count)
+
+
+class RetentionStressTests(ScratchFilesMixin, TransactionTestCase):
+    """Concurrent stores for one user never leave more datasets than the retention limit."""
+
+    def test_limit_holds_under_concurrent_stores(self):
+        user = User.objects.create_user(username='retention-stress')
+        figures = stress_retention(user, uploaders=4, uploads=5, limit=3)
+
+        self.assertEqual(figures['stored'], 20)
+        self.assertLessEqual(figures['peak'], 3)
+        self.assertEqual(figures['final'], 3)
+        # The newest store of some uploader is among those kept.
+        kept = set(EquipmentDataset.objects.filter(user=user).values_list('file_name', flat=True))
+        self.assertTrue(kept & {f"stress-{n}-4.csv" for n in range(4)})
+
+
+class ChunkedUploadTests(ScratchFilesMixin, TransactionTestCase):
+    """Resumable uploads through /api/uploads/."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        self.csv_path = write_equipment_csv(os.path.join(self.workdir, 'upload.csv'), 8000, seed=1)
+        with open(self.csv_path, 'rb') as handle:
+            self.content = handle.read()
+
+    def start(self, **body):
+        body = {"file_name": 'upload.csv', "total_size": len(self.content), "chunk_size": 64 * 1024, **body}
+        response = self.client.post('/api/uploads/', data=json.dumps(body), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put_chunk(self, upload, index):
+        size = upload['chunk_size']
+        return self.client.put(
+            f"/api/uploads/{upload['upload_id']}/chunks/{index}/",
+            data=self.content[index * size:(index + 1) * size], content_type='application/octet-stream',
+        )
+
+    def test_interrupted_transfer_matches_one_shot_parse(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            figures = InterruptedUpload(
+                self.user, self.csv_path, random.Random(1), 64 * 1024, drop_rate=0.3, interrupt_after=3, parallel=2,
+            ).run(timeout=30)
+
+        self.assertGreater(figures['chunks'], 3)
+        self.assertGreater(figures['rounds'], 1)
+        self.assertGreater(figures['dropped'], 0)
+        self.assertEqual(figures['sends'], figures['chunks'] + figures['dropped'])
+        self.assertEqual(figures['job'].result['total_count'], 8000)
+
+    def test_declared_digest_does_not_stand_in_for_the_bytes(self):
+        upload = self.start()
+        for index in range(upload['total_chunks']):
+            self.assertEqual(self.put_chunk(upload, index).status_code, 200)
+        self.client.post(f"/api/uploads/{upload['upload_id']}/complete/")
+        self.assertEqual(wait_for_job(upload['job']['job_id']).status, UploadJob.SUCCEEDED)
+
+        # Someone else who only knows the digest gets nothing from it.
+        bob = User.objects.create_user(username='bob')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(bob)[1]}")
+        upload = self.start(total_size=1, sha256=hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(upload['job']['status'], UploadJob.WAITING)
+        self.assertIsNone(upload['job'].get('result'))
+        self.assertFalse(EquipmentDataset.objects.filter(user=bob).exists())
+
+    @override_settings(CHUNKED_UPLOAD_PARK_SECONDS=1)
+    def test_stalled_parse_parks_and_resumes(self):
+        upload = self.start(sha256=hashlib.sha256(self.content).hexdigest())
+        self.put_chunk(upload, 0)
+        time.sleep(2.5)
+        job = UploadJob.objects.get(pk=upload['job']['job_id'])
+        self.assertEqual(job.status, UploadJob.WAITING)
+        self.assertTrue(os.path.exists(job.spool_path))
+
+        for index in range(1, upload['total_chunks']):
+            self.assertEqual(self.put_chunk(upload, index).status_code, 200)
+        self.client.post(f"/api/uploads/{upload['upload_id']}/complete/")
+        job = wait_for_job(job.pk)
+        self.assertEqual(job.status, UploadJob.SUCCEEDED, job.error)
+        self.assertEqual(job.result['total_count'], 8000)
+
+
+class UploadJobTests(ScratchFilesMixin, TransactionTestCase):
+    """Upload jobs, and long-polling them on /api/async/jobs/."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+
+    def test_failure_after_the_dataset_commit_keeps_the_job(self):
+        with mock.patch.object(summary_cache, 'store', side_effect=RuntimeError('cache down')), \
+                self.assertLogs('api.jobs', 'ERROR') as logs:
+            response = self.client.post('/api/upload/', {'file': ContentFile(equipment_csv(500), name='upload.csv')})
+            job = wait_for_job(response.json()['job_id'])
+
+        self.assertIn('Could not cache the summary', logs.output[0])
+        self.assertEqual(job.status, UploadJob.SUCCEEDED, job.error)
+        self.assertEqual(job.dataset.total_count, 500)
+        if job.dataset.column_key:
+            self.assertTrue(os.path.isdir(columnar.store_path(job.dataset.column_key)))
+
+    def test_long_poll_wakes_on_job_events(self):
+        job = UploadJob.objects.create(user=self.user, file_name='x.csv', status=UploadJob.RUNNING)
+
+        def progress():
+            UploadJob.objects.filter(pk=job.pk).update(progress=40)
+            events.publish(self.user.id, events.JOB_PROGRESS, {"job_id": str(job.pk), "progress": 40})
+
+        threading.Timer(0.3, progress).start()
+        started = time.monotonic()
+        data = self.client.get(f"/api/async/jobs/{job.pk}/", {'wait': 10, 'progress': 0}).json()
+        self.assertEqual(data['progress'], 40)
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_long_poll_returns_the_job_as_it_is_when_the_wait_ends(self):
+        job = UploadJob.objects.create(user=self.user, file_name='x.csv', status=UploadJob.QUEUED)
+        started = time.monotonic()
+        self.assertEqual(self.client.get(f"/api/async/jobs/{job.pk}/", {'wait': 1}).json()['status'], UploadJob.QUEUED)
+        self.assertGreaterEqual(time.monotonic() - started, 1)
+        self.assertEqual(self.client.get(f"/api/async/jobs/{job.pk}/", {'wait': 'x'}).status_code, 400)
+
+
+class SummaryCacheTests(ScratchFilesMixin, TransactionTestCase):
+    """Content uploaded before is answered from the summary cache, without a parse."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        self.content = equipment_csv(500, seed=4)
+
+    def upload(self, content, name='upload.csv'):
+        return self.client.post('/api/upload/', {'file': ContentFile(content, name=name)})
+
+    def test_repeat_upload_is_answered_from_the_cache(self):
+        first = self.upload(self.content)
+        self.assertEqual(first.status_code, 202)
+        job = wait_for_job(first.json()['job_id'])
+        self.assertEqual(job.status, UploadJob.SUCCEEDED, job.error)
+
+        hits = summary_cache.stats()['hits']
+        repeat = self.upload(self.content, name='again.csv')
+        self.assertEqual(repeat.status_code, 201)
+        self.assertEqual(repeat.json()['status'], UploadJob.SUCCEEDED)
+        self.assertEqual(repeat.json()['result']['total_count'], 500)
+        self.assertEqual(repeat.json()['result']['distribution'], job.result['distribution'])
+        self.assertEqual(summary_cache.stats()['hits'], hits + 1)
+        self.assertEqual(
+            sorted(EquipmentDataset.objects.filter(user=self.user).values_list('file_name', flat=True)),
+            ['again.csv', 'upload.csv'],
+        )
+
+        # One byte more is other content, parsed afresh.
+        other = self.upload(self.content + b'\n')
+        self.assertEqual(other.status_code, 202)
+        self.assertEqual(wait_for_job(other.json()['job_id']).status, UploadJob.SUCCEEDED)
+
+class BatchUploadTests(ScratchFilesMixin, TestCase):
+    """Several CSVs, loose and zipped, in one request to /api/upload/batch/."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+
+    def test_each_file_gets_its_summary_or_error_in_upload_order(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zipped:
+            zipped.writestr('inner/zipped.csv', equipment_csv(50, seed=3))
+            zipped.writestr('notes.txt', 'not a csv')
+        files = [
+            ContentFile(equipment_csv(100, seed=1), name='first.csv'),
+            ContentFile(b'', name='empty.csv'),
+            ContentFile(archive.getvalue(), name='more.zip'),
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/upload/batch/', {'files': files})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['succeeded'], data['failed']), (2, 1))
+        results = data['results']
+        self.assertEqual([entry['file_name'] for entry in results], ['first.csv', 'empty.csv', 'zipped.csv'])
+        self.assertEqual([entry['status'] for entry in results], ['succeeded', 'failed', 'succeeded'])
+        self.assertIn('empty', results[1]['error'])
+        self.assertEqual([results[0]['result']['total_count'], results[2]['result']['total_count']], [100, 50])
+        self.assertEqual(
+            set(EquipmentDataset.objects.filter(user=self.user).values_list('pk', flat=True)),
+            {results[0]['dataset_id'], results[2]['dataset_id']},
+        )
+
+    def test_rejects_a_batch_it_cannot_accept(self):
+        self.assertEqual(self.client.post('/api/upload/batch/', {}).status_code, 400)
+        response = self.client.post('/api/upload/batch/', {'files': [ContentFile(b'not a zip', name='bad.zip')]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bad.zip', response.json()['error'])
+
+REPORT_SUMMARY = {
+    "total_count": 3,
+    "averages": {"avg_flowrate": 110.0, "avg_pressure": 6.0, "avg_temp": 105.0},
+    "distribution": {"Pump": 2, "Valve": 1},
+    "raw_data": [
+        {"Equipment Name": "Pump-1", "Type": "Pump", "Flowrate": 120, "Pressure": 5.2, "Temperature": 110},
+    ],
+}
+
+
+class ReportTests(ScratchFilesMixin, TransactionTestCase):
+    """PDF reports: drawn once however many ask at once, and resumable."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        self.dataset = store_dataset(self.user, 'report.csv', REPORT_SUMMARY)
+        self.url = f"/api/download-pdf/{self.dataset.pk}/"
+
+    def test_concurrent_requests_draw_the_report_once(self):
+        render = reports.render_report
+
+        def slow_render(dataset):
+            time.sleep(0.5)
+            return render(dataset)
+
+        before = reports.stats()['renders']
+        with mock.patch.object(reports, 'render_report', side_effect=slow_render):
+            threads = [threading.Thread(target=reports.get_report, args=(self.dataset.pk,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.1)
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(reports.stats()['renders'] - before, 1)
+        self.assertNotIn(self.dataset.pk, reports._render_locks)
+
+    def test_ranges_resume_against_the_weak_tag_of_a_compressed_response(self):
+        full = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        etag = full['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        part = self.client.get(self.url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE=etag, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part['Content-Range'].split('/')[0], 'bytes 100-199')
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE='"other"')
+        self.assertEqual(stale.status_code, 200)
+
+    def test_only_a_single_range_past_the_end_is_unsatisfiable(self):
+        size = len(b''.join(self.client.get(self.url).streaming_content))
+        for ignored in ('bytes=0-9,20-29', 'bytes=abc', 'bytes=-', 'bytes=9-0', 'items=0-9'):
+            response = self.client.get(self.url, HTTP_RANGE=ignored)
+            self.assertEqual(response.status_code, 200, ignored)
+            self.assertEqual(len(b''.join(response.streaming_content)), size)
+        for unsatisfiable in (f'bytes={size}-', f'bytes={size + 10}-{size + 20}', 'bytes=-0'):
+            response = self.client.get(self.url, HTTP_RANGE=unsatisfiable)
+            self.assertEqual(response.status_code, 416, unsatisfiable)
+            self.assertEqual(response['Content-Range'], f"bytes */{size}")
+
+
+class HistoryTests(ScratchFilesMixin, TestCase):
+    """History listings and their validators, on the sync and async views alike."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        for name in ('a.csv', 'b.csv'):
+            self.store(name)
+
+    def store(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return store_dataset(self.user, name, REPORT_SUMMARY)
+
+    def test_conditional_get_is_answered_without_the_datasets_table(self):
+        for url in ('/api/history/', '/api/async/history/'):
+            full = self.client.get(url)
+            self.assertEqual(full.status_code, 200)
+            self.assertEqual([entry['name'] for entry in full.json()], ['b.csv', 'a.csv'])
+
+            with CaptureQueriesContext(connection) as queries:
+                for tag in (full['ETag'], f"W/{full['ETag']}"):
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=tag).status_code, 304)
+                modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=full['Last-Modified'])
+                self.assertEqual(modified.status_code, 304)
+            self.assertFalse([query for query in queries if 'api_equipmentdataset' in query['sql']])
+
+    def test_an_upload_changes_the_tag(self):
+        etag = self.client.get('/api/history/')['ETag']
+        self.store('c.csv')
+        response = self.client.get('/api/history/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['name'], 'c.csv')
+
+
+def totals_summary(count, flowrate, distribution):
+    """A summary of `count` rows whose flowrates sum to `flowrate`; pressure and temperature are 1 and 100."""
+    totals = {"sum": flowrate, "count": count}
+    return {
+        "total_count": count,
+        "averages": {"avg_flowrate": round(flowrate / count, 2), "avg_pressure": 1.0, "avg_temp": 100.0},
+        "totals": {
+            "avg_flowrate": totals,
+            "avg_pressure": {"sum": count * 1.0, "count": count},
+            "avg_temp": {"sum": count * 100.0, "count": count},
+        },
+        "distribution": distribution,
+        "raw_data": [],
+    }
+
+
+class StatsTests(ScratchFilesMixin, TestCase):
+    """Exact cross-dataset statistics on /api/stats/, from running totals or a selection."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        self.datasets = [
+            store_dataset(self.user, name, totals_summary(*figures)) for name, figures in (
+                ('a.csv', (2, 10.0, {"Pump": 2})),
+                ('b.csv', (3, 30.0, {"Pump": 1, "Valve": 2})),
+                ('c.csv', (1, 1.0, {"Valve": 1})),
+            )
+        ]
+
+    def test_whole_history_is_exact_and_follows_deletes(self):
+        data = self.client.get('/api/stats/').json()
+        self.assertEqual((data['scope'], data['dataset_count'], data['total_count']), ('all', 3, 6))
+        self.assertAlmostEqual(data['averages']['avg_flowrate'], 41 / 6)
+        self.assertEqual(data['totals']['avg_flowrate'], {"sum": 41.0, "count": 6})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.datasets[0].delete()
+        data = self.client.get('/api/stats/').json()
+        self.assertEqual((data['dataset_count'], data['total_count']), (2, 4))
+        self.assertAlmostEqual(data['averages']['avg_flowrate'], 31 / 4)
+
+    def test_selection_with_breakdown_and_distribution(self):
+        data = self.client.get('/api/stats/', {'last': 2, 'breakdown': 1, 'distribution': 1}).json()
+        self.assertEqual((data['scope'], data['dataset_count'], data['total_count']), ('selection', 2, 4))
+        self.assertAlmostEqual(data['averages']['avg_flowrate'], 31 / 4)
+        self.assertEqual([entry['file_name'] for entry in data['datasets']], ['c.csv', 'b.csv'])
+        self.assertEqual(data['datasets'][0]['averages']['avg_flowrate'], 1.0)
+        self.assertEqual(data['distribution'], {"Valve": 3, "Pump": 1})
+
+        data = self.client.get('/api/stats/', {'datasets': f"{self.datasets[0].pk}"}).json()
+        self.assertEqual((data['dataset_count'], data['averages']['avg_flowrate']), (1, 5.0))
+
+    def test_rejects_bad_filters(self):
+        self.assertEqual(self.client.get('/api/stats/', {'last': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/', {'since': 'yesterday'}).status_code, 400)
+        response = self.client.get('/api/stats/', {'datasets': f"{self.datasets[0].pk},99999"})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('99999', response.json()['error'])
+
+
+class DatasetRowsTests(ScratchFilesMixin, TestCase):
+    """Paged, filtered raw rows on /api/datasets/<id>/rows/, checked against the frame they came from."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        self.frame = equipment_frame(40_000, seed=5)
+        store = columnar.writer()
+        store.update(self.frame)
+        manifest = columnar.commit(store.finish(), 'b' * 64)
+        self.dataset = store_dataset(self.user, 'rows.csv', REPORT_SUMMARY, column_store=manifest)
+        self.url = f"/api/datasets/{self.dataset.pk}/rows/"
+
+    def pages(self, **params):
+        pages, url, params = [], self.url, {'limit': 500, **params}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200, response.content)
+            pages.append(response.json())
+            # The next link carries every parameter along with the cursor.
+            url, params = pages[-1]['next'], {}
+        return pages
+
+    def test_pages_walk_the_sorted_matches_once(self):
+        where = ['Pressure>7', 'Type=Pump|Valve']
+        pages = self.pages(where=where, sort='-Flowrate', fields='Type,Flowrate')
+        rows = [row for page in pages for row in page['rows']]
+
+        pressure = self.frame['Pressure'].astype('float32')
+        expected = self.frame[(pressure > np.float32(7)) & self.frame['Type'].isin(['Pump', 'Valve'])]
+        self.assertEqual(sorted(row['_row'] for row in rows), sorted(expected.index))
+        self.assertEqual(set(rows[0]), {'_row', 'Type', 'Flowrate'})
+        flowrates = [row['Flowrate'] for row in rows]
+        self.assertEqual(flowrates, sorted(flowrates, reverse=True))
+        self.assertTrue(all(len(page['rows']) <= 500 for page in pages))
+        self.assertIsNone(pages[-1]['next_cursor'])
+
+        # Rare matches take the whole-file path; the pages must not change.
+        with mock.patch.object(rowquery, 'SCAN_BEFORE_MASK', 1000):
+            masked = self.pages(where=where, sort='-Flowrate', fields='Type,Flowrate')
+        self.assertEqual([row['_row'] for page in masked for row in page['rows']], [row['_row'] for row in rows])
+
+    def test_predicates_on_the_sort_column_are_counted(self):
+        first = self.client.get(self.url, {'where': 'Flowrate>=150', 'sort': 'Flowrate', 'limit': 10}).json()
+        flowrate = self.frame['Flowrate'].astype('float32')
+        self.assertEqual(first['matched'], int((flowrate >= np.float32(150)).sum()))
+        self.assertEqual(first['total_rows'], 40_000)
+        self.assertEqual(len(first['rows']), 10)
+        self.assertGreaterEqual(first['rows'][0]['Flowrate'], 150)
+
+    def test_rejects_what_does_not_fit_the_dataset(self):
+        first = self.client.get(self.url, {'sort': 'Pressure', 'limit': 5}).json()
+        for params in (
+            {'where': 'Pressure>high'},
+            {'where': 'Type>Pump'},
+            {'fields': 'Colour'},
+            {'limit': 0},
+            {'cursor': 'not-a-cursor'},
+            # A cursor only resumes the query it came from.
+            {'sort': 'Flowrate', 'cursor': first['next_cursor']},
+        ):
+            self.assertEqual(self.client.get(self.url, params).status_code, 400, params)
+        other = store_dataset(User.objects.create_user(username='bob'), 'other.csv', REPORT_SUMMARY)
+        self.assertEqual(self.client.get(f"/api/datasets/{other.pk}/rows/").status_code, 404)
+
+
+class DatasetAggregateTests(ScratchFilesMixin, TestCase):
+    """Windowed rollups and column statistics of one dataset, checked against the frame it was parsed from."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        self.frame = equipment_frame(600, seed=6)
+        # Three days of readings, seven minutes apart.
+        self.frame['Timestamp'] = pd.date_range('2024-01-01', periods=600, freq='7min')
+        path = os.path.join(self.workdir, 'readings.csv')
+        self.frame.to_csv(path, index=False)
+        summary, rollup_rows, staged, _ = process_csv_path(
+            path, store_root=settings.COLUMN_STORE_DIR, store_max_bytes=settings.COLUMN_STORE_DATASET_MAX_BYTES,
+        )
+        manifest = columnar.commit(staged, 'c' * 64)
+        self.dataset = store_dataset(self.user, 'readings.csv', summary, rollup_rows, manifest)
+
+    def test_rollups_merge_into_the_requested_window(self):
+        url = f"/api/datasets/{self.dataset.pk}/rollups/"
+        overall = self.client.get(url, {'granularity': 'all', 'metrics': 'Flowrate'}).json()
+        self.assertEqual(overall['stored_bucket_seconds'], 3600)
+        by_type = self.frame.groupby('Type')['Flowrate']
+        self.assertEqual({result['key']: result['count'] for result in overall['results']}, by_type.size().to_dict())
+        for result in overall['results']:
+            figures = result['metrics']['Flowrate']
+            self.assertAlmostEqual(figures['mean'], by_type.mean()[result['key']], places=3)
+            self.assertEqual(figures['max'], by_type.max()[result['key']])
+
+        daily = self.client.get(url, {
+            'granularity': 'day', 'key': 'Pump', 'start': '2024-01-02', 'end': '2024-01-03',
+        }).json()
+        self.assertEqual(len(daily['results']), 1)
+        day = self.frame[(self.frame['Type'] == 'Pump') & (self.frame['Timestamp'].dt.day == 2)]
+        self.assertEqual(daily['results'][0]['count'], len(day))
+        self.assertAlmostEqual(daily['results'][0]['metrics']['Pressure']['mean'], day['Pressure'].mean(), places=3)
+
+        for params in ({'granularity': 'month'}, {'metrics': 'Colour'}, {'scope': 'site'}, {'start': 'soon'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400, params)
+
+    def test_column_statistics_per_category(self):
+        url = f"/api/datasets/{self.dataset.pk}/columns/"
+        data = self.client.get(url, {'describe': 'Temperature', 'by': 'Type', 'percentiles': '50'}).json()
+        self.assertEqual(data['rows'], 600)
+        by_type = self.frame.groupby('Type')['Temperature']
+        for group in data['describe']:
+            figures = group['metrics']['Temperature']
+            self.assertEqual(group['rows'], by_type.size()[group['key']])
+            self.assertAlmostEqual(figures['mean'], by_type.mean()[group['key']], places=3)
+            self.assertAlmostEqual(figures['p50'], by_type.median()[group['key']], places=3)
+
+        self.assertEqual(self.client.get(url, {'describe': 'Type'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'describe': 'Flowrate', 'by': 'Pressure'}).status_code, 400)
+
+
+class EventBrokerTests(SimpleTestCase):
+    """Per-user fan-out, replay for reconnecting clients, and resync when replay cannot help."""
+
+    def test_fan_out_replay_and_resync(self):
+        async def scenario():
+            broker = events.Broker(replay=3)
+            alice, bob = broker.subscribe(1), broker.subscribe(2)
+            # From another thread, as on_commit hooks publish.
+            publisher = threading.Thread(target=lambda: [
+                broker.publish(1, events.DATASET_CREATED, {"id": n}) for n in range(5)
+            ])
+            publisher.start()
+            publisher.join()
+            received = [await alice.get(1) for _ in range(5)]
+            self.assertEqual([event.data['id'] for event in received], list(range(5)))
+            self.assertIsNone(await bob.get(0.05))
+
+            # Reconnecting after the fourth event: the fifth is replayed.
+            replayed = broker.subscribe(1, received[3].id)
+            self.assertEqual((await replayed.get(1)).data, {"id": 4})
+            # The first is no longer kept, nor is anything from another process.
+            for last_event_id in (received[0].id, 'elsewhere-1'):
+                self.assertEqual((await broker.subscribe(1, last_event_id).get(1)).name, events.RESYNC)
+
+            for subscription in (alice, bob, replayed):
+                subscription.close()
+            self.assertEqual(broker.subscriber_count(2), 0)
+
+        asyncio.run(scenario())
+
+    def test_overflowing_subscriber_is_told_to_resync(self):
+        async def scenario():
+            broker = events.Broker()
+            subscription = broker.subscribe(1)
+            for n in range(events.QUEUE_SIZE + 1):
+                broker.publish(1, events.JOB_PROGRESS, {"progress": n})
+            await asyncio.sleep(0)
+            event = await subscription.get(1)
+            self.assertEqual((event.name, event.data), (events.RESYNC, {"reason": "overflow"}))
+            self.assertIsNone(await subscription.get(0.05))
+
+        asyncio.run(scenario())
+
+
+class EventStreamTests(TestCase):
+    """The server-sent event stream of /api/async/events/."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice')
+        self.auth = {'Authorization': f"Token {AuthToken.objects.issue(self.user)[1]}"}
+
+    async def test_stream_carries_the_users_events(self):
+        response = await AsyncClient().get('/api/async/events/', headers=self.auth)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+
+        events.publish(self.user.id + 1, events.DATASET_CREATED, {"id": 1})
+        published = events.publish(self.user.id, events.DATASET_CREATED, {"id": 2, "cursor": 7})
+        self.assertEqual(await anext(stream), published.encode().encode())
+        self.assertEqual(events.broker.subscriber_count(self.user.id), 1)
+
+        # A client going away cancels the stream while it waits, as the ASGI handler does.
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(events.broker.subscriber_count(self.user.id), 0)
+
+    def test_needs_the_asgi_server(self):
+        self.assertEqual(Client(headers=self.auth).get('/api/async/events/').status_code, 501)
+        self.assertEqual(Client().get('/api/async/events/').status_code, 401)
+
+
+class CompactResponseTests(ScratchFilesMixin, TestCase):
+    """?fields= selections, MessagePack for clients that ask for it, and compressed bodies."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        job = UploadJob.objects.create(
+            user=self.user, file_name='report.csv', status=UploadJob.SUCCEEDED, result=REPORT_SUMMARY,
+        )
+        self.job_url = f"/api/jobs/{job.pk}/"
+        with self.captureOnCommitCallbacks(execute=True):
+            store_dataset(self.user, 'report.csv', REPORT_SUMMARY)
+
+    def test_fields_trim_the_summary_and_history_entries(self):
+        data = self.client.get(self.job_url, {'fields': 'total_count,averages.avg_temp,missing'}).json()
+        self.assertEqual(data['result'], {"total_count": 3, "averages": {"avg_temp": 105.0}})
+        self.assertEqual(data['status'], UploadJob.SUCCEEDED)
+
+        for url in ('/api/history/', '/api/async/history/'):
+            self.assertEqual(self.client.get(url, {'fields': 'name'}).json(), [{"name": 'report.csv'}])
+            self.assertEqual(self.client.get(url, {'fields': 'averages..avg_temp'}).status_code, 400)
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack_decodes_to_the_json_body(self):
+        for url in (self.job_url, '/api/history/', '/api/async/history/'):
+            packed = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(packed['Content-Type'], 'application/msgpack')
+            self.assertIn('Accept', packed['Vary'])
+            self.assertEqual(msgpack.unpackb(packed.content), self.client.get(url).json())
+
+    def test_bodies_are_compressed_for_clients_that_accept_it(self):
+        plain = self.client.get(self.job_url).content
+        encodings = [('gzip', gzip.decompress)] + ([('br', brotli.decompress)] if brotli else [])
+        for encoding, decompress in encodings:
+            response = self.client.get(self.job_url, HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertEqual(decompress(response.content), plain)
+
+
+class ColumnStoreTests(ScratchFilesMixin, TransactionTestCase):
+    """Columnar stores shared by content: removed with their last dataset, never under a new one."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        store = columnar.writer()
+        store.update(equipment_frame(100))
+        self.manifest = columnar.commit(store.finish(), 'a' * 64)
+
+    def test_store_outlives_a_delete_racing_a_new_dataset(self):
+        first = store_dataset(self.user, 'first.csv', REPORT_SUMMARY, column_store=self.manifest)
+        inserted, deleted = threading.Event(), threading.Event()
+
+        def store_second():
+            try:
+                with transaction.atomic():
+                    store_dataset(self.user, 'second.csv', REPORT_SUMMARY, column_store=self.manifest)
+                    inserted.set()
+                    deleted.wait(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=store_second)
+        thread.start()
+        inserted.wait(5)
+        first.delete()
+        deleted.set()
+        thread.join()
+
+        self.assertTrue(os.path.isdir(columnar.store_path(self.manifest['key'])))
+        self.assertEqual(EquipmentDataset.objects.get(file_name='second.csv').column_key, self.manifest['key'])
+
+    def test_dataset_stored_after_its_store_went_has_no_columns(self):
+        self.assertTrue(columnar.release(self.manifest['key']))
+        dataset = store_dataset(self.user, 'late.csv', REPORT_SUMMARY, column_store=self.manifest)
+        self.assertFalse(dataset.column_key)
+
+    def test_last_dataset_takes_the_store_along(self):
+        datasets = [
+            store_dataset(self.user, f"{n}.csv", REPORT_SUMMARY, column_store=self.manifest) for n in range(2)
+        ]
+        datasets[0].delete()
+        self.assertTrue(os.path.isdir(columnar.store_path(self.manifest['key'])))
+        datasets[1].delete()
+        self.assertFalse(os.path.isdir(columnar.store_path(self.manifest['key'])))
+
+
+class ServerTimingTests(ScratchFilesMixin, TestCase):
+    """Server-Timing goes to staff, and to everyone only when SERVER_TIMING_PUBLIC says so."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alice')
+        self.staff = User.objects.create_user(username='admin', is_staff=True)
+
+    def get_history(self, user=None):
+        headers = {'HTTP_AUTHORIZATION': f"Token {AuthToken.objects.issue(user)[1]}"} if user else {}
+        return Client(**headers).get('/api/history/')
+
+    def test_sent_to_staff_only(self):
+        self.assertNotIn('Server-Timing', self.get_history())
+        self.assertNotIn('Server-Timing', self.get_history(self.user))
+        self.assertIn('total;dur=', self.get_history(self.staff)['Server-Timing'])
+
+    @override_settings(SERVER_TIMING_PUBLIC=True)
+    def test_sent_to_everyone_when_public(self):
+        self.assertIn('Server-Timing', self.get_history())
+        self.assertIn('Server-Timing', self.get_history(self.user))
+
+
+@override_settings(AUTH_CACHE_SHARED=True)
+class TokenCacheTests(ScratchFilesMixin, TestCase):
+    """Tokens answered from the process and shared caches, which let go of them on logout or deactivation."""
+
+    def setUp(self):
+        super().setUp()
+        authentication._local.clear()
+        self.addCleanup(authentication._local.clear)
+        self.user = User.objects.create_user(username='alice', password='secret')
+        self.key = AuthToken.objects.issue(self.user)[1]
+        self.client = Client(HTTP_AUTHORIZATION=f"Token {self.key}")
+
+    def test_shared_cache_holds_no_user(self):
+        authentication.resolve(self.key)
+        entry = cache.get(authentication._shared_key(AuthToken.digest_of(self.key)))
+        self.assertEqual(set(entry), {'user_id', 'is_active', 'created_at', 'expires_at', 'replaced_at'})
+        self.assertEqual(entry['user_id'], self.user.pk)
+
+        # Another process: only the shared cache is warm.
+        for path in ('/api/history/', '/api/async/history/'):
+            authentication._local.clear()
+            shared_hits = authentication.stats()['shared_hits']
+            self.assertEqual(self.client.get(path).status_code, 200)
+            self.assertEqual(authentication.stats()['shared_hits'], shared_hits + 1)
+
+    def test_warm_token_needs_no_query(self):
+        self.assertEqual(self.client.get('/api/history/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/history/').status_code, 200)
+        self.assertFalse([query for query in queries if 'api_authtoken' in query['sql']])
+
+    def test_logout_revokes_a_warm_token(self):
+        self.client.get('/api/history/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        self.assertIsNone(cache.get(authentication._shared_key(AuthToken.digest_of(self.key))))
+        self.assertEqual(self.client.get('/api/history/').status_code, 401)
+
+    def test_deactivation_revokes_every_token_of_the_user(self):
+        other = Client(HTTP_AUTHORIZATION=f"Token {AuthToken.objects.issue(self.user)[1]}")
+        for client in (self.client, other):
+            self.assertEqual(client.get('/api/history/').status_code, 200)
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        for client in (self.client, other):
+            self.assertEqual(client.get('/api/history/').status_code, 401)
+            self.assertEqual(client.get('/api/async/history/').status_code, 401)
+
+    @override_settings(AUTH_TOKEN_ROTATE_SECONDS=0)
+    def test_old_token_is_replaced_and_lasts_the_grace_period(self):
+        response = self.client.get('/api/history/')
+        replacement = response[authentication.ROTATED_HEADER]
+        old = AuthToken.objects.get(pk=AuthToken.digest_of(self.key))
+        self.assertIsNotNone(old.replaced_at)
+        self.assertLessEqual((old.expires_at - old.replaced_at).total_seconds(), settings.AUTH_TOKEN_GRACE_SECONDS)
+        # Still in its grace period, and not replaced twice.
+        response = self.client.get('/api/history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(authentication.ROTATED_HEADER, response)
+        self.assertEqual(Client(HTTP_AUTHORIZATION=f"Token {replacement}").get('/api/history/').status_code, 200)
@@ -1,37 +1,57 @@
-import pandas as pd
-import io
+import os
 
-def process_csv(file_obj):
+from django.conf import settings
+from django.core.files import File
+
+from . import ingest, metrics
+from .columnar import ColumnWriter
+from .rollups import RollupAggregate
+
+
+def resolve_engine(engine=None):
+    """Map a configured engine name, CSV_PARSER_ENGINE by default, to one that is usable here."""
+    return ingest.resolve_engine(engine or getattr(settings, 'CSV_PARSER_ENGINE', 'auto'))
+
+
+def process_csv(file_obj, engine=None, projected=True, progress=None, rollup=None, store=None, timings=None):
+    """
+    Summarise an uploaded equipment CSV in one streaming pass (see ingest.summarize).
+    rollup, a RollupAggregate, and store, a ColumnWriter, are fed every chunk as well.
+    The parse's phase timings go to the metrics, or into `timings`, a dict,
+    for a caller in another process to record with metrics.record_parse.
+    """
     try:
-        
-        content = file_obj.read().decode('utf-8')
-        
-       
-        if not content.strip():
-            raise ValueError("The uploaded CSV file is empty.")
-
-        df = pd.read_csv(io.StringIO(content), sep=',', on_bad_lines='skip')
-        
-       
-        df.columns = df.columns.str.strip()
-
-        
-        averages = {
-            "avg_flowrate": round(df['Flowrate'].mean(), 2) if 'Flowrate' in df.columns else 0,
-            "avg_pressure": round(df['Pressure'].mean(), 2) if 'Pressure' in df.columns else 0,
-            "avg_temp": round(df['Temperature'].mean(), 2) if 'Temperature' in df.columns else 0,
-        }
-        
-        
-        dist_col = 'Type' if 'Type' in df.columns else df.columns[1]
-        distribution = df[dist_col].value_counts().to_dict()
-        
-        return {
-            "total_count": len(df),
-            "averages": averages,
-            "distribution": distribution,
-            "raw_data": df.head(10).to_dict(orient='records')
-        }
+        consumers = [consumer for consumer in (rollup, store) if consumer is not None]
+        phases = {} if timings is None else timings
+        summary = ingest.summarize(file_obj, resolve_engine(engine), projected, progress, consumers, phases)
+        if timings is None:
+            metrics.record_parse(phases)
+        return summary
+    except OSError:
+        # Reading the source failed, or it has nothing more yet (see chunked.ChunksPending): not a CSV problem.
+        raise
     except Exception as e:
-        
-        raise Exception(f"CSV Processing Error: {str(e)}")
\ No newline at end of file
+
+        raise Exception(f"CSV Processing Error: {str(e)}")
+
+
+def process_csv_path(path, engine=None, store_root=None, store_max_bytes=0):
+    """
+    process_csv for a file on disk, returning the summary, its rollup rows,
+    when store_root is given the directory of its staged columnar copy (see
+    api.columnar.commit), and the parse's timings for metrics.record_parse.
+    Needs no database, so it can run in a worker process.
+    """
+    rollup = RollupAggregate()
+    store = ColumnWriter(store_root, store_max_bytes) if store_root else None
+    timings = {}
+    try:
+        with open(path, 'rb') as handle:
+            summary = process_csv(
+                File(handle, name=os.path.basename(path)), engine=engine, rollup=rollup, store=store, timings=timings,
+            )
+    except Exception:
+        if store is not None:
+            store.abort()
+        raise
+    return summary, rollup.rows(), store.finish() if store is not None else None, timings
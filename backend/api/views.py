@@ -1,16 +1,23 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from .utils import process_csv
-from .models import EquipmentDataset
+from . import aggregates, authentication, columnar, events, history, metrics, reports, rollups, rowquery, summary_cache, sync
+from .fields import FieldsError, requested_fields, select_fields
+from .chunked import abort_upload, create_upload, finalize_upload, received_indexes, received_ranges, write_chunk
+from .batch import BatchError, process_batch
+from .jobs import enqueue_upload
+from .summary_upload import SummaryUploadError, accept_summary
+from .models import AuthToken, ChunkedUpload, DatasetPreview, DatasetRollup, EquipmentDataset, UploadJob
+from .uploadhandlers import HashingUploadHandler
+from django.conf import settings
 from django.contrib.auth import authenticate
 from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, timezone
+import io
 import logging
 
 logger = logging.getLogger(__name__)
@@ -41,15 +48,18 @@ class LoginView(APIView):
                 logger.warning(f"Inactive user login attempt: {username}")
                 return Response({"error": "Account is disabled"}, status=401)
             
-            token, created = Token.objects.get_or_create(user=user)
-            logger.info(f"Successful login for user: {username} (Token {'created' if created else 'retrieved'})")
+            # Each login gets its own token; the user's expired ones go on the way.
+            AuthToken.objects.filter(user=user, expires_at__lt=datetime.now(timezone.utc)).delete()
+            token, key = AuthToken.objects.issue(user)
+            logger.info(f"Successful login for user: {username}")
             
             return Response({
                 "success": True,
                 "user_id": user.id,
                 "username": user.username,
                 "email": user.email,
-                "token": token.key
+                "token": key,
+                "expires": token.expires_at.isoformat(),
             })
         else:
             logger.warning(f"Failed login attempt for username: {username}")
@@ -58,14 +68,16 @@ class LoginView(APIView):
 
 class LogoutView(APIView):
     """
-    Logout endpoint - deletes the user's token
+    Logout endpoint - deletes the token the request was made with; the
+    user's other logins stay signed in
     """
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
         try:
-            # Delete the user's token to logout
-            request.user.auth_token.delete()
+            # Through a queryset: request.auth is the token cache's shared instance.
+            # The delete drops it from the caches too (see api.signals)
+            AuthToken.objects.filter(pk=request.auth.pk).delete()
             return Response({"success": True, "message": "Logged out successfully"})
         except Exception as e:
             logger.error(f"Logout error: {str(e)}")
@@ -73,89 +85,690 @@ class LogoutView(APIView):
 
 
 class UploadView(APIView):
+    """
+    Accepts a CSV and queues it for processing.
+    Responds 202 with a job to poll at /api/jobs/<id>/; the job result is the dataset summary.
+    Content uploaded before is answered from the summary cache with a finished job and 201.
+    ?fields= trims the summary (see api.fields), here and when polling the job.
+    """
     parser_classes = [MultiPartParser, FormParser]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
         logger.info(f"Upload request from user: {request.user.username}")
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        # Must be in place before request.FILES is first touched.
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
         
         if 'file' not in request.FILES:
             return Response({"error": "No file provided"}, status=400)
             
         file_obj = request.FILES['file']
+        digest = hasher.digests.get('file', [''])[0]
         
         try:
-            results = process_csv(file_obj)
-            
-            user_history = EquipmentDataset.objects.filter(user=request.user)
-            if user_history.count() >= 5:
-                user_history.order_by('upload_date').first().delete()
-            
-            EquipmentDataset.objects.create(
-                user=request.user, 
-                file_name=file_obj.name,
-                summary_data=results
-            )
-            
-            logger.info(f"Successfully processed file {file_obj.name} for user {request.user.username}")
-            return Response(results, status=201)
-        except ValueError as e:
-            logger.error(f"CSV processing error for user {request.user.id}: {str(e)}")
-            return Response({"error": f"Invalid CSV format: {str(e)}"}, status=400)
+            job = enqueue_upload(request.user, file_obj, digest)
+            if job.status == UploadJob.SUCCEEDED:
+                logger.info(f"Served file {file_obj.name} for user {request.user.username} from summary cache")
+                return Response(serialize_job(job, fields), status=201)
+
+            logger.info(f"Queued file {file_obj.name} for user {request.user.username} as job {job.id}")
+            return Response(serialize_job(job, fields), status=202)
         except Exception as e:
             logger.error(f"Upload error for user {request.user.id}: {str(e)}")
-            return Response({"error": "Failed to process file"}, status=500)
+            return Response({"error": "Failed to queue file"}, status=500)
 
 
-class HistoryView(APIView):
+class BatchUploadView(APIView):
+    """
+    Accepts many CSVs in one request, as repeated 'files' fields and/or zip
+    archives of CSVs. They are parsed in parallel and stored together; the
+    response lists each file's summary or error, in upload order.
+    """
+    parser_classes = [MultiPartParser, FormParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        hasher = HashingUploadHandler(request)
+        request.upload_handlers.insert(0, hasher)
+
+        uploads = request.FILES.getlist('files')
+        if not uploads:
+            return Response({"error": "No files provided"}, status=400)
+
+        try:
+            files = process_batch(request.user, uploads, hasher.digests.get('files', []))
+        except BatchError as e:
+            return Response({"error": str(e)}, status=400)
+        except Exception as e:
+            logger.error(f"Batch upload error for user {request.user.id}: {str(e)}")
+            return Response({"error": "Failed to process batch"}, status=500)
+
+        results = []
+        for batch_file in files:
+            entry = {"file_name": batch_file.name}
+            if batch_file.error:
+                entry.update({"status": "failed", "error": batch_file.error})
+            else:
+                entry.update({
+                    "status": "succeeded",
+                    "cached": batch_file.cached,
+                    "dataset_id": batch_file.dataset_id,
+                    "result": select_fields(batch_file.summary, fields),
+                })
+            results.append(entry)
+
+        succeeded = sum(1 for entry in results if entry['status'] == 'succeeded')
+        logger.info(f"Batch of {len(results)} file(s) from user {request.user.username}: {succeeded} succeeded")
+        return Response({
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results,
+        })
+
+
+class SummaryUploadView(APIView):
+    """
+    Stores a CSV the client summarised itself instead of the file: a 'summary'
+    file holding {"summary": ..., "rollups": [...]} as JSON, gzipped or not,
+    and optionally a 'columns' file packed by ingest.ColumnSample, which the
+    summary is checked against and which becomes the dataset's columnar copy.
+    """
+    parser_classes = [MultiPartParser, FormParser]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        file_name = request.data.get('file_name', '').strip()
+        summary_file = request.FILES.get('summary')
+        if not file_name or summary_file is None:
+            return Response({"error": "file_name and a summary file are required"}, status=400)
+
+        try:
+            dataset, summary, verified = accept_summary(
+                request.user, file_name[:255], summary_file, request.FILES.get('columns')
+            )
+        except SummaryUploadError as e:
+            return Response({"error": str(e)}, status=400)
+        except Exception as e:
+            logger.error(f"Summary upload error for user {request.user.id}: {str(e)}")
+            return Response({"error": "Failed to store summary"}, status=500)
+
+        return Response({
+            "file_name": file_name,
+            "status": "succeeded",
+            "verified": verified,
+            "dataset_id": dataset.pk,
+            "result": select_fields(summary, fields),
+        }, status=201)
+
+
+def serialize_job(job, fields=None):
+    """A job as the upload and job views return it; fields, from requested_fields(), trims its result."""
+    data = {
+        "job_id": str(job.id),
+        "status": job.status,
+        "progress": job.progress,
+        "file_name": job.file_name,
+        "status_url": f"/api/jobs/{job.id}/",
+        "created": job.created_at.isoformat(),
+        "updated": job.updated_at.isoformat(),
+    }
+    if job.status == UploadJob.SUCCEEDED:
+        data["result"] = select_fields(job.result, fields)
+    elif job.status == UploadJob.FAILED:
+        data["error"] = job.error
+    return data
+
+
+def serialize_chunked_upload(upload, fields=None):
+    indexes = received_indexes(upload)
+    return {
+        "upload_id": str(upload.id),
+        "file_name": upload.file_name,
+        "total_size": upload.total_size,
+        "chunk_size": upload.chunk_size,
+        "total_chunks": upload.total_chunks,
+        "received": received_ranges(indexes),
+        "missing": upload.total_chunks - len(indexes),
+        "job": serialize_job(upload.job, fields),
+    }
+
+
+class ChunkedUploadStartView(APIView):
+    """
+    Starts a resumable upload: POST {"file_name", "total_size", "chunk_size"?, "sha256"?}.
+    Chunks then go to PUT /api/uploads/<id>/chunks/<n>/ in any order, and
+    POST /api/uploads/<id>/complete/ closes the upload. ?fields= trims the
+    job's result, as on /api/upload/, on all three.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        file_name = request.data.get('file_name')
+        sha256 = (request.data.get('sha256') or '').lower()
+        try:
+            total_size = int(request.data.get('total_size'))
+            chunk_size = int(request.data.get('chunk_size') or 0)
+        except (TypeError, ValueError):
+            return Response({"error": "total_size and chunk_size must be integers"}, status=400)
+
+        if not file_name or total_size < 0 or chunk_size < 0:
+            return Response({"error": "file_name and a non-negative total_size are required"}, status=400)
+        if total_size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            return Response({"error": "File is too large"}, status=413)
+        if sha256 and len(sha256) != 64:
+            return Response({"error": "sha256 must be a hex SHA-256 digest"}, status=400)
+
+        upload = create_upload(request.user, file_name, total_size, chunk_size, sha256)
+        logger.info(f"Started chunked upload {upload.id} of {file_name} for user {request.user.username}")
+        return Response(serialize_chunked_upload(upload, fields), status=201)
+
+
+class ChunkedUploadDetailView(APIView):
+    """GET reports which chunk ranges arrived, so clients resume with only the rest; DELETE cancels."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        upload = ChunkedUpload.objects.filter(user=request.user, pk=upload_id).select_related('job').first()
+        if not upload:
+            return Response({"error": "Upload not found"}, status=404)
+        return Response(serialize_chunked_upload(upload, fields))
+
+    def delete(self, request, upload_id):
+        upload = ChunkedUpload.objects.filter(user=request.user, pk=upload_id).select_related('job').first()
+        if not upload:
+            return Response({"error": "Upload not found"}, status=404)
+        abort_upload(upload)
+        return Response(status=204)
+
+
+class ChunkedUploadChunkView(APIView):
+    """PUT the raw bytes of chunk n. Every chunk but the last must be exactly chunk_size bytes."""
+    permission_classes = [IsAuthenticated]
+
+    def put(self, request, upload_id, index):
+        upload = ChunkedUpload.objects.filter(user=request.user, pk=upload_id).select_related('job').first()
+        if not upload:
+            return Response({"error": "Upload not found"}, status=404)
+        if index >= upload.total_chunks:
+            return Response({"error": f"Chunk index must be below {upload.total_chunks}"}, status=400)
+        if upload.job.status in UploadJob.FINISHED:
+            return Response({"error": "Upload is already finished", "job": serialize_job(upload.job)}, status=409)
+
+        try:
+            # Read the raw body as a stream; request.data would buffer it in memory.
+            size = write_chunk(upload, index, request.stream or io.BytesIO())
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        except OSError as e:
+            logger.error(f"Chunk write failed for upload {upload.id}: {str(e)}")
+            return Response({"error": "Failed to store chunk"}, status=500)
+
+        return Response({"index": index, "size": size})
+
+
+class ChunkedUploadCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        upload = ChunkedUpload.objects.filter(user=request.user, pk=upload_id).select_related('job').first()
+        if not upload:
+            return Response({"error": "Upload not found"}, status=404)
+
+        missing = finalize_upload(upload)
+        if missing:
+            return Response({"error": f"{missing} chunk(s) still missing", **serialize_chunked_upload(upload)}, status=409)
+
+        upload.job.refresh_from_db()
+        return Response(serialize_job(upload.job, fields), status=201 if upload.job.status == UploadJob.SUCCEEDED else 202)
+
+
+class JobListView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        history = EquipmentDataset.objects.filter(user=request.user).order_by('-upload_date')
+        jobs = UploadJob.objects.filter(user=request.user).defer('result')[:20]
         data = [
             {
-                "id": h.id,
-                "name": h.file_name, 
-                "date": h.upload_date.isoformat()
-            } 
-            for h in history
+                "job_id": str(job.id),
+                "status": job.status,
+                "progress": job.progress,
+                "file_name": job.file_name,
+                "status_url": f"/api/jobs/{job.id}/",
+            }
+            for job in jobs
         ]
         return Response(data)
 
 
-class DownloadPDFView(APIView):
+class JobDetailView(APIView):
+    """
+    Status of one upload job, at once; /api/async/jobs/<id>/ long-polls it.
+    ?fields= trims the result, as on upload.
+    """
     permission_classes = [IsAuthenticated]
 
+    def get(self, request, job_id):
+        job = UploadJob.objects.filter(user=request.user, pk=job_id).first()
+        if not job:
+            return Response({"error": "Job not found"}, status=404)
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+        return Response(serialize_job(job, fields))
+
+
+class CacheStatsView(APIView):
+    """Cache effectiveness for upload summaries, history listings and reports, as seen by this process."""
+    permission_classes = [IsAdminUser]
+
     def get(self, request):
-        latest = EquipmentDataset.objects.filter(user=request.user).order_by('-upload_date').first()
+        return Response({
+            "summary": summary_cache.stats(),
+            "history": history.stats(),
+            "reports": reports.stats(),
+        })
+
+
+class MetricsView(APIView):
+    """
+    This process's request, span, query and parse histograms, cache counters
+    and event stream figures, in the Prometheus text format.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        caches = {
+            "summary": summary_cache.stats(), "history": history.stats(), "reports": reports.stats(),
+            "auth": authentication.stats(),
+        }
+        broker = events.broker.stats()
+        extra = [
+            ('vista_cache_hits_total', 'counter', "Cache hits since start.",
+             [({"cache": name}, figures['hits']) for name, figures in caches.items()]),
+            ('vista_cache_misses_total', 'counter', "Cache misses since start; report misses are renders.",
+             [({"cache": name}, figures.get('misses', figures.get('renders'))) for name, figures in caches.items()]),
+            ('vista_event_subscribers', 'gauge', "Open event streams.", [({}, broker['subscribers'])]),
+            ('vista_events_published_total', 'counter', "Events published since start.", [({}, broker['published'])]),
+        ]
+        return HttpResponse(metrics.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class HistoryView(APIView):
+    """
+    Upload history for the current user, served from a per-user cache that
+    uploads and deletes invalidate. Conditional GETs that still match get a
+    304 without touching the datasets table. ?fields= trims each entry.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            fields = requested_fields(request)
+        except FieldsError as e:
+            return Response({"error": str(e)}, status=400)
+
+        listing = history.get_listing(request.user.id)
+        if history.is_not_modified(request, listing):
+            response = Response(status=304)
+        else:
+            response = Response([select_fields(entry, fields) for entry in listing['data']])
+
+        response['ETag'] = listing['etag']
+        response['Last-Modified'] = listing['last_modified']
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class SyncView(APIView):
+    """
+    Changes to the user's history after a cursor, for clients keeping a local
+    copy: ?cursor=<n>, or the ETag of the last sync in If-None-Match. Without
+    either, or with one too old to resume, the answer is a full snapshot
+    marked reset. 304 when nothing changed.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        value = request.query_params.get('cursor')
+        if value is None:
+            value = request.META.get('HTTP_IF_NONE_MATCH', '').strip().removeprefix('W/').strip('"') or None
+        try:
+            cursor = sync.parse_cursor(value)
+        except sync.SyncError as e:
+            return Response({"error": str(e)}, status=400)
+
+        changes = sync.changes_since(request.user.id, cursor)
+        if changes is None:
+            response = Response(status=304)
+            response['ETag'] = f'"{cursor}"'
+        else:
+            response = Response(changes)
+            response['ETag'] = f'"{changes["cursor"]}"'
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class DatasetDetailView(APIView):
+    """Summary of one stored dataset, without its preview rows."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset_id):
+        dataset = EquipmentDataset.objects.filter(user=request.user, pk=dataset_id).first()
+        if not dataset:
+            return Response({"error": "Dataset not found"}, status=404)
+
+        data = dataset.to_summary(include_preview=False)
+        data.update({
+            "id": dataset.id,
+            "file_name": dataset.file_name,
+            "upload_date": dataset.upload_date,
+            "preview_url": f"/api/datasets/{dataset.id}/preview/",
+            "columns_url": f"/api/datasets/{dataset.id}/columns/" if dataset.column_key else None,
+        })
+        return Response(data)
+
+    def delete(self, request, dataset_id):
+        deleted, _ = EquipmentDataset.objects.filter(user=request.user, pk=dataset_id).delete()
+        if not deleted:
+            return Response({"error": "Dataset not found"}, status=404)
+        return Response(status=204)
+
+
+class DatasetPreviewView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset_id):
+        rows = (
+            DatasetPreview.objects.filter(dataset_id=dataset_id, dataset__user=request.user)
+            .values_list('rows', flat=True).first()
+        )
+        if rows is None:
+            return Response({"error": "Dataset not found"}, status=404)
+        return Response({"raw_data": rows})
+
+
+class DatasetColumnsView(APIView):
+    """
+    The dataset's columnar copy: its columns, rows and size, and the user's
+    storage against their quota. describe=<columns> adds exact statistics
+    per reading, optionally by=<category column>, with percentiles; they are
+    computed from the memory-mapped columns, not a reparse of the CSV.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset_id):
+        key = (
+            EquipmentDataset.objects.filter(user=request.user, pk=dataset_id)
+            .values_list('column_key', flat=True).first()
+        )
+        if key is None:
+            return Response({"error": "Dataset not found"}, status=404)
+        store = columnar.open_store(key)
+        if store is None:
+            return Response({"error": "No columnar copy is kept for this dataset"}, status=404)
+
+        data = {
+            "dataset_id": dataset_id,
+            "rows": store.rows,
+            "bytes": store.manifest['bytes'],
+            "skipped": store.manifest['skipped'],
+            "columns": [
+                {"name": name, "kind": column['kind'], "dtype": columnar.DTYPES[column['kind']].name}
+                for name, column in store.columns.items()
+            ],
+            "storage": columnar.usage(request.user.pk),
+        }
+
+        params = request.query_params
+        if params.get('describe'):
+            metrics = [name for name in params['describe'].split(',') if name]
+            by = params.get('by') or None
+            unknown = [name for name in metrics if store.columns.get(name, {}).get('kind') != columnar.FLOAT]
+            if unknown:
+                return Response({"error": f"Not numeric columns of this dataset: {', '.join(unknown)}"}, status=400)
+            if by is not None and store.columns.get(by, {}).get('kind') != columnar.CATEGORY:
+                return Response({"error": f"Not a category column of this dataset: {by}"}, status=400)
+            try:
+                percentiles = [float(p) for p in params.get('percentiles', '50,95').split(',') if p]
+                if len(percentiles) > 10 or any(not 0 <= p <= 100 for p in percentiles):
+                    raise ValueError("Percentiles must be at most 10 values between 0 and 100")
+            except ValueError as e:
+                return Response({"error": str(e)}, status=400)
+            data["describe"] = columnar.describe(store, metrics, by, percentiles)
+        return Response(data)
+
+
+class DatasetRowsView(APIView):
+    """
+    Raw rows of a dataset, paged from its columnar copy.
+    Query: fields (comma-separated), sort=<column> or -<column>, where
+    (repeatable, e.g. Pressure>120 or Type=Pump|Valve), limit, and the cursor
+    returned by the previous page. matched is the number of matching rows
+    when finding the page counted them, else null.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset_id):
+        key = (
+            EquipmentDataset.objects.filter(user=request.user, pk=dataset_id)
+            .values_list('column_key', flat=True).first()
+        )
+        if key is None:
+            return Response({"error": "Dataset not found"}, status=404)
+        store = columnar.open_store(key)
+        if store is None:
+            return Response({"error": "No columnar copy is kept for this dataset"}, status=404)
+        if store.manifest['skipped']:
+            return Response({"error": store.manifest['skipped']}, status=404)
+
+        params = request.query_params
+        try:
+            limit = int(params.get('limit', rowquery.DEFAULT_LIMIT))
+            query = rowquery.RowQuery(
+                store,
+                fields=[name for name in params.get('fields', '').split(',') if name],
+                sort=params.get('sort') or None,
+                where=params.getlist('where'),
+                limit=limit,
+            )
+            position = query.position(params['cursor']) if params.get('cursor') else 0
+            rows, next_position, matched = query.page(position)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        next_cursor = query.cursor(next_position) if next_position is not None else None
+        next_url = None
+        if next_cursor:
+            next_params = params.copy()
+            next_params['cursor'] = next_cursor
+            next_url = f"{request.path}?{next_params.urlencode()}"
+        return Response({
+            "dataset_id": dataset_id,
+            "fields": query.fields,
+            "total_rows": store.rows,
+            "matched": matched,
+            "rows": query.fetch(rows),
+            "next_cursor": next_cursor,
+            "next": next_url,
+        })
+
+
+def _parse_instant(value):
+    """An ISO date or datetime from a query string, as an aware datetime (UTC when naive)."""
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        moment = datetime(day.year, day.month, day.day)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
+class DatasetRollupView(APIView):
+    """
+    Windowed aggregates of one dataset per equipment Type or name.
+    Query: scope=type|equipment, key (repeatable), start/end (buckets starting
+    in [start, end)), granularity=hour|day|week|all, metrics, percentiles.
+    Stored buckets are merged server-side, so only the requested window and
+    granularity is sent. Granularity never goes finer than what was stored.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset_id):
+        if not EquipmentDataset.objects.filter(user=request.user, pk=dataset_id).exists():
+            return Response({"error": "Dataset not found"}, status=404)
+
+        params = request.query_params
+        scope = params.get('scope', DatasetRollup.SCOPE_TYPE)
+        granularity = params.get('granularity', 'all')
+        metrics = [metric for metric in params.get('metrics', '').split(',') if metric] or list(rollups.METRICS)
+        if scope not in dict(DatasetRollup.SCOPE_CHOICES):
+            return Response({"error": f"Unknown scope: {scope}"}, status=400)
+        if granularity not in rollups.GRANULARITIES:
+            return Response({"error": f"Unknown granularity: {granularity}"}, status=400)
+        unknown = [metric for metric in metrics if metric not in rollups.METRICS]
+        if unknown:
+            return Response({"error": f"Unknown metrics: {', '.join(unknown)}"}, status=400)
+        try:
+            percentiles = [float(p) for p in params.get('percentiles', '50,95').split(',') if p]
+            if len(percentiles) > 10 or any(not 0 <= p <= 100 for p in percentiles):
+                raise ValueError("Percentiles must be at most 10 values between 0 and 100")
+            start = _parse_instant(params['start']) if params.get('start') else None
+            end = _parse_instant(params['end']) if params.get('end') else None
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        stored = DatasetRollup.objects.filter(dataset_id=dataset_id, scope=scope)
+        keys = params.getlist('key')
+        if keys:
+            stored = stored.filter(key__in=keys)
+        if start:
+            stored = stored.filter(bucket_start__gte=start)
+        if end:
+            stored = stored.filter(bucket_start__lt=end)
+        fields = ['scope', 'key', 'bucket_start', 'bucket_seconds', 'count', 'stats']
+        if percentiles:
+            fields.append('sample')
+        rows = list(stored.order_by('key', 'bucket_start').values(*fields))
+
+        stored_seconds = max((row['bucket_seconds'] or 0 for row in rows), default=0) or None
+        seconds = rollups.GRANULARITIES[granularity]
+        if seconds is not None and stored_seconds and seconds < stored_seconds:
+            seconds = stored_seconds
+        if not percentiles:
+            for row in rows:
+                row['sample'] = []
+
+        results = [
+            {
+                "key": key,
+                "bucket_start": bucket_start,
+                "count": merged['count'],
+                "metrics": rollups.describe(merged, metrics, percentiles),
+            }
+            for (_, key, bucket_start), merged in rollups.merge_stored(rows, seconds).items()
+        ]
+        return Response({
+            "dataset_id": dataset_id,
+            "scope": scope,
+            "granularity": granularity,
+            "bucket_seconds": seconds if stored_seconds else None,
+            "stored_bucket_seconds": stored_seconds,
+            "results": results,
+        })
+
+
+class StatsView(APIView):
+    """
+    Exact statistics across the user's datasets, merged from stored sums and counts.
+    Without filters the whole history is served from running totals. Filters:
+    last=N (newest N), datasets=1,2,3, since/until (upload date). breakdown=1
+    adds per-dataset figures for comparison; distribution=1 the combined Type counts.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            last = int(params['last']) if params.get('last') else None
+            ids = [int(pk) for pk in params['datasets'].split(',') if pk] if params.get('datasets') else None
+            since = _parse_instant(params['since']) if params.get('since') else None
+            until = _parse_instant(params['until']) if params.get('until') else None
+            if last is not None and last < 1:
+                raise ValueError("last must be a positive integer")
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+
+        filtered = any(value is not None for value in (last, ids, since, until))
+        datasets = aggregates.select(request.user.id, last=last, ids=ids, since=since, until=until)
+        if ids is not None:
+            missing = sorted(set(ids) - set(datasets.values_list('pk', flat=True)))
+            if missing:
+                return Response({"error": f"Datasets not found: {', '.join(map(str, missing))}"}, status=404)
+
+        data = aggregates.selection_totals(datasets) if filtered else aggregates.user_totals(request.user.id)
+        data["scope"] = "selection" if filtered else "all"
+        if params.get('breakdown') in ('1', 'true'):
+            data["datasets"] = aggregates.breakdown(datasets)
+        if params.get('distribution') in ('1', 'true'):
+            data["distribution"] = aggregates.distribution(datasets)
+        return Response(data)
+
+
+class DownloadPDFView(APIView):
+    """
+    PDF report for one dataset, or for the latest one without an id.
+    Drawn on first request and then served from the report cache.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, dataset_id=None):
+        datasets = EquipmentDataset.objects.filter(user=request.user).only('id', 'file_name')
+        dataset = datasets.filter(pk=dataset_id).first() if dataset_id else datasets.order_by('-upload_date').first()
         
-        if not latest:
+        if not dataset:
             return Response({"error": "No data found"}, status=404)
 
         try:
-            response = HttpResponse(content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="Report_{latest.file_name}.pdf"'
-
-            p = canvas.Canvas(response, pagesize=letter)
-            p.setFont("Helvetica-Bold", 16)
-            p.drawString(100, 750, "V.I.S.T.A. Analytics Report")
-            
-            p.setFont("Helvetica", 10)
-            p.drawString(100, 735, f"User: {request.user.username}")
-            p.drawString(100, 720, f"Source: {latest.file_name}")
-            p.drawString(100, 705, f"Generated: {latest.upload_date.strftime('%Y-%m-%d %H:%M')}")
-            
-            p.line(100, 690, 500, 690)
-            
-            summary = latest.summary_data
-            p.setFont("Helvetica", 12)
-            p.drawString(100, 660, f"Total Equipment: {summary.get('total_count', 'N/A')}")
-            p.drawString(100, 640, f"Avg Pressure: {summary.get('averages', {}).get('avg_pressure', 'N/A')} PSI")
-            p.drawString(100, 620, f"Avg Temp: {summary.get('averages', {}).get('avg_temp', 'N/A')} °C")
-            
-            p.showPage()
-            p.save()
-            return response
+            path = reports.get_report(dataset.pk)
         except Exception as e:
             logger.error(f"PDF generation error for user {request.user.id}: {str(e)}")
-            return Response({"error": "Failed to generate PDF"}, status=500)
\ No newline at end of file
+            return Response({"error": "Failed to generate PDF"}, status=500)
+
+        return reports.report_response(
+            request, path, f"Report_{dataset.file_name}.pdf", reports.report_etag(dataset.pk)
+        )
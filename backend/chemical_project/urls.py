@@ -1,11 +1,42 @@
 from django.contrib import admin
 from django.urls import path
-from api.views import UploadView, HistoryView, DownloadPDFView, LoginView
+from api.async_views import (
+    AsyncDownloadPDFView, AsyncEventsView, AsyncHistoryView, AsyncJobDetailView, AsyncUploadView,
+)
+from api.views import (
+    UploadView, BatchUploadView, SummaryUploadView, HistoryView, SyncView, DatasetDetailView, DatasetPreviewView, DatasetColumnsView, DatasetRowsView, DatasetRollupView, DownloadPDFView, StatsView, LoginView, LogoutView, JobListView, JobDetailView, CacheStatsView, MetricsView,
+    ChunkedUploadStartView, ChunkedUploadDetailView, ChunkedUploadChunkView, ChunkedUploadCompleteView,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/login/', LoginView.as_view(), name='login'),
+    path('api/logout/', LogoutView.as_view(), name='logout'),
     path('api/upload/', UploadView.as_view(), name='upload'),
+    path('api/upload/batch/', BatchUploadView.as_view(), name='upload_batch'),
+    path('api/upload/summary/', SummaryUploadView.as_view(), name='upload_summary'),
+    path('api/uploads/', ChunkedUploadStartView.as_view(), name='chunked_upload_start'),
+    path('api/uploads/<uuid:upload_id>/', ChunkedUploadDetailView.as_view(), name='chunked_upload'),
+    path('api/uploads/<uuid:upload_id>/chunks/<int:index>/', ChunkedUploadChunkView.as_view(), name='chunked_upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/complete/', ChunkedUploadCompleteView.as_view(), name='chunked_upload_complete'),
+    path('api/jobs/', JobListView.as_view(), name='jobs'),
+    path('api/jobs/<uuid:job_id>/', JobDetailView.as_view(), name='job_detail'),
+    path('api/cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
     path('api/history/', HistoryView.as_view(), name='history'),
+    path('api/sync/', SyncView.as_view(), name='sync'),
+    path('api/datasets/<int:dataset_id>/', DatasetDetailView.as_view(), name='dataset_detail'),
+    path('api/datasets/<int:dataset_id>/preview/', DatasetPreviewView.as_view(), name='dataset_preview'),
+    path('api/datasets/<int:dataset_id>/columns/', DatasetColumnsView.as_view(), name='dataset_columns'),
+    path('api/datasets/<int:dataset_id>/rows/', DatasetRowsView.as_view(), name='dataset_rows'),
+    path('api/datasets/<int:dataset_id>/rollups/', DatasetRollupView.as_view(), name='dataset_rollups'),
+    path('api/stats/', StatsView.as_view(), name='stats'),
     path('api/download-pdf/', DownloadPDFView.as_view(), name='download_pdf'),
+    path('api/download-pdf/<int:dataset_id>/', DownloadPDFView.as_view(), name='download_dataset_pdf'),
+    path('api/async/upload/', AsyncUploadView.as_view(), name='async_upload'),
+    path('api/async/jobs/<uuid:job_id>/', AsyncJobDetailView.as_view(), name='async_job_detail'),
+    path('api/async/history/', AsyncHistoryView.as_view(), name='async_history'),
+    path('api/async/events/', AsyncEventsView.as_view(), name='async_events'),
+    path('api/async/download-pdf/', AsyncDownloadPDFView.as_view(), name='async_download_pdf'),
+    path('api/async/download-pdf/<int:dataset_id>/', AsyncDownloadPDFView.as_view(), name='async_download_dataset_pdf'),
 ]
\ No newline at end of file
@@ -0,0 +1,675 @@
+import gzip
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal
+from requests.adapters import HTTPAdapter
+
+from local_cache import LocalCache
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+API_BASE = 'http://127.0.0.1:8000/api'
+CHUNK_SIZE = 8 * 1024 * 1024
+# Seconds the server may hold a job status request open (capped by JOB_LONG_POLL_SECONDS).
+JOB_WAIT = 20
+# Local pre-aggregation parses CSVs with the server's own module, backend/api/ingest.py.
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'backend')
+# Columns collected in memory and sent along with a local summary, so the
+# server can check it; larger files send the summary alone.
+LOCAL_COLUMNS_MAX_BYTES = 128 * 1024 * 1024
+# Answers come as MessagePack when msgpack is installed here, JSON otherwise;
+# requests asks for them compressed on its own. DRF goes by how specific an
+# Accept entry is, not by q, so JSON stays the fallback as application/*.
+MSGPACK = 'application/msgpack'
+ACCEPT = f"{MSGPACK}, application/*;q=0.5" if msgpack is not None else 'application/json'
+# The parts of an upload's summary the dashboard shows; the server leaves out the rest (?fields=).
+RESULT_FIELDS = 'total_count,averages'
+# The failure message of every call that cannot reach the server.
+OFFLINE = "Backend server is offline"
+# Seconds without a byte, heartbeats included, after which the event stream counts as dead.
+EVENTS_TIMEOUT = 45
+# Longest wait between attempts to reopen a dropped event stream.
+EVENTS_MAX_BACKOFF = 60
+
+
+class ApiError(Exception):
+    pass
+
+
+class UploadError(ApiError):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+def file_sha256(path, block_size=CHUNK_SIZE, cancelled=None):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled()
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_session(token=None, pool_size=4):
+    """A keep-alive session whose connection pool serves pool_size threads at once."""
+    session = requests.Session()
+    session.headers['Accept'] = ACCEPT
+    if token:
+        session.headers['Authorization'] = f"Token {token}"
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def decode(response):
+    """A response's body, from MessagePack or JSON as its Content-Type says."""
+    if msgpack is not None and response.headers.get('Content-Type', '').startswith(MSGPACK):
+        try:
+            return msgpack.unpackb(response.content)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise ValueError(f"Invalid MessagePack answer: {e}")
+    return response.json()
+
+
+def error_message(response):
+    try:
+        return decode(response).get('error', f"Server returned {response.status_code}")
+    except (ValueError, AttributeError):
+        return f"Server returned {response.status_code}"
+
+
+class ChunkedUploader:
+    """
+    Sends files through the server's resumable upload API (/api/uploads/).
+    Chunks go out in parallel and each is retried with backoff. If a transfer
+    still fails, calling upload() again with the same file resumes it and
+    sends only the chunks the server does not have. upload_batch() sends
+    several files in one request instead, and upload_summary() summarises a
+    file here and sends only the result. result_fields, as for ?fields=,
+    trims the summaries the server answers with.
+    """
+
+    def __init__(self, token, base_url=API_BASE, workers=4, retries=5, chunk_size=CHUNK_SIZE, session=None,
+                 columns_max_bytes=LOCAL_COLUMNS_MAX_BYTES, result_fields=None):
+        self.base_url = base_url
+        self.params = {"fields": result_fields} if result_fields else {}
+        self.workers = workers
+        self.retries = retries
+        self.chunk_size = chunk_size
+        self.columns_max_bytes = columns_max_bytes
+        self.session = session or make_session(token, pool_size=workers)
+        # (path, size, mtime) -> upload id, for resuming interrupted transfers
+        self._pending = {}
+
+    def upload(self, path, progress=None, cancelled=None):
+        """
+        Upload a file and return the server's job for it.
+        progress, if given, is called with (chunks_sent, total_chunks).
+        cancelled, a threading.Event, stops the transfer between chunks by
+        raising Cancelled; uploading the same file again later resumes it.
+        """
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+
+        status = self._resume(key)
+        if status is None:
+            status = decode(self._request('post', f"{self.base_url}/uploads/", json={
+                "file_name": os.path.basename(path),
+                "total_size": stat.st_size,
+                "chunk_size": self.chunk_size,
+                "sha256": file_sha256(path, cancelled=cancelled),
+            }, params=self.params))
+            self._pending[key] = status['upload_id']
+
+        # The server already knew this content; nothing to send.
+        if status['job']['status'] in ('succeeded', 'failed'):
+            self._pending.pop(key, None)
+            return status['job']
+
+        self._send_missing(path, status, progress, cancelled)
+
+        response = self._request('post', f"{self.base_url}/uploads/{status['upload_id']}/complete/", params=self.params)
+        self._pending.pop(key, None)
+        return decode(response)
+
+    def upload_batch(self, paths, progress=None, cancelled=None):
+        """
+        Send several CSVs in one request to /api/upload/batch/, where they are
+        parsed in parallel. Returns the server's per-file results.
+        The files are streamed from disk; progress and cancelled work as in upload(),
+        with progress counted in bytes.
+        """
+        body = MultipartBody('files', paths, progress, cancelled)
+        try:
+            response = self.session.post(
+                f"{self.base_url}/upload/batch/",
+                params=self.params,
+                data=body,
+                headers={'Content-Type': body.content_type},
+                timeout=(5, 600),
+            )
+        except requests.exceptions.RequestException as e:
+            raise UploadError(str(e))
+        finally:
+            body.close()
+        if response.status_code >= 400:
+            raise UploadError(error_message(response))
+        return decode(response)
+
+    def upload_summary(self, path, progress=None, cancelled=None):
+        """
+        Parse and summarise a CSV here, as the server would, and upload the
+        summary and rollups to /api/upload/summary/ instead of the file. The
+        file's known columns go along, compressed, when they fit in
+        columns_max_bytes; the server then checks the summary against them.
+        progress is called with (bytes_parsed, file_size). Returns the
+        server's result, shaped like a finished job.
+        """
+        # Imported here: only this mode needs pandas and the backend's parsing module.
+        if BACKEND_DIR not in sys.path:
+            sys.path.append(BACKEND_DIR)
+        from api import ingest
+        from api.rollups import RollupAggregate
+
+        size = max(os.path.getsize(path), 1)
+
+        def report(bytes_read):
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled()
+            if progress:
+                progress(bytes_read, size)
+
+        rollup = RollupAggregate()
+        columns = ingest.ColumnSample(self.columns_max_bytes)
+        with open(path, 'rb') as handle:
+            summary = ingest.summarize(handle, progress=report, consumers=[rollup, columns])
+
+        document = json.dumps({"summary": summary, "rollups": rollup.rows()}).encode()
+        files = {'summary': ('summary.json.gz', gzip.compress(document), 'application/gzip')}
+        packed = columns.pack()
+        if packed is not None:
+            files['columns'] = ('columns.zip', packed, 'application/zip')
+        response = self._request(
+            'post', f"{self.base_url}/upload/summary/",
+            data={"file_name": os.path.basename(path)}, files=files, cancelled=cancelled, params=self.params,
+        )
+        return decode(response)
+
+    def _resume(self, key):
+        upload_id = self._pending.get(key)
+        if not upload_id:
+            return None
+        try:
+            return decode(self._request('get', f"{self.base_url}/uploads/{upload_id}/", params=self.params))
+        except UploadError:
+            # The server no longer knows the upload; start over.
+            self._pending.pop(key, None)
+            return None
+
+    def _send_missing(self, path, status, progress, cancelled):
+        received = {i for first, last in status['received'] for i in range(first, last + 1)}
+        missing = [i for i in range(status['total_chunks']) if i not in received]
+        sent = len(received)
+
+        def send(index):
+            if cancelled is not None and cancelled.is_set():
+                raise Cancelled()
+            with open(path, 'rb') as f:
+                f.seek(index * status['chunk_size'])
+                data = f.read(status['chunk_size'])
+            self._request(
+                'put',
+                f"{self.base_url}/uploads/{status['upload_id']}/chunks/{index}/",
+                data=data,
+                headers={'Content-Type': 'application/octet-stream'},
+                cancelled=cancelled,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            # Progress is reported from the calling thread, never from the pool.
+            for future in as_completed([pool.submit(send, index) for index in missing]):
+                future.result()
+                sent += 1
+                if progress:
+                    progress(sent, status['total_chunks'])
+
+    def _request(self, method, url, cancelled=None, **kwargs):
+        """Send a request, retrying connection failures and 5xx answers with exponential backoff."""
+        cancelled = cancelled or threading.Event()
+        delay = 0.5
+        for attempt in range(self.retries):
+            if cancelled.is_set():
+                raise Cancelled()
+            try:
+                response = self.session.request(method, url, timeout=(5, 60), **kwargs)
+                if response.status_code < 400:
+                    return response
+                if response.status_code < 500:
+                    raise UploadError(error_message(response))
+            except requests.exceptions.RequestException:
+                if attempt == self.retries - 1:
+                    raise
+            cancelled.wait(delay)
+            delay *= 2
+        raise UploadError(f"Server kept failing on {url}")
+
+
+class MultipartBody:
+    """
+    A multipart/form-data body read from disk as it is sent, so requests streams
+    it with a Content-Length instead of building multi-GB bodies in memory.
+    """
+
+    def __init__(self, field, paths, progress=None, cancelled=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self._parts = []
+        for path in paths:
+            name = os.path.basename(path).replace('"', '%22')
+            self._parts.append((
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+                'Content-Type: text/csv\r\n\r\n'
+            ).encode())
+            self._parts.append(path)
+            self._parts.append(b'\r\n')
+        self._parts.append(f'--{boundary}--\r\n'.encode())
+        # requests reads the Content-Length from here.
+        self.len = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self._parts)
+        self._progress = progress
+        self._cancelled = cancelled
+        self._sent = 0
+        self._handle = None
+
+    def read(self, size=-1):
+        if self._cancelled is not None and self._cancelled.is_set():
+            raise Cancelled()
+        size = size if size and size > 0 else CHUNK_SIZE
+        while self._parts or self._handle:
+            if self._handle is None:
+                part = self._parts.pop(0)
+                if isinstance(part, bytes):
+                    return self._count(part)
+                self._handle = open(part, 'rb')
+            data = self._handle.read(size)
+            if data:
+                return self._count(data)
+            self._handle.close()
+            self._handle = None
+        return b''
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def _count(self, data):
+        self._sent += len(data)
+        if self._progress:
+            self._progress(self._sent, self.len)
+        return data
+
+
+def read_events(response):
+    """(id, name, data) for each event of a text/event-stream response; comments are skipped."""
+    event_id, name, data = None, 'message', []
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if line:
+            field, _, value = line.partition(':')
+            value = value[1:] if value.startswith(' ') else value
+            if field == 'id':
+                event_id = value
+            elif field == 'event':
+                name = value
+            elif field == 'data':
+                data.append(value)
+        elif data:
+            yield event_id, name, json.loads('\n'.join(data))
+            name, data = 'message', []
+
+
+class EventFeed:
+    """
+    The latest pushed state of each upload job, shared between the thread
+    reading the event stream and the calls waiting on jobs. `connected` is
+    true while the stream is open; only then are job events known to arrive.
+    """
+
+    def __init__(self, keep=256):
+        self.connected = False
+        self._keep = keep
+        self._jobs = OrderedDict()  # job id -> latest job.progress or job.finished data
+        self._changed = threading.Condition()
+
+    def set_connected(self, connected):
+        with self._changed:
+            self.connected = connected
+            self._changed.notify_all()
+
+    def job_event(self, data):
+        with self._changed:
+            self._jobs[data['job_id']] = data
+            self._jobs.move_to_end(data['job_id'])
+            while len(self._jobs) > self._keep:
+                self._jobs.popitem(last=False)
+            self._changed.notify_all()
+
+    def wait_job(self, job_id, progress, timeout, cancelled):
+        """
+        The job's pushed state once it has finished or moved past `progress`;
+        None after `timeout` seconds, on cancel or when the stream drops.
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self.connected and not cancelled.is_set():
+                state = self._jobs.get(job_id)
+                if state is not None and ('status' in state or state['progress'] > progress):
+                    return state
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # In short steps, so a cancel is noticed without a notify.
+                self._changed.wait(min(remaining, 0.5))
+        return None
+
+
+class CallSignals(QObject):
+    """A Call's signals; a QRunnable is not a QObject and cannot carry its own."""
+    progress = pyqtSignal(int)
+    event = pyqtSignal(str, object)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    done = pyqtSignal()
+
+
+class Call(QRunnable):
+    """
+    One unit of network work on ApiClient's thread pool. Results come back
+    through `signals`, which Qt delivers on the GUI thread: exactly one of
+    finished (with the result), failed (with a message) or cancelled, then
+    done. progress carries a percentage.
+    """
+
+    def __init__(self, work, *args):
+        super().__init__()
+        # ApiClient holds the only reference until `done`; Qt must not delete it first.
+        self.setAutoDelete(False)
+        self.signals = CallSignals()
+        self.cancel_event = threading.Event()
+        self._work = work
+        self._args = args
+        self._percent = -1
+        self._settled = False
+        self._settle_lock = threading.Lock()
+
+    def cancel(self):
+        """
+        Settle the call as cancelled now. The work stops at its next check,
+        e.g. between upload chunks; whatever it returns after that is dropped.
+        """
+        self.cancel_event.set()
+        self._settle(self.signals.cancelled)
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def report(self, done, total):
+        """Progress callback for the work; emits only when the percentage changes."""
+        percent = done * 100 // max(total, 1)
+        if percent != self._percent and not self._settled:
+            self._percent = percent
+            self.signals.progress.emit(percent)
+
+    def run(self):
+        try:
+            if self.is_cancelled():
+                return
+            self._settle(self.signals.finished, self._work(self, *self._args))
+        except Cancelled:
+            self._settle(self.signals.cancelled)
+        except requests.exceptions.ConnectionError:
+            self._settle(self.signals.failed, OFFLINE)
+        except Exception as e:
+            self._settle(self.signals.failed, str(e))
+        finally:
+            self.signals.done.emit()
+
+    def _settle(self, signal, *args):
+        with self._settle_lock:
+            if self._settled:
+                return
+            self._settled = True
+        signal.emit(*args)
+
+
+class ApiClient(QObject):
+    """
+    The desktop client's connection to the server. Every method returns a
+    started Call at once and does its requests on a small thread pool, so the
+    GUI thread never waits on the network. All calls share one keep-alive
+    session. After login, `cache` is the user's LocalCache, which sync()
+    keeps current, and `events` what subscribe() has heard about jobs.
+    """
+
+    def __init__(self, base_url=API_BASE, threads=4, upload_workers=4, parent=None):
+        super().__init__(parent)
+        self.base_url = base_url
+        self.pool = QThreadPool(self)
+        # One thread more for the event stream, which holds its own for as long as it is open.
+        self.pool.setMaxThreadCount(threads + 1)
+        self.session = make_session(pool_size=threads + upload_workers + 1)
+        self.session.hooks['response'].append(self._keep_rotated_token)
+        self.uploader = ChunkedUploader(None, base_url, workers=upload_workers, session=self.session,
+                                        result_fields=RESULT_FIELDS)
+        self._calls = set()
+        self._stream = None
+        self.cache = None
+        self.events = EventFeed()
+
+    def login(self, username, password):
+        """finished(user data); later calls are made as this user."""
+        return self._start(self._login, username, password)
+
+    def login_offline(self, username, password):
+        """
+        finished(user data from the last online login) if the password matches
+        it; the cache is then readable, and sync() works once the server is back.
+        """
+        return self._start(self._login_offline, username, password)
+
+    def sync(self):
+        """
+        Bring the cache up to date through /api/sync/; finished(history from
+        the cache), or finished(None) when nothing changed.
+        """
+        return self._start(self._sync)
+
+    def subscribe(self):
+        """
+        Listen to the server's event stream, /api/async/events/, until
+        cancelled, reopening it with backoff when it drops. Emits event(name,
+        data) for every event and event('open', None) each time the stream
+        (re)opens, when anything may have been missed. finished(None) if the
+        server has no event stream, e.g. when it runs under WSGI; polling then
+        goes on as before.
+        """
+        return self._start(self._subscribe)
+
+    def watch_job(self, job_id):
+        """
+        Follow an upload job; progress as it parses, finished(job) once done.
+        Pushed job events drive it while subscribed, long polls otherwise.
+        """
+        return self._start(self._watch_job, job_id)
+
+    def upload(self, path):
+        """Chunked, resumable upload; finished(job). A cancelled upload resumes on the next try."""
+        return self._start(lambda call: self.uploader.upload(path, call.report, call.cancel_event))
+
+    def upload_batch(self, paths):
+        """One streamed batch request; finished(per-file results)."""
+        return self._start(lambda call: self.uploader.upload_batch(paths, call.report, call.cancel_event))
+
+    def upload_summary(self, path):
+        """Summarise the file here and send only the result; finished(result, shaped like a job)."""
+        return self._start(lambda call: self.uploader.upload_summary(path, call.report, call.cancel_event))
+
+    def upload_summaries(self, paths):
+        """upload_summary for several files in turn; finished(per-file results, as upload_batch gives them)."""
+        return self._start(self._upload_summaries, paths)
+
+    def shutdown(self, timeout_ms=5000):
+        """Cancel whatever is running and wait briefly for the pool to wind down."""
+        for call in list(self._calls):
+            call.cancel()
+        stream = self._stream
+        sock = getattr(getattr(stream, 'raw', None) and stream.raw.connection, 'sock', None)
+        if sock is not None:
+            # Wakes the stream's blocked read, which closing from this thread would
+            # not; it would otherwise last until the next heartbeat.
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.pool.waitForDone(timeout_ms)
+
+    def _start(self, work, *args):
+        call = Call(work, *args)
+        self._calls.add(call)
+        call.signals.done.connect(lambda: self._calls.discard(call))
+        # Started once control is back in the event loop: a call that fails at
+        # once (server down) must not signal before the caller has connected.
+        QTimer.singleShot(0, lambda: self.pool.start(call))
+        return call
+
+    def _send(self, method, path, timeout=(5, 30), **kwargs):
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs)
+        if response.status_code >= 400:
+            raise ApiError(error_message(response))
+        return response
+
+    def _login(self, call, username, password):
+        user = decode(self._send('post', '/login/', json={"username": username, "password": password}))
+        self.session.headers['Authorization'] = f"Token {user['token']}"
+        self._open_cache(username).remember_login(user, password)
+        return user
+
+    def _login_offline(self, call, username, password):
+        if not os.path.exists(LocalCache.path_for(self.base_url, username)):
+            raise ApiError(f"{OFFLINE}; sign in online once to use it offline")
+        cache = LocalCache.for_user(self.base_url, username)
+        user = cache.check_login(password)
+        if user is None:
+            cache.close()
+            raise ApiError("Invalid username or password")
+        self._open_cache(username, cache)
+        self.session.headers['Authorization'] = f"Token {user['token']}"
+        return {**user, "offline": True}
+
+    def _keep_rotated_token(self, response, *args, **kwargs):
+        # The server replaces an ageing token on its next use and sends the new
+        # key along; the old one only lasts a minute more.
+        token = response.headers.get('X-Auth-Token')
+        if token:
+            self.session.headers['Authorization'] = f"Token {token}"
+            if self.cache is not None:
+                self.cache.remember_token(token)
+
+    def _open_cache(self, username, cache=None):
+        if self.cache is not None:
+            self.cache.close()
+        self.cache = cache or LocalCache.for_user(self.base_url, username)
+        return self.cache
+
+    def _sync(self, call):
+        cursor = self.cache.cursor()
+        response = self._send('get', '/sync/', params={} if cursor is None else {"cursor": cursor})
+        if response.status_code == 304:
+            return None
+        self.cache.apply(decode(response))
+        return self.cache.history()
+
+    def _subscribe(self, call):
+        last_event_id = None
+        delay = 1
+        while not call.is_cancelled():
+            headers = {'Accept': 'text/event-stream'}
+            if last_event_id:
+                headers['Last-Event-ID'] = last_event_id
+            try:
+                with self.session.get(f"{self.base_url}/async/events/", headers=headers, stream=True,
+                                      timeout=(5, EVENTS_TIMEOUT)) as response:
+                    if response.status_code in (404, 501):
+                        return None
+                    if response.status_code >= 400:
+                        raise ApiError(error_message(response))
+                    self._stream = response
+                    self.events.set_connected(True)
+                    call.signals.event.emit('open', None)
+                    delay = 1
+                    for event_id, name, data in read_events(response):
+                        last_event_id = event_id or last_event_id
+                        if name.startswith('job.'):
+                            self.events.job_event(data)
+                        call.signals.event.emit(name, data)
+            except requests.exceptions.RequestException:
+                pass
+            finally:
+                self._stream = None
+                self.events.set_connected(False)
+            call.cancel_event.wait(delay)
+            delay = min(delay * 2, EVENTS_MAX_BACKOFF)
+        raise Cancelled()
+
+    def _upload_summaries(self, call, paths):
+        results = []
+        for i, path in enumerate(paths):
+            def report(done, total):
+                call.report(i * total + done, len(paths) * total)
+            try:
+                results.append(self.uploader.upload_summary(path, report, call.cancel_event))
+            except (ApiError, ValueError) as e:
+                # A file that fails to parse or is refused; the rest still go.
+                results.append({"file_name": os.path.basename(path), "status": "failed", "error": str(e)})
+        return {"results": results}
+
+    def _watch_job(self, call, job_id):
+        progress = -1
+        while not call.is_cancelled():
+            pushed = self.events.connected
+            job = decode(self._send(
+                'get', f"/async/jobs/{job_id}/",
+                params={"wait": 0 if pushed else JOB_WAIT, "progress": progress, "fields": RESULT_FIELDS},
+                timeout=(5, JOB_WAIT + 30),
+            ))
+            if job.get('status') in ('succeeded', 'failed'):
+                return job
+            progress = job.get('progress', 0)
+            call.report(progress, 100)
+            if pushed:
+                # Events for jobs processed elsewhere never come; the job is read
+                # again after JOB_WAIT seconds without one.
+                state = self.events.wait_job(job_id, progress, JOB_WAIT, call.cancel_event)
+                while state is not None and 'status' not in state:
+                    progress = state['progress']
+                    call.report(progress, 100)
+                    state = self.events.wait_job(job_id, progress, JOB_WAIT, call.cancel_event)
+        raise Cancelled()
@@ -0,0 +1,204 @@
+"""
+Frame times of the dashboard's drawing, the way it used to be done (clear,
+re-plot, tight_layout, full draw; rebuild the history list) against
+rendering.py (artists changed in place, blitting, downsampling, keyed
+history widgets). Runs without a display:
+
+    QT_QPA_PLATFORM=offscreen python bench_rendering.py
+"""
+import argparse
+import os
+import statistics
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from PyQt5.QtCore import QEventLoop, QTimer, qInstallMessageHandler
+from PyQt5.QtWidgets import QApplication, QLabel, QVBoxLayout, QWidget
+
+from rendering import Renderer, WidgetList
+
+LABELS = ['Pressure', 'Temp', 'Flow']
+COLORS = ['#2563eb', '#10b981', '#f59e0b']
+
+
+def canvas_window():
+    figure, ax = plt.subplots(figsize=(6, 4))
+    canvas = FigureCanvas(figure)
+    window = QWidget()
+    QVBoxLayout(window).addWidget(canvas)
+    window.resize(1000, 600)
+    window.show()
+    QApplication.processEvents()
+    canvas.draw()
+    return window, canvas, ax
+
+
+def spin(ms):
+    loop = QEventLoop()
+    QTimer.singleShot(ms, loop.quit)
+    loop.exec_()
+
+
+def timed(frames, step):
+    timings = []
+    for i in range(frames):
+        started = time.perf_counter()
+        step(i)
+        QApplication.processEvents()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name, timings, note=''):
+    p50 = statistics.median(timings) * 1000
+    p95 = statistics.quantiles(timings, n=20)[18] * 1000 if len(timings) > 1 else p50
+    print(f"{name:<26} {p50:8.2f}ms {p95:8.2f}ms {max(timings) * 1000:8.2f}ms  {note}")
+
+
+def heights(i, rng):
+    return list(rng.uniform(50, 150, size=3) * (1 + (i % 50 == 49)))
+
+
+def bench_bars(frames, rng):
+    window, canvas, ax = canvas_window()
+
+    def legacy(i):
+        ax.clear()
+        ax.bar(LABELS, heights(i, rng), color=COLORS)
+        ax.set_title("Current Asset Telemetry")
+        canvas.figure.tight_layout()
+        canvas.draw()
+
+    report("bars, redraw everything", timed(frames, legacy))
+    window.close()
+
+    window, canvas, ax = canvas_window()
+    renderer = Renderer(canvas)
+    bars = renderer.bars(ax, LABELS, COLORS)
+    ax.set_title("Current Asset Telemetry")
+    renderer.update(bars, heights(0, rng))
+    renderer.flush()
+    spin(50)
+    renderer.full_draws = 0
+
+    def blitted(i):
+        renderer.update(bars, heights(i, rng))
+        renderer.flush()
+
+    report("bars, renderer", timed(frames, blitted), f"{renderer.full_draws} full draws")
+    window.close()
+
+
+def bench_burst(rng, seconds=1.0, every_ms=1):
+    """Updates far faster than frames for a while: how many frames they are merged into."""
+    window, canvas, ax = canvas_window()
+    renderer = Renderer(canvas)
+    bars = renderer.bars(ax, LABELS, COLORS)
+    renderer.update(bars, heights(0, rng))
+    renderer.flush()
+    spin(50)
+    renderer.frames = renderer.updates = 0
+
+    source = QTimer()
+    source.setInterval(every_ms)
+    source.timeout.connect(lambda: renderer.update(bars, heights(1, rng)))
+    started = time.perf_counter()
+    source.start()
+    spin(int(seconds * 1000))
+    source.stop()
+    elapsed = time.perf_counter() - started
+    print(f"burst: {renderer.updates} updates in {elapsed:.1f}s drawn as {renderer.frames} frames "
+          f"({renderer.frames / elapsed:.0f} fps)")
+    window.close()
+
+
+def bench_series(frames, points, rng):
+    x = np.arange(points, dtype=float)
+    y = np.cumsum(rng.normal(size=points))
+    window, canvas, ax = canvas_window()
+
+    def legacy(i):
+        ax.clear()
+        ax.plot(x[:points - frames + i], y[:points - frames + i], color=COLORS[0])
+        canvas.figure.tight_layout()
+        canvas.draw()
+
+    report(f"series {points:,}, redraw", timed(frames, legacy))
+    window.close()
+
+    window, canvas, ax = canvas_window()
+    renderer = Renderer(canvas)
+    line = renderer.line(ax, color=COLORS[0])
+    renderer.update(line, (x[:points - frames], y[:points - frames]))
+    renderer.flush()
+    spin(50)
+    renderer.full_draws = 0
+
+    def blitted(i):
+        # A rolling series: one more reading every frame.
+        renderer.update(line, (x[:points - frames + i], y[:points - frames + i]))
+        renderer.flush()
+
+    report(f"series {points:,}, renderer", timed(frames, blitted), f"{renderer.full_draws} full draws")
+    window.close()
+
+
+def bench_history(frames):
+    def item_widget(item):
+        label = QLabel(f"{item['name']}\n{item['date']}")
+        label.setStyleSheet("background-color: #1e293b; border-radius: 8px; padding: 10px;")
+        return label
+
+    def items(i):
+        # Newest first; one new upload per refresh.
+        return [{"id": n, "name": f"upload_{n}.csv", "date": f"2026-01-01T00:00:{n % 60:02d}"}
+                for n in range(i + 5, i, -1)]
+
+    panel = QWidget()
+    layout = QVBoxLayout(panel)
+    panel.show()
+
+    def rebuild(i):
+        for index in reversed(range(layout.count())):
+            widget = layout.itemAt(index).widget()
+            if widget:
+                widget.setParent(None)
+        for item in items(i):
+            layout.addWidget(item_widget(item))
+        layout.addStretch()
+
+    report("history, rebuild", timed(frames, rebuild))
+    panel.close()
+
+    panel = QWidget()
+    history = WidgetList(QVBoxLayout(panel), item_widget, placeholder=QLabel("No uploads yet"))
+    panel.show()
+    report("history, incremental", timed(frames, lambda i: history.update(items(i))))
+    panel.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time dashboard frames, old drawing path against rendering.py.")
+    parser.add_argument('--frames', type=int, default=200, help="Timed frames per case.")
+    parser.add_argument('--points', type=int, default=1_000_000, help="Length of the plotted series.")
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args()
+
+    # The offscreen platform warns about size hints for every window shown.
+    qInstallMessageHandler(lambda kind, context, message: None if 'propagateSizeHints' in message else print(message))
+    app = QApplication([])
+    rng = np.random.default_rng(options.seed)
+    print(f"{'case':<26} {'p50':>10} {'p95':>10} {'max':>10}")
+    bench_bars(options.frames, rng)
+    bench_series(min(options.frames, 50), options.points, rng)
+    bench_history(options.frames)
+    bench_burst(rng)
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+The desktop client's own copy of a user's upload history and dataset
+summaries, in SQLite, kept current through the server's delta sync
+(/api/sync/). The dashboard draws from it at startup before any request
+returns, and keeps working from it, read-only, while the backend is offline.
+
+One database per server and user under ~/.vista, readable by its owner only:
+it also holds the auth token and a salted PBKDF2 hash of the password, so the
+same user can sign in offline.
+"""
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.vista')
+# Bump when the tables change; an older cache is dropped and synced afresh.
+SCHEMA_VERSION = 1
+PASSWORD_ITERATIONS = 200_000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS datasets_recent ON datasets (date DESC, id DESC);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def _hash_password(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, PASSWORD_ITERATIONS).hex()
+
+
+class LocalCache:
+    """
+    History and summaries as the last sync left them. Safe to share between
+    the GUI thread, which reads, and ApiClient's pool, which applies syncs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        os.chmod(path, 0o600)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+            if self._get('schema') != str(SCHEMA_VERSION):
+                self._db.executescript("DROP TABLE datasets; DROP TABLE meta;" + SCHEMA)
+                self._set('schema', SCHEMA_VERSION)
+
+    @staticmethod
+    def path_for(base_url, username, directory=CACHE_DIR):
+        name = hashlib.sha256(f"{base_url}\n{username}".encode()).hexdigest()[:16]
+        return os.path.join(directory, f"{name}.sqlite3")
+
+    @classmethod
+    def for_user(cls, base_url, username, directory=CACHE_DIR):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        return cls(cls.path_for(base_url, username, directory))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def history(self, limit=None):
+        """Listing items, newest first, as /api/history/ gives them."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, name, date FROM datasets ORDER BY date DESC, id DESC LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [{"id": row[0], "name": row[1], "date": row[2]} for row in rows]
+
+    def summary(self, dataset_id):
+        """A dataset's summary, as the upload returned it; None if it is not cached."""
+        with self._lock:
+            row = self._db.execute("SELECT summary FROM datasets WHERE id = ?", (dataset_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cursor(self):
+        """The cursor of the last applied sync; None before the first."""
+        with self._lock:
+            value = self._get('cursor')
+        return int(value) if value is not None else None
+
+    def apply(self, changes):
+        """Apply one /api/sync/ answer, in a single transaction."""
+        rows = [
+            (item['id'], item['name'], item['date'], json.dumps(item['summary']))
+            for item in changes['datasets']
+        ]
+        with self._lock, self._db:
+            if changes['reset']:
+                self._db.execute("DELETE FROM datasets")
+            self._db.executemany("DELETE FROM datasets WHERE id = ?", [(pk,) for pk in changes['deleted']])
+            self._db.executemany("INSERT OR REPLACE INTO datasets (id, name, date, summary) VALUES (?, ?, ?, ?)", rows)
+            self._set('cursor', changes['cursor'])
+
+    def remember_login(self, user, password):
+        """Keep the login answer and a password hash, for check_login() while offline."""
+        salt = os.urandom(16)
+        with self._lock, self._db:
+            self._set('user', json.dumps(user))
+            self._set('password', f"{salt.hex()}${_hash_password(password, salt)}")
+
+    def remember_token(self, token):
+        """Swap the remembered login's token for its replacement, so an offline login resumes with the live one."""
+        with self._lock, self._db:
+            user = self._get('user')
+            if user is not None:
+                self._set('user', json.dumps({**json.loads(user), "token": token}))
+
+    def check_login(self, password):
+        """The remembered login answer if the password matches it, else None."""
+        with self._lock:
+            user, stored = self._get('user'), self._get('password')
+        if user is None or stored is None:
+            return None
+        salt, expected = stored.split('$')
+        if not hmac.compare_digest(_hash_password(password, bytes.fromhex(salt)), expected):
+            return None
+        return json.loads(user)
+
+    def _get(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
@@ -1,20 +1,26 @@
 import sys
-import requests
 import json
 import matplotlib.pyplot as plt
+from api_client import OFFLINE, ApiClient
+from rendering import Renderer, WidgetList
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QLabel, QFileDialog, 
-                             QFrame, QLineEdit, QDialog, QMessageBox, QScrollArea)
-from PyQt5.QtCore import Qt
+                             QFrame, QLineEdit, QDialog, QMessageBox, QScrollArea,
+                             QProgressBar, QCheckBox)
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QFont, QColor
 
+# Seconds between attempts to reach the server again while offline.
+RECONNECT_INTERVAL = 15
+
+
 class LoginDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, client, parent=None):
         super().__init__(parent)
         self.setWindowTitle("V.I.S.T.A. System Gateway")
         self.setFixedSize(900, 550)
-        self.api_url = 'http://127.0.0.1:8000/api/login/'
+        self.client = client
         self.user_data = None
         
         qr = self.frameGeometry()
@@ -70,15 +76,15 @@ class LoginDialog(QDialog):
         self.status_lbl = QLabel("")
         self.status_lbl.setStyleSheet("color: #ef4444; font-size: 12px;")
 
-        login_btn = QPushButton("Access Dashboard")
-        login_btn.clicked.connect(self.login)
-        login_btn.setStyleSheet("background-color: #2563eb; color: white; border-radius: 6px; padding: 15px; font-weight: bold;")
+        self.login_btn = QPushButton("Access Dashboard")
+        self.login_btn.clicked.connect(self.login)
+        self.login_btn.setStyleSheet("background-color: #2563eb; color: white; border-radius: 6px; padding: 15px; font-weight: bold;")
 
         login_layout.addWidget(title)
         login_layout.addWidget(self.username_input)
         login_layout.addWidget(self.password_input)
         login_layout.addWidget(self.status_lbl)
-        login_layout.addWidget(login_btn)
+        login_layout.addWidget(self.login_btn)
         
         self.main_layout.addWidget(self.brand_panel)
         self.main_layout.addWidget(self.login_panel)
@@ -91,34 +97,54 @@ class LoginDialog(QDialog):
             self.status_lbl.setText("Fields cannot be empty")
             return
 
-        try:
-            response = requests.post(
-                self.api_url, 
-                json={"username": username, "password": password}, 
-                timeout=5
-            )
-            
-            if response.status_code == 200:
-                self.user_data = response.json()
-                self.accept()
-            else:
-                self.status_lbl.setText("Invalid username or password")
-        except requests.exceptions.ConnectionError:
-            self.status_lbl.setText("Backend server is offline")
-        except Exception as e:
-            self.status_lbl.setText(f"Error: {str(e)}")
+        # The request runs on the client's pool; the dialog stays responsive meanwhile.
+        self.login_btn.setEnabled(False)
+        self.status_lbl.setText("")
+        call = self.client.login(username, password)
+        call.signals.finished.connect(self.logged_in)
+        call.signals.failed.connect(lambda message: self.login_failed(message, username, password))
+
+    def logged_in(self, user_data):
+        self.user_data = user_data
+        self.accept()
+
+    def login_failed(self, message, username=None, password=None):
+        if message == OFFLINE and username:
+            # Same user as last time: open their cached dashboard, read-only.
+            call = self.client.login_offline(username, password)
+            call.signals.finished.connect(self.logged_in)
+            call.signals.failed.connect(self.login_failed)
+            return
+        self.login_btn.setEnabled(True)
+        self.status_lbl.setText(message)
 
 
 class DesktopDashboard(QMainWindow):
-    def __init__(self, user_data):
+    def __init__(self, user_data, client):
         super().__init__()
         self.user_data = user_data
         self.setWindowTitle("V.I.S.T.A. Desktop Pro")
         self.resize(1400, 800)
-        self.api_url = 'http://127.0.0.1:8000/api/upload/'
-        self.history_url = 'http://127.0.0.1:8000/api/history/'
+        self.client = client
+        self.active_call = None  # The upload or job being followed, if any
+        self.sync_call = None
+        self.sync_again = False
+        self.offline = False
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.timeout.connect(self.load_history)
         self.init_ui()
+        # Draw what the last session cached straight away; the sync catches up after.
+        cached = self.client.cache.history()
+        self.display_history(cached)
+        if cached:
+            self.show_dataset(cached[0]['id'])
+        if user_data.get('offline'):
+            self.set_offline(True)
         self.load_history()
+        # Pushed changes replace polling the history; it reconnects by itself.
+        self.events_call = self.client.subscribe()
+        self.events_call.signals.event.connect(self.on_event)
 
     def init_ui(self):
         self.main_widget = QWidget()
@@ -140,6 +166,12 @@ class DesktopDashboard(QMainWindow):
         self.upload_btn.clicked.connect(self.upload_dataset)
         self.upload_btn.setStyleSheet("background-color: #2563eb; color: white; padding: 12px; border-radius: 8px; font-weight: bold;")
         sidebar_layout.addWidget(self.upload_btn)
+
+        # Summarise files on this machine and send only the results; for slow links.
+        self.local_check = QCheckBox("Aggregate locally")
+        self.local_check.setToolTip("Parse CSVs here and upload only their summaries")
+        self.local_check.setStyleSheet("color: #94a3b8; font-size: 11px; margin: 6px 4px;")
+        sidebar_layout.addWidget(self.local_check)
         
         # History Section in Sidebar
         history_title = QLabel("RECENT UPLOADS")
@@ -156,11 +188,30 @@ class DesktopDashboard(QMainWindow):
         self.history_layout.setContentsMargins(10, 10, 10, 10)
         self.history_layout.setSpacing(8)
         
+        # Only new uploads get a widget; the rest are kept across refreshes.
+        no_data_label = QLabel("No uploads yet")
+        no_data_label.setStyleSheet("color: #475569; font-size: 11px; font-style: italic; padding: 10px;")
+        no_data_label.setAlignment(Qt.AlignCenter)
+        self.history_list = WidgetList(self.history_layout, self.create_history_item, placeholder=no_data_label)
+        
         self.history_scroll.setWidget(self.history_widget)
         sidebar_layout.addWidget(self.history_scroll)
         
         sidebar_layout.addStretch()
 
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(False)
+        self.progress_bar.setFixedHeight(6)
+        self.progress_bar.setStyleSheet("QProgressBar { background-color: #1e293b; border: none; border-radius: 3px; } QProgressBar::chunk { background-color: #f59e0b; border-radius: 3px; }")
+        self.progress_bar.hide()
+        sidebar_layout.addWidget(self.progress_bar)
+
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel_upload)
+        self.cancel_btn.setStyleSheet("background-color: #1e293b; color: #e2e8f0; padding: 8px; border-radius: 8px;")
+        self.cancel_btn.hide()
+        sidebar_layout.addWidget(self.cancel_btn)
+
         self.status_lbl = QLabel("● System Online")
         self.status_lbl.setStyleSheet("color: #10b981; font-weight: bold; margin-bottom: 20px;")
         sidebar_layout.addWidget(self.status_lbl)
@@ -188,6 +239,10 @@ class DesktopDashboard(QMainWindow):
         self.figure, self.ax = plt.subplots(figsize=(6, 4))
         self.canvas = FigureCanvas(self.figure)
         workspace_layout.addWidget(self.canvas)
+        # Bars are made once and redrawn by blitting; see rendering.py.
+        self.renderer = Renderer(self.canvas)
+        self.ax.set_title("Current Asset Telemetry")
+        self.bars = self.renderer.bars(self.ax, ['Pressure', 'Temp', 'Flow'], ['#2563eb', '#10b981', '#f59e0b'])
 
         self.layout.addWidget(self.sidebar)
         self.layout.addWidget(self.workspace)
@@ -206,40 +261,55 @@ class DesktopDashboard(QMainWindow):
         return card
 
     def load_history(self):
-        """Fetch and display upload history"""
-        try:
-            headers = {"Authorization": f"Token {self.user_data['token']}"}
-            response = requests.get(self.history_url, headers=headers, timeout=5)
-            
-            if response.status_code == 200:
-                history_data = response.json()
-                self.display_history(history_data)
-            else:
-                print(f"Failed to load history: {response.status_code}")
-        except Exception as e:
-            print(f"Error loading history: {str(e)}")
+        """Sync the cached history with the server and display it"""
+        if self.sync_call is not None:
+            # One sync at a time; run another once this one ends.
+            self.sync_again = True
+            return
+        self.sync_call = self.client.sync()
+        self.sync_call.signals.finished.connect(self.history_loaded)
+        self.sync_call.signals.failed.connect(self.sync_failed)
+        self.sync_call.signals.done.connect(self.sync_done)
+
+    def on_event(self, name, data):
+        # 'open' after a reconnect: changes made while the stream was down were not pushed.
+        if name in ('open', 'resync') or name.startswith('dataset.'):
+            self.load_history()
+
+    def history_loaded(self, history_data):
+        self.set_offline(False)
+        if history_data is not None:  # None: unchanged since the last sync
+            self.display_history(history_data)
+
+    def sync_failed(self, message):
+        if message == OFFLINE:
+            self.set_offline(True)
+        elif self.active_call is None:
+            # Cleared by the next successful sync; an upload in progress keeps its status.
+            self.set_status(f"● History sync failed: {message}", "#ef4444")
+
+    def sync_done(self):
+        self.sync_call = None
+        if self.sync_again:
+            self.sync_again = False
+            self.load_history()
+        elif self.offline:
+            self.reconnect_timer.start(RECONNECT_INTERVAL * 1000)
+
+    def set_offline(self, offline):
+        """While offline the dashboard shows cached data only; uploads wait for the server."""
+        self.offline = offline
+        if self.active_call is None:
+            self.idle()
+
+    def show_dataset(self, dataset_id):
+        summary = self.client.cache.summary(dataset_id)
+        if summary is not None:
+            self.update_ui(summary)
 
     def display_history(self, history_data):
         """Display history items in the sidebar"""
-        # Clear existing history items
-        for i in reversed(range(self.history_layout.count())): 
-            widget = self.history_layout.itemAt(i).widget()
-            if widget:
-                widget.setParent(None)
-        
-        if not history_data:
-            no_data_label = QLabel("No uploads yet")
-            no_data_label.setStyleSheet("color: #475569; font-size: 11px; font-style: italic; padding: 10px;")
-            no_data_label.setAlignment(Qt.AlignCenter)
-            self.history_layout.addWidget(no_data_label)
-            return
-        
-        # Display each history item
-        for item in history_data[:5]:  # Show only last 5
-            history_item = self.create_history_item(item)
-            self.history_layout.addWidget(history_item)
-        
-        self.history_layout.addStretch()
+        self.history_list.update(history_data[:5])  # Show only last 5
 
     def create_history_item(self, item):
         """Create a widget for a single history item"""
@@ -259,6 +329,10 @@ class DesktopDashboard(QMainWindow):
             }
         """)
         
+        # Click to show its cached summary, online or not.
+        frame.setCursor(Qt.PointingHandCursor)
+        frame.mousePressEvent = lambda event, dataset_id=item.get('id'): self.show_dataset(dataset_id)
+
         layout = QVBoxLayout(frame)
         layout.setContentsMargins(8, 8, 8, 8)
         layout.setSpacing(4)
@@ -287,21 +361,111 @@ class DesktopDashboard(QMainWindow):
         return frame
 
     def upload_dataset(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select CSV", "", "CSV Files (*.csv)")
-        if file_path:
-            with open(file_path, 'rb') as f:
-                headers = {"Authorization": f"Token {self.user_data['token']}"}
-                try:
-                    response = requests.post(self.api_url, files={'file': f}, headers=headers, timeout=10)
-                    if response.status_code == 201:
-                        self.update_ui(response.json())
-                        self.load_history()  # Reload history after upload
-                        QMessageBox.information(self, "Success", "Dataset uploaded successfully")
-                    else:
-                        error_msg = response.json().get('error', f'Server returned {response.status_code}')
-                        QMessageBox.warning(self, "Error", error_msg)
-                except Exception as e:
-                    QMessageBox.critical(self, "Connection Error", str(e))
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select CSV(s)", "", "CSV Files (*.csv)")
+        if len(file_paths) > 1:
+            self.upload_batch(file_paths)
+        elif file_paths and self.local_check.isChecked():
+            call = self.follow(self.client.upload_summary(file_paths[0]), "● Summarising")
+            call.signals.finished.connect(self.job_finished)
+            call.signals.failed.connect(lambda message: self.call_failed("Upload Error", message))
+        elif file_paths:
+            # Resumable, chunked transfer on the client's pool; a retry after a failure
+            # or a cancel only sends what is missing.
+            call = self.follow(self.client.upload(file_paths[0]), "● Uploading")
+            call.signals.finished.connect(self.upload_finished)
+            call.signals.failed.connect(lambda message: self.call_failed("Connection Error", message))
+
+    def upload_finished(self, job):
+        if job.get('status') in ('succeeded', 'failed'):
+            # Identical content was processed before; the job is already done.
+            self.job_finished(job)
+        else:
+            # The server processes the file in the background; follow the job.
+            call = self.follow(self.client.watch_job(job['job_id']), "● Processing")
+            call.signals.finished.connect(self.job_finished)
+            call.signals.failed.connect(lambda message: self.call_failed("Error", message))
+
+    def upload_batch(self, file_paths):
+        """Send several CSVs in one batch request, where the server parses them in parallel, or summarise them here."""
+        if self.local_check.isChecked():
+            call = self.follow(self.client.upload_summaries(file_paths), f"● Summarising {len(file_paths)} files")
+        else:
+            call = self.follow(self.client.upload_batch(file_paths), f"● Sending {len(file_paths)} files")
+        call.signals.finished.connect(self.batch_finished)
+        call.signals.failed.connect(lambda message: self.call_failed("Connection Error", message))
+
+    def batch_finished(self, batch):
+        self.idle()
+        results = batch.get('results', [])
+        succeeded = [r for r in results if r['status'] == 'succeeded']
+        if succeeded:
+            self.update_ui(succeeded[-1]['result'])
+            if not self.client.events.connected:
+                self.load_history()
+
+        failed = [f"{r['file_name']}: {r['error']}" for r in results if r['status'] == 'failed']
+        message = f"{len(succeeded)} of {len(results)} files uploaded successfully"
+        if failed:
+            QMessageBox.warning(self, "Batch Upload", message + "\n\n" + "\n".join(failed))
+        else:
+            QMessageBox.information(self, "Success", message)
+
+    def follow(self, call, label):
+        """Show a running upload or job in the sidebar, with its progress and a cancel button."""
+        self.active_call = call
+        self.upload_btn.setEnabled(False)
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.cancel_btn.show()
+        self.set_status(f"{label} 0%", "#f59e0b")
+        call.signals.progress.connect(lambda percent: self.show_progress(label, percent))
+        call.signals.cancelled.connect(self.idle)
+        return call
+
+    def show_progress(self, label, percent):
+        self.progress_bar.setValue(percent)
+        self.set_status(f"{label} {percent}%", "#f59e0b")
+
+    def cancel_upload(self):
+        if self.active_call is not None:
+            self.cancel_btn.setEnabled(False)
+            self.set_status("● Cancelling", "#f59e0b")
+            self.active_call.cancel()
+
+    def call_failed(self, title, message):
+        self.idle()
+        if message == OFFLINE:
+            self.set_offline(True)
+            self.load_history()
+        QMessageBox.critical(self, title, message)
+
+    def idle(self):
+        self.active_call = None
+        self.upload_btn.setEnabled(not self.offline)
+        self.progress_bar.hide()
+        self.cancel_btn.hide()
+        self.cancel_btn.setEnabled(True)
+        if self.offline:
+            self.set_status("● Offline (read-only)", "#94a3b8")
+        else:
+            self.set_status("● System Online", "#10b981")
+
+    def job_finished(self, job):
+        self.idle()
+        self.finish_job(job)
+
+    def finish_job(self, job):
+        if job.get('status') == 'succeeded':
+            self.update_ui(job['result'])
+            if not self.client.events.connected:
+                self.load_history()  # Reload history after upload; a subscribed dashboard hears of it
+            QMessageBox.information(self, "Success", "Dataset uploaded successfully")
+        else:
+            QMessageBox.warning(self, "Error", job.get('error', 'Processing failed'))
+
+    def set_status(self, text, color):
+        self.status_lbl.setText(text)
+        self.status_lbl.setStyleSheet(f"color: {color}; font-weight: bold; margin-bottom: 20px;")
 
     def update_ui(self, data):
         try:
@@ -314,23 +478,26 @@ class DesktopDashboard(QMainWindow):
             self.pressure_card.findChild(QLabel, "value_label").setText(f"{avg_pressure} PSI")
             self.temp_card.findChild(QLabel, "value_label").setText(f"{avg_temp} °C")
             
-            self.ax.clear()
-            self.ax.bar(['Pressure', 'Temp', 'Flow'], 
-                        [avg_pressure if isinstance(avg_pressure, (int, float)) else 0, 
-                         avg_temp if isinstance(avg_temp, (int, float)) else 0, 
-                         avg_flowrate if isinstance(avg_flowrate, (int, float)) else 0], 
-                        color=['#2563eb', '#10b981', '#f59e0b'])
-            self.ax.set_title("Current Asset Telemetry")
-            self.figure.tight_layout()
-            self.canvas.draw()
+            self.renderer.update(self.bars, [
+                avg_pressure if isinstance(avg_pressure, (int, float)) else 0,
+                avg_temp if isinstance(avg_temp, (int, float)) else 0,
+                avg_flowrate if isinstance(avg_flowrate, (int, float)) else 0,
+            ])
         except Exception as e:
             QMessageBox.critical(self, "Data Error", f"Failed to update UI: {str(e)}")
 
+    def closeEvent(self, event):
+        # Stop transfers rather than leave them running behind a closed window.
+        self.reconnect_timer.stop()
+        self.client.shutdown()
+        super().closeEvent(event)
+
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    login = LoginDialog()
+    client = ApiClient()
+    login = LoginDialog(client)
     if login.exec_() == QDialog.Accepted:
-        dash = DesktopDashboard(login.user_data)
+        dash = DesktopDashboard(login.user_data, client)
         dash.show()
         sys.exit(app.exec_())
\ No newline at end of file
@@ -0,0 +1,236 @@
+"""
+Drawing for the desktop dashboard that keeps up with frequent updates.
+
+Artists are made once and changed in place. Updates arriving within one frame
+are merged into a single redraw, and that redraw blits only the changing
+artists over a cached background; the whole figure is drawn again only when
+an axis has to grow or the canvas is resized. Long series are reduced to the
+first, lowest, highest and last point of each pixel column before Matplotlib
+sees them, which draws the same line.
+"""
+import numpy as np
+from PyQt5.QtCore import QObject, QTimer
+
+# Shortest time between two redraws; updates in between are merged.
+FRAME_MS = 16
+# Headroom added when data outgrows an axis, so a growing series does not
+# force a full redraw on every frame.
+GROWTH = 0.25
+# Bars rescale down once they fill less than this share of their axis;
+# apart from GROWTH, so values moving about a level do not flip the scale.
+SHRINK_BELOW = 0.4
+
+
+def downsample(x, y, columns):
+    """
+    At most about 4 * columns points of the series (x, y), x sorted, that
+    draw like the whole series at `columns` pixels wide: per column, the
+    first, lowest, highest and last point (M4).
+    """
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    n = len(y)
+    columns = max(int(columns), 1)
+    if n <= 4 * columns:
+        return x, y
+    size = -(-n // columns)
+    full = n // size * size
+    starts = np.arange(0, full, size)
+    blocks = y[:full].reshape(-1, size)
+    keep = [starts, starts + size - 1, starts + blocks.argmin(axis=1), starts + blocks.argmax(axis=1)]
+    if full < n:
+        tail = y[full:]
+        keep.append(np.array([full, n - 1, full + tail.argmin(), full + tail.argmax()]))
+    keep = np.unique(np.concatenate(keep))
+    return x[keep], y[keep]
+
+
+class Bars:
+    """A bar group whose heights change in place; see Renderer.bars()."""
+
+    def __init__(self, ax, labels, colors):
+        self.ax = ax
+        self.patches = list(ax.bar(labels, [0] * len(labels), color=colors))
+        self.values = None
+
+    @property
+    def artists(self):
+        return self.patches
+
+    def apply(self, heights):
+        for patch, height in zip(self.patches, heights):
+            patch.set_height(height)
+        return _fit(self.ax, 'y', min(0, *heights), max(0, *heights), shrink=True)
+
+
+class Line:
+    """A line whose data changes in place, downsampled to the axes' width; see Renderer.line()."""
+
+    def __init__(self, ax, **style):
+        self.ax = ax
+        (self.line,) = ax.plot([], [], **style)
+        self.values = None
+
+    @property
+    def artists(self):
+        return [self.line]
+
+    def apply(self, series):
+        x, y = series
+        if not len(x):
+            self.line.set_data([], [])
+            return False
+        x, y = downsample(x, y, self.ax.bbox.width)
+        self.line.set_data(x, y)
+        grew = _fit(self.ax, 'x', x[0], x[-1])
+        finite = y[np.isfinite(y)]
+        if len(finite):
+            grew |= _fit(self.ax, 'y', finite.min(), finite.max())
+        return grew
+
+
+def _fit(ax, axis, low, high, shrink=False):
+    """
+    Widen one axis, with headroom, when [low, high] leaves it; with shrink,
+    also narrow it when the data fills less than SHRINK_BELOW. True if it changed.
+    """
+    get, set_ = (ax.get_ylim, ax.set_ylim) if axis == 'y' else (ax.get_xlim, ax.set_xlim)
+    current_low, current_high = get()
+    inside = current_low <= low and high <= current_high
+    if inside and not (shrink and high - low < SHRINK_BELOW * (current_high - current_low)):
+        return False
+    span = (high - low) or abs(high) or 1
+    if inside or low < current_low:
+        # Zero stays put, so bars keep their baseline.
+        current_low = low - GROWTH * span if low else low
+    if inside or high > current_high:
+        current_high = high + GROWTH * span if high else high
+    set_(current_low, current_high)
+    return True
+
+
+class Renderer(QObject):
+    """
+    Keeps one Matplotlib canvas up to date. Make artists with bars() and
+    line(), then hand them new values with update() as often as they come;
+    at most one redraw per FRAME_MS follows. `frames`, `full_draws` and
+    `updates` count what it has done.
+    """
+
+    def __init__(self, canvas, frame_ms=FRAME_MS, parent=None):
+        super().__init__(parent)
+        self.canvas = canvas
+        self.figure = canvas.figure
+        # Tight layout only runs on full draws, never per frame.
+        self.figure.set_layout_engine('tight')
+        self._groups = []
+        self._background = None
+        self._dirty = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(frame_ms)
+        self._timer.timeout.connect(self.flush)
+        self.frames = self.full_draws = self.updates = 0
+        canvas.mpl_connect('draw_event', self._on_draw)
+
+    def bars(self, ax, labels, colors=None):
+        return self._add(Bars(ax, labels, colors))
+
+    def line(self, ax, **style):
+        return self._add(Line(ax, **style))
+
+    def update(self, group, values):
+        """New values for a group: heights for bars, (x, y) for a line. Only the latest is drawn."""
+        group.values = values
+        self.updates += 1
+        self._dirty = True
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self):
+        """Draw pending updates now."""
+        self._timer.stop()
+        if not self._dirty:
+            return
+        self._dirty = False
+        grew = False
+        for group in self._groups:
+            if group.values is not None:
+                grew |= group.apply(group.values)
+                group.values = None
+        self.frames += 1
+        if grew or self._background is None or not self.canvas.isVisible():
+            # Ticks change with the limits; the background has to be redrawn.
+            self._background = None
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self._background)
+        self._draw_artists()
+        self.canvas.blit(self.figure.bbox)
+
+    def _add(self, group):
+        for artist in group.artists:
+            # Left out of full draws; drawn over the cached background instead.
+            artist.set_animated(True)
+        self._groups.append(group)
+        self._background = None
+        return group
+
+    def _draw_artists(self):
+        for group in self._groups:
+            for artist in group.artists:
+                group.ax.draw_artist(artist)
+
+    def _on_draw(self, event):
+        # Every full draw, also on resize, refreshes the cached background.
+        self.full_draws += 1
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_artists()
+
+
+class WidgetList:
+    """
+    Keeps the widgets in a box layout in step with a list of items, by key:
+    widgets are made only for new items and removed only for items that are
+    gone, instead of rebuilding the whole list on every refresh. `placeholder`
+    is shown while the list is empty.
+    """
+
+    def __init__(self, layout, make_widget, key=lambda item: item['id'], placeholder=None):
+        self.layout = layout
+        self.make_widget = make_widget
+        self.key = key
+        self.placeholder = placeholder
+        self._widgets = {}  # key -> (item, widget)
+        if placeholder is not None:
+            layout.addWidget(placeholder)
+        layout.addStretch()
+
+    def update(self, items):
+        """Show `items` in order; returns the number of widgets made."""
+        made = 0
+        wanted = {self.key(item): item for item in items}
+        for key in [key for key in self._widgets if key not in wanted]:
+            self._remove(key)
+
+        for position, (key, item) in enumerate(wanted.items()):
+            entry = self._widgets.get(key)
+            if entry is not None and entry[0] != item:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                entry = self._widgets[key] = (item, self.make_widget(item))
+                made += 1
+            widget = entry[1]
+            if self.layout.indexOf(widget) != position:
+                self.layout.removeWidget(widget)
+                self.layout.insertWidget(position, widget)
+
+        if self.placeholder is not None:
+            self.placeholder.setVisible(not self._widgets)
+        return made
+
+    def _remove(self, key):
+        _, widget = self._widgets.pop(key)
+        self.layout.removeWidget(widget)
+        widget.setParent(None)
+        widget.deleteLater()
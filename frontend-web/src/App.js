@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { Bar } from 'react-chartjs-2';
 import { Chart as ChartJS, CategoryScale, LinearScale, BarElement, Title, Tooltip, Legend } from 'chart.js';
@@ -7,9 +7,94 @@ ChartJS.register(CategoryScale, LinearScale, BarElement, Title, Tooltip, Legend)
 
 const API_BASE = 'http://127.0.0.1:8000/api';
 
+// The parts of an upload's summary the dashboard shows; the server leaves out the
+// rest, the full distribution above all. Answers stay JSON rather than MessagePack:
+// the browser always gets them compressed, and compressed MessagePack is no smaller
+// (see `manage.py bench_payloads`), so a decoder would ship for nothing.
+const RESULT_FIELDS = 'total_count,averages,raw_data';
+
 
 axios.defaults.headers.post['Content-Type'] = 'application/json';
 
+// The server replaces an ageing token on its next use and sends the new key in
+// X-Auth-Token; the old one only lasts a minute more. Requests read the token
+// from storage as they go out, so they pick the new one up.
+const keepRotatedToken = (rotated) => {
+  if (rotated && localStorage.getItem('v_auth')) localStorage.setItem('v_auth', rotated);
+};
+axios.interceptors.response.use(response => {
+  keepRotatedToken(response.headers['x-auth-token']);
+  return response;
+});
+
+// Reads the server-sent events of /api/async/events/ (served under ASGI only) and
+// reconnects with backoff, resuming from the last event id. EventSource cannot send
+// the token header, hence fetch. onEvent(name, data) also gets 'open' on every
+// (re)connect, 'close' when the stream drops and 'unavailable' when the server has
+// none. getToken() is asked on every (re)connect. Returns a function that closes
+// the stream.
+const subscribeEvents = (getToken, onEvent) => {
+  const controller = new AbortController();
+  let lastEventId = null;
+  let delay = 1000;
+
+  const read = async () => {
+    const headers = { 'Authorization': `Token ${getToken()}`, 'Accept': 'text/event-stream' };
+    if (lastEventId) headers['Last-Event-ID'] = lastEventId;
+    const response = await fetch(`${API_BASE}/async/events/`, { headers, cache: 'no-store', signal: controller.signal });
+    if (response.status === 404 || response.status === 501) return false;
+    if (!response.ok) throw new Error(`Event stream returned ${response.status}`);
+    keepRotatedToken(response.headers.get('X-Auth-Token'));
+    onEvent('open', null);
+    delay = 1000;
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let watchdog;
+    let buffer = '';
+    while (true) {
+      // The server sends a heartbeat every 15s; a silent stream is a dead one.
+      clearTimeout(watchdog);
+      watchdog = setTimeout(() => reader.cancel(), 45000);
+      const { value, done } = await reader.read();
+      if (done) return true;
+      buffer += value;
+      let end;
+      while ((end = buffer.indexOf('\n\n')) >= 0) {
+        let name = 'message';
+        const data = [];
+        for (const line of buffer.slice(0, end).split('\n')) {
+          const colon = line.indexOf(':');
+          if (colon <= 0) continue;  // Heartbeat comments
+          const value = line.slice(colon + 1).replace(/^ /, '');
+          const field = line.slice(0, colon);
+          if (field === 'id') lastEventId = value;
+          else if (field === 'event') name = value;
+          else if (field === 'data') data.push(value);
+        }
+        buffer = buffer.slice(end + 2);
+        if (data.length) onEvent(name, JSON.parse(data.join('\n')));
+      }
+    }
+  };
+
+  (async () => {
+    while (!controller.signal.aborted) {
+      try {
+        if (await read() === false) {
+          onEvent('unavailable', null);
+          return;
+        }
+      } catch (err) {
+        if (controller.signal.aborted) return;
+      }
+      onEvent('close', null);
+      await new Promise(resolve => setTimeout(resolve, delay));
+      delay = Math.min(delay * 2, 60000);
+    }
+  })();
+  return () => controller.abort();
+};
+
 function App() {
   const [isAuthenticated, setIsAuthenticated] = useState(!!localStorage.getItem('v_auth'));
   const [credentials, setCredentials] = useState({ username: '', password: '' });
@@ -17,6 +102,11 @@ function App() {
   const [loading, setLoading] = useState(false);
   const [history, setHistory] = useState([]);
   const [error, setError] = useState('');
+  const [progress, setProgress] = useState(0);
+  // While the event stream is open, history and job updates are pushed instead of polled.
+  const streamLive = useRef(false);
+  const jobStates = useRef(new Map());  // job id -> latest job.progress or job.finished data
+  const jobWaiters = useRef(new Set());
 
   const fetchHistory = useCallback(async (authOverride) => {
     const token = authOverride || localStorage.getItem('v_auth');
@@ -41,6 +131,28 @@ function App() {
     }
   }, [isAuthenticated, fetchHistory]);
 
+  useEffect(() => {
+    if (!isAuthenticated) return undefined;
+    const close = subscribeEvents(() => localStorage.getItem('v_auth'), (name, data) => {
+      if (name === 'open') streamLive.current = true;
+      if (name === 'close' || name === 'unavailable') {
+        streamLive.current = false;
+        jobWaiters.current.forEach(wake => wake(true));
+      }
+      if (name.startsWith('job.')) {
+        jobStates.current.set(data.job_id, data);
+        if (jobStates.current.size > 256) jobStates.current.delete(jobStates.current.keys().next().value);
+        jobWaiters.current.forEach(wake => wake());
+      }
+      // 'open' after a reconnect: changes made while the stream was down were not pushed.
+      if (name === 'open' || name === 'resync' || name.startsWith('dataset.')) fetchHistory();
+    });
+    return () => {
+      close();
+      streamLive.current = false;
+    };
+  }, [isAuthenticated, fetchHistory]);
+
   const handleLogin = (e) => {
     e.preventDefault();
     setError('');
@@ -89,6 +201,48 @@ function App() {
     setError('');
   };
 
+  // The job's pushed state once it has finished or moved past `progress`; null
+  // after timeoutMs or when the stream drops.
+  const nextJobState = (jobId, progress, timeoutMs) => new Promise(resolve => {
+    let timer;
+    const wake = (dropped) => {
+      const state = jobStates.current.get(jobId);
+      const moved = state && (state.status || state.progress > progress);
+      if (!moved && !dropped) return false;
+      clearTimeout(timer);
+      jobWaiters.current.delete(wake);
+      resolve(moved ? state : null);
+      return true;
+    };
+    timer = setTimeout(() => wake(true), timeoutMs);
+    if (!wake()) jobWaiters.current.add(wake);
+  });
+
+  // Uploads are processed in the background; follow the job until it finishes, through
+  // its pushed events while the stream is open and long polls otherwise.
+  // Content the server has seen before comes back already finished.
+  const waitForJob = async (job) => {
+    while (true) {
+      if (job.status === 'succeeded') return job.result;
+      if (job.status === 'failed') throw new Error(job.error || 'Processing failed');
+      setProgress(job.progress);
+      const pushed = streamLive.current;
+      if (pushed) {
+        // Events for jobs processed elsewhere never come; the job is read again after 20s without one.
+        const state = await nextJobState(job.job_id, job.progress, 20000);
+        if (state && !state.status) {
+          job = { ...job, progress: state.progress };
+          continue;
+        }
+      }
+      const response = await axios.get(`${API_BASE}/async/jobs/${job.job_id}/`, {
+        headers: { 'Authorization': `Token ${localStorage.getItem('v_auth')}` },
+        params: { wait: pushed ? 0 : 20, progress: job.progress, fields: RESULT_FIELDS }
+      });
+      job = response.data;
+    }
+  };
+
   const handleUpload = async (e) => {
     const file = e.target.files[0];
     if (!file) return;
@@ -104,25 +258,29 @@ function App() {
     formData.append('file', file);
 
     setLoading(true);
+    setProgress(0);
     setError('');
     try {
       const response = await axios.post(`${API_BASE}/upload/`, formData, {
         headers: { 
           'Authorization': `Token ${token}`,
           'Content-Type': 'multipart/form-data'
-        }
+        },
+        params: { fields: RESULT_FIELDS }
       });
       
-      if (response.data) {
-        setData(response.data);
-        fetchHistory();
+      const result = await waitForJob(response.data);
+      if (result) {
+        setData(result);
+        // A live stream brings the new dataset's event, and the history with it.
+        if (!streamLive.current) fetchHistory();
       }
     } catch (error) {
       if (error.response?.status === 401) {
         setError('Session expired. Please login again.');
         handleLogout();
       } else {
-        setError(error.response?.data?.error || 'Upload failed. Verify CSV format.');
+        setError(error.response?.data?.error || error.message || 'Upload failed. Verify CSV format.');
       }
       console.error('Upload error:', error);
     } finally {
@@ -233,7 +391,7 @@ function App() {
             📄 EXPORT PDF
           </button>
           <label className="cursor-pointer bg-blue-600 hover:bg-blue-500 transition-all px-8 py-3 rounded-xl font-bold text-white text-xs shadow-lg shadow-blue-900/20">
-            {loading ? "ANALYZING..." : "UPLOAD CSV"}
+            {loading ? `ANALYZING... ${progress}%` : "UPLOAD CSV"}
             <input type="file" className="hidden" onChange={handleUpload} accept=".csv" disabled={loading} />
           </label>
           <button onClick={handleLogout} className="text-slate-500 hover:text-red-400 text-xs font-bold transition-colors">LOGOUT</button>
@@ -13,4 +13,6 @@ export const uploadCSV = (file) => {
     });
 };
 
-export const fetchHistory = () => API.get('history/');
\ No newline at end of file
+export const fetchHistory = () => API.get('history/');
+
+export const fetchJob = (jobId, wait = 0, progress = 0) => API.get(`async/jobs/${jobId}/`, { params: { wait, progress } });
\ No newline at end of file